@@ -0,0 +1,147 @@
+"""
+Benchmark of GIF encoding: the old single-filter palette against a sampled palette.
+
+The old command ran ``split; palettegen; paletteuse`` over the whole input, so
+FFmpeg held every frame in memory until the palette was ready. VideoEncoder now
+makes the palette from a sample of the frames first and then encodes in one
+streaming pass. For each frame count this writes synthetic frames to a
+temporary directory, runs both pipelines and reports the wall time and the peak
+RSS of the FFmpeg processes.
+
+The stream pipeline sends the same frames as Images to create_video_from_stream,
+which saves them as PNG files itself and encodes them when the stream is
+finished; its time includes drawing and saving the frames. The disk column is
+the size of the frame files when encoding starts, which is the most the frames
+of each pipeline take up.
+
+Usage: python -m benchmarks.bench_gif_encoding [--frames 1000 10000] [--resolution 640x360]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from src.video_encoder import VideoEncoder
+
+# The GIF filter VideoEncoder used before palettes were sampled.
+LEGACY_GIF_FILTER = '[0:v] split [a][b];[a] palettegen [p];[b][p] paletteuse'
+
+
+def draw_frames(frames, width, height):
+    """Yields frames that look like a growing listing of code, each a new Image."""
+    image = Image.new('RGB', (width, height), color=(20, 22, 24))
+    draw = ImageDraw.Draw(image)
+    line_height = 12
+    lines_per_frame = max(1, height // line_height)
+    for i in range(frames):
+        y = (i % lines_per_frame) * line_height
+        if y == 0:
+            draw.rectangle([0, 0, width, height], fill=(20, 22, 24))
+        draw.text((8, y), f"{i:06d}  def frame_{i}(self): return self.value + {i}", fill=(255, 255, 255))
+        yield image.copy()
+
+
+def write_frames(frame_dir, frames, width, height):
+    """Writes the frames of draw_frames, returning their paths."""
+    paths = []
+    for i, image in enumerate(draw_frames(frames, width, height)):
+        path = os.path.join(frame_dir, f"frame_{i:06d}.png")
+        image.save(path, compress_level=1)
+        paths.append(path)
+    return paths
+
+
+def directory_size(path):
+    """Returns the size of the files in a directory in MB."""
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file()) / (1024 * 1024)
+
+
+def run_measured(command):
+    """Runs an FFmpeg command, returning its wall time in seconds and its peak RSS in MB."""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4 reports the resource usage of this process alone
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg failed: {' '.join(command)}")
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def run_legacy(encoder, list_filepath):
+    """Encodes with the old filter, returning (seconds, peak RSS in MB)."""
+    command = ['ffmpeg', '-y'] + encoder._build_input_args(list_filepath) + \
+        ['-filter_complex', LEGACY_GIF_FILTER, encoder.output_path]
+    return run_measured(command)
+
+
+def run_sampled(encoder, list_filepath, frame_paths, work_dir):
+    """Encodes with a sampled palette like VideoEncoder does, returning (seconds, peak RSS in MB)."""
+    commands = []
+    # Record the palette command instead of running it, so that both passes are measured alike
+    encoder._run_ffmpeg = commands.append
+    palette_path = encoder._make_gif_palette(frame_paths, work_dir)
+    palette_time, palette_rss = run_measured(commands[0])
+    encode_time, encode_rss = run_measured(encoder._build_ffmpeg_command(list_filepath, palette_path=palette_path))
+    return palette_time + encode_time, max(palette_rss, encode_rss)
+
+
+def run_stream(output_path, frame_rate, frames, width, height):
+    """
+    Streams frames into a VideoEncoder, returning (seconds, peak RSS in MB, peak disk use in MB).
+    """
+    encoder = VideoEncoder(output_path, frame_rate=frame_rate, format='gif')
+    runs, disk = [], []
+    def run_ffmpeg(command):
+        if not disk:
+            # Every frame is saved by the time the first FFmpeg process starts
+            disk.append(directory_size(encoder._gif_frame_dir))
+        runs.append(run_measured(command))
+    encoder._run_ffmpeg = run_ffmpeg
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        encoder.create_video_from_stream(draw_frames(frames, width, height), width, height)
+    return time.perf_counter() - start, max(rss for _, rss in runs), disk[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare GIF palette pipelines.")
+    parser.add_argument("--frames", type=int, nargs='+', default=[1000, 10000],
+                        help="Frame counts to benchmark. Default: 1000 10000")
+    parser.add_argument("--resolution", default="640x360", help="Frame size as WIDTHxHEIGHT. Default: 640x360")
+    parser.add_argument("--fps", type=int, default=10, help="Default: 10")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.lower().split('x'))
+
+    if not VideoEncoder.is_ffmpeg_installed():
+        parser.error("FFmpeg is not installed or not found in the system's PATH.")
+
+    print(f"{'frames':>8} {'pipeline':>8} {'time (s)':>10} {'peak RSS (MB)':>14} {'disk (MB)':>10}")
+    for frames in args.frames:
+        work_dir = tempfile.mkdtemp()
+        try:
+            frame_paths = write_frames(work_dir, frames, width, height)
+            frames_size = directory_size(work_dir)
+            encoder = VideoEncoder(os.path.join(work_dir, 'output.gif'), frame_rate=args.fps, format='gif')
+            list_filepath = encoder._write_frame_list(frame_paths, os.path.join(work_dir, 'frames.txt'))
+            results = {
+                'legacy': run_legacy(encoder, list_filepath) + (frames_size,),
+                'sampled': run_sampled(encoder, list_filepath, frame_paths, work_dir) + (frames_size,),
+                'stream': run_stream(os.path.join(work_dir, 'stream.gif'), args.fps, frames, width, height),
+            }
+            for pipeline, (elapsed, rss, disk) in results.items():
+                print(f"{frames:>8} {pipeline:>8} {elapsed:>10.2f} {rss:>14.1f} {disk:>10.1f}")
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of FrameRenderer's text backends.
+
+Renders the same synthetic frames with the 'draw' (ImageDraw.text) and 'atlas'
+(glyph atlas) backends and reports frames per second for each.
+
+Usage: python -m benchmarks.bench_text_backends [--frames N] [--resolution 1080p]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timezone
+
+from src.frame_renderer import FrameRenderer, TEXT_BACKENDS
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+
+def make_file_contents(seed, file_count=12, lines_per_file=40):
+    """Builds a deterministic file tree of code-like text."""
+    rng = random.Random(seed)
+    words = ['def', 'return', 'self', 'value', 'import', 'class', 'for', 'in', 'if', 'else',
+             'result', 'index', 'path', 'commit', 'frame', '=', '+', '(', ')', ':', '[]', '{}']
+    file_contents = {}
+    for i in range(file_count):
+        lines = []
+        for _ in range(lines_per_file):
+            indent = '    ' * rng.randint(0, 3)
+            lines.append(indent + ' '.join(rng.choice(words) for _ in range(rng.randint(3, 12))))
+        file_contents[f"src/module_{i:02d}.py"] = '\n'.join(lines)
+    return file_contents
+
+
+def run_backend(text_backend, resolution, frames, font_path, font_size):
+    """Renders frames with one backend and returns the frames per second."""
+    width, height = RESOLUTIONS[resolution]
+    renderer = FrameRenderer(width, height, font_path=font_path, font_size=font_size, text_backend=text_backend)
+    commit_info = {
+        'hash': 'a1b2c3d',
+        'author_name': 'Benchmark',
+        'author_email': 'bench@example.com',
+        'date': datetime(2024, 1, 1, tzinfo=timezone.utc),
+        'message': 'Benchmark commit',
+    }
+    trees = [make_file_contents(seed) for seed in range(frames)]
+
+    # Warm up font loading and, for the atlas, the glyph cache
+    renderer.render_frame(commit_info, trees[0])
+
+    start = time.perf_counter()
+    for file_contents in trees:
+        renderer.render_frame(commit_info, file_contents)
+    elapsed = time.perf_counter() - start
+    return frames / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FrameRenderer text backends.")
+    parser.add_argument("--frames", type=int, default=20, help="Frames to render per backend. Default: 20")
+    parser.add_argument("--resolution", default="1080p", choices=sorted(RESOLUTIONS), help="Default: 1080p")
+    parser.add_argument("--font-path", default=None, help="Path to a .ttf font file. Default: Pillow's default font")
+    parser.add_argument("--font-size", type=int, default=15, help="Default: 15")
+    args = parser.parse_args()
+
+    results = {}
+    for text_backend in TEXT_BACKENDS:
+        results[text_backend] = run_backend(text_backend, args.resolution, args.frames, args.font_path, args.font_size)
+        print(f"{text_backend:>6}: {results[text_backend]:8.2f} frames/s")
+    print(f"speedup: {results['atlas'] / results['draw']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Benchmark suite of the time-lapse pipeline on a synthetic repository.
+
+Each scenario runs in its own process, so its peak RSS is not inflated by the
+scenarios before it. Results are written as JSON with the throughput, latency
+percentiles and peak RSS of every scenario. With --compare, the results are
+checked against a saved baseline and regressions beyond a threshold make the
+command exit with status 1.
+
+Usage:
+    python -m benchmarks.run [--output results.json] [--scenarios history render_1080p ...]
+    python -m benchmarks.run --compare baseline.json [--threshold 0.15]
+    python -m benchmarks.run --compare baseline.json --current results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.synthetic_repo import SyntheticRepoSpec, generate_repo
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+RESULTS_VERSION = 1
+
+# Default relative change that counts as a regression.
+DEFAULT_THRESHOLD = 0.15
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of some values by the nearest-rank method."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(latencies, items, elapsed, unit):
+    """
+    Builds the result of a scenario.
+
+    :param latencies: Seconds taken by each measured operation.
+    :param items: The number of units processed in elapsed seconds.
+    :param elapsed: The total measured time in seconds.
+    :param unit: What the throughput counts, e.g. 'frames'.
+    """
+    result = {
+        'unit': unit,
+        'samples': len(latencies),
+        'throughput': items / elapsed if elapsed else None,
+        'latency_ms': {f'p{p}': percentile(latencies, p) * 1000 for p in PERCENTILES},
+    }
+    result['latency_ms']['max'] = max(latencies) * 1000
+    return result
+
+
+def _timed(operation, count):
+    """Runs an operation count times, returning the latencies and the total time."""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        operation_start = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - operation_start)
+    return latencies, time.perf_counter() - start
+
+
+def bench_history(repo_path, options):
+    """Reads the whole commit history, several times."""
+    from src.git_utils import GitRepo
+    git_repo = GitRepo(repo_path)
+    commits = len(git_repo.get_commit_history())
+    latencies, elapsed = _timed(lambda _: git_repo.get_commit_history(), options['repeats'])
+    return summarize(latencies, commits * len(latencies), elapsed, 'commits')
+
+
+def bench_file_tree(repo_path, options):
+    """Reads the full file tree of evenly spread commits, with a shared blob cache as in a render."""
+    from src.git_utils import GitRepo
+    git_repo = GitRepo(repo_path)
+    history = git_repo.get_commit_history(max_frames=options['frames'])
+    latencies, elapsed = _timed(lambda i: git_repo.get_file_tree_at_commit(history[i]['commit_obj']), len(history))
+    return summarize(latencies, len(latencies), elapsed, 'trees')
+
+
+def _bench_render(resolution):
+    """Builds a scenario that renders evenly spread commits at a resolution."""
+    def bench_render(repo_path, options):
+        from src.git_utils import GitRepo
+        from src.frame_renderer import FrameRenderer
+        git_repo = GitRepo(repo_path)
+        width, height = RESOLUTIONS[resolution]
+        renderer = FrameRenderer(width, height, text_backend=options['text_backend'])
+        history = git_repo.get_commit_history(max_frames=options['frames'])
+        trees = [git_repo.get_file_tree_at_commit(commit['commit_obj']) for commit in history]
+        # Warm up font loading
+        renderer.render_frame(history[0], trees[0])
+        latencies, elapsed = _timed(lambda i: renderer.render_frame(history[i], trees[i]), len(history))
+        return summarize(latencies, len(latencies), elapsed, 'frames')
+    bench_render.__doc__ = f"Renders evenly spread commits at {resolution}."
+    return bench_render
+
+
+def _bench_encode(output_format):
+    """Builds a scenario that renders frames once and encodes them, several times."""
+    def bench_encode(repo_path, options):
+        from src.git_utils import GitRepo
+        from src.frame_renderer import FrameRenderer
+        from src.video_encoder import VideoEncoder
+        if not VideoEncoder.is_ffmpeg_installed():
+            return {'skipped': "FFmpeg is not installed or not found in the system's PATH."}
+        git_repo = GitRepo(repo_path)
+        width, height = RESOLUTIONS['720p']
+        renderer = FrameRenderer(width, height, text_backend=options['text_backend'])
+        history = git_repo.get_commit_history(max_frames=options['frames'])
+        frames = [renderer.render_frame(commit, git_repo.get_file_tree_at_commit(commit['commit_obj']))
+                  for commit in history]
+        output_dir = tempfile.mkdtemp()
+        try:
+            encoder = VideoEncoder(os.path.join(output_dir, f'output.{output_format}'), frame_rate=10,
+                                   format=output_format)
+            latencies, elapsed = _timed(lambda _: encoder.create_video_from_stream(frames, width, height),
+                                        options['repeats'])
+        finally:
+            shutil.rmtree(output_dir)
+        return summarize(latencies, len(frames) * len(latencies), elapsed, 'frames')
+    bench_encode.__doc__ = f"Encodes pre-rendered 720p frames to {output_format}."
+    return bench_encode
+
+
+SCENARIOS = {
+    'history': bench_history,
+    'file_tree': bench_file_tree,
+    'render_720p': _bench_render('720p'),
+    'render_1080p': _bench_render('1080p'),
+    'render_4k': _bench_render('4k'),
+    'encode_mp4': _bench_encode('mp4'),
+    'encode_gif': _bench_encode('gif'),
+}
+
+
+def _run_scenario(name, repo_path, options):
+    """Runs a scenario in a worker process and adds its peak RSS, including FFmpeg's."""
+    result = SCENARIOS[name](repo_path, options)
+    if 'skipped' not in result:
+        # ru_maxrss is in kilobytes on Linux
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        result['peak_rss_mb'] = max(own, children) / 1024
+    return result
+
+
+def run_suite(scenarios, spec, options, repo_path=None):
+    """
+    Runs scenarios on a synthetic repository.
+
+    :param scenarios: Names from SCENARIOS.
+    :param spec: The SyntheticRepoSpec of the repository.
+    :param options: Scenario options: frames, repeats and text_backend.
+    :param repo_path: An existing repository to use instead of generating one.
+    :return: The results dictionary.
+    """
+    work_dir = None
+    if repo_path is None:
+        work_dir = tempfile.mkdtemp()
+        repo_path = generate_repo(os.path.join(work_dir, 'repo'), spec)
+    # A fresh 'spawn' process per scenario keeps peak RSS figures independent
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        for name in scenarios:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[name] = executor.submit(_run_scenario, name, repo_path, options).result()
+            _print_result(name, results[name])
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir)
+    return {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'repo': spec.to_dict() if work_dir is not None else {'path': repo_path},
+        'options': options,
+        'scenarios': results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares results with a baseline.
+
+    A scenario regresses when its throughput drops, or its p50 or p90 latency or
+    peak RSS grows, by more than threshold (relative). Scenarios missing from
+    either side or skipped are not compared.
+
+    :return: A list of (scenario, metric, baseline value, current value, relative change) of the regressions.
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None or 'skipped' in base or 'skipped' in result:
+            continue
+        checks = [('throughput', base.get('throughput'), result.get('throughput'), -1),
+                  ('latency_ms.p50', base['latency_ms']['p50'], result['latency_ms']['p50'], 1),
+                  ('latency_ms.p90', base['latency_ms']['p90'], result['latency_ms']['p90'], 1),
+                  ('peak_rss_mb', base.get('peak_rss_mb'), result.get('peak_rss_mb'), 1)]
+        for metric, old, new, direction in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > threshold:
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+
+def _print_result(name, result):
+    """Prints one line per scenario."""
+    if 'skipped' in result:
+        print(f"{name:>13}: skipped ({result['skipped']})")
+        return
+    latency = result['latency_ms']
+    print(f"{name:>13}: {result['throughput']:10.1f} {result['unit']}/s  "
+          f"p50 {latency['p50']:8.2f} ms  p90 {latency['p90']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+          f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the time-lapse pipeline on a synthetic repository.")
+    parser.add_argument("--scenarios", nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="Scenarios to run. Default: all")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", default=None, metavar="BASELINE",
+                        help="Compare the results with a baseline JSON file and exit with status 1 on a regression.")
+    parser.add_argument("--current", default=None, metavar="RESULTS",
+                        help="With --compare, compare this results file instead of running the suite.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative change that counts as a regression. Default: {DEFAULT_THRESHOLD}")
+    parser.add_argument("--repo", default=None, help="Benchmark an existing repository instead of a synthetic one.")
+    parser.add_argument("--commits", type=int, default=500, help="Commits of the synthetic repository. Default: 500")
+    parser.add_argument("--files", type=int, default=100, help="Files of the synthetic repository. Default: 100")
+    parser.add_argument("--file-size", type=int, default=2048, help="Approximate bytes per file. Default: 2048")
+    parser.add_argument("--binary-ratio", type=float, default=0.05, help="Share of binary files. Default: 0.05")
+    parser.add_argument("--merge-density", type=float, default=0.1,
+                        help="Share of commits that merge a topic branch. Default: 0.1")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    parser.add_argument("--frames", type=int, default=30, help="Commits rendered or read per scenario. Default: 30")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs of the whole-history and encoding scenarios. Default: 5")
+    parser.add_argument("--text-backend", default="atlas", choices=["draw", "atlas"], help="Default: atlas")
+    args = parser.parse_args()
+
+    if args.current is not None and args.compare is None:
+        parser.error("--current requires --compare.")
+
+    if args.current is not None:
+        with open(args.current, encoding='utf-8') as f:
+            results = json.load(f)
+    else:
+        spec = SyntheticRepoSpec(commits=args.commits, files=args.files, file_size=args.file_size,
+                                 binary_ratio=args.binary_ratio, merge_density=args.merge_density, seed=args.seed)
+        options = {'frames': args.frames, 'repeats': args.repeats, 'text_backend': args.text_backend}
+        results = run_suite(args.scenarios, spec, options, repo_path=args.repo)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        for name, metric, old, new, change in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Deterministic synthetic Git repositories for benchmarks.
+
+The history is written with a single ``git fast-import`` stream, so even large
+repositories are created in seconds. The same options always produce the same
+commit SHAs: contents come from a seeded random generator, and authors and
+dates are fixed.
+
+Usage: python -m benchmarks.synthetic_repo PATH [--commits N] [--files N] [--file-size BYTES]
+                                                 [--binary-ratio R] [--merge-density R] [--seed N]
+"""
+import argparse
+import os
+import random
+import subprocess
+
+# Commit times start here (2023-11-14) and advance by one hour per commit.
+BASE_TIMESTAMP = 1700000000
+COMMIT_INTERVAL = 3600
+
+AUTHORS = [
+    ('Ada Lovelace', 'ada@example.com'),
+    ('Alan Turing', 'alan@example.com'),
+    ('Grace Hopper', 'grace@example.com'),
+    ('Linus Torvalds', 'linus@example.com'),
+    ('Margaret Hamilton', 'margaret@example.com'),
+]
+
+_WORDS = ['def', 'return', 'self', 'value', 'import', 'class', 'for', 'in', 'if', 'else',
+          'result', 'index', 'path', 'commit', 'frame', '=', '+', '(', ')', ':', '[]', '{}']
+
+
+class SyntheticRepoSpec:
+    """The shape of a synthetic repository."""
+    def __init__(self, commits=200, files=50, file_size=2048, binary_ratio=0.05, merge_density=0.1,
+                 files_per_commit=3, seed=0):
+        """
+        Initializes the SyntheticRepoSpec object.
+
+        :param commits: The number of commits on the main branch.
+        :param files: The number of files in the final tree.
+        :param file_size: The approximate size of each file in bytes.
+        :param binary_ratio: The share of files with binary content (0 to 1).
+        :param merge_density: The share of main-branch commits that merge a one-commit topic branch (0 to 1).
+        :param files_per_commit: The most files a commit adds or changes.
+        :param seed: The seed of the content generator.
+        """
+        if commits < 1 or files < 1 or file_size < 1 or files_per_commit < 1:
+            raise ValueError("Commit count, file count, file size and files per commit must be positive.")
+        if not 0 <= binary_ratio <= 1 or not 0 <= merge_density <= 1:
+            raise ValueError("Binary ratio and merge density must be between 0 and 1.")
+        self.commits = commits
+        self.files = files
+        self.file_size = file_size
+        self.binary_ratio = binary_ratio
+        self.merge_density = merge_density
+        self.files_per_commit = files_per_commit
+        self.seed = seed
+
+    def to_dict(self):
+        """Returns the options as a dictionary, e.g. for benchmark results."""
+        return dict(vars(self))
+
+
+def generate_repo(path, spec):
+    """
+    Creates a synthetic repository. The directory must not exist or be empty.
+
+    Files are added over the first commits until spec.files exist; later commits
+    change some of them. The working tree is not checked out.
+
+    :param path: The directory to create the repository in.
+    :param spec: A SyntheticRepoSpec.
+    :return: The path of the repository.
+    """
+    os.makedirs(path, exist_ok=True)
+    subprocess.run(['git', 'init', '--quiet', path], check=True)
+    subprocess.run(['git', '-C', path, 'symbolic-ref', 'HEAD', 'refs/heads/main'], check=True)
+    process = subprocess.Popen(['git', '-C', path, 'fast-import', '--quiet', '--done'], stdin=subprocess.PIPE)
+    try:
+        for chunk in _fast_import_stream(spec):
+            process.stdin.write(chunk)
+        process.stdin.close()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    if process.wait() != 0:
+        raise RuntimeError("git fast-import failed to write the synthetic repository.")
+    return path
+
+
+def _fast_import_stream(spec):
+    """Yields the fast-import commands of a synthetic history as bytes."""
+    rng = random.Random(spec.seed)
+    binary_files = set(rng.sample(range(spec.files), round(spec.files * spec.binary_ratio)))
+    # New files are spread over the first commits, at most files_per_commit per commit
+    next_new_file = 0
+    mark = 0
+    main_tip = None
+
+    for i in range(spec.commits):
+        if main_tip is not None and rng.random() < spec.merge_density:
+            mark += 1
+            topic_mark = mark
+            yield from _commit('refs/heads/topic', topic_mark, i, f"Topic change {i}",
+                               _changes(rng, spec, binary_files, next_new_file, new_files=0), main_tip)
+            merge = topic_mark
+        else:
+            merge = None
+
+        new_files = min(spec.files - next_new_file, spec.files_per_commit)
+        changes = _changes(rng, spec, binary_files, next_new_file, new_files)
+        next_new_file += new_files
+        mark += 1
+        message = f"Merge topic into main at {i}" if merge is not None else f"Change {i}"
+        yield from _commit('refs/heads/main', mark, i, message, changes, main_tip, merge)
+        main_tip = mark
+    yield b'done\n'
+
+
+def _changes(rng, spec, binary_files, existing_files, new_files):
+    """Returns the (file index, content) pairs of one commit: new files first, then changed ones."""
+    changes = [(index, _content(rng, spec, index in binary_files))
+               for index in range(existing_files, existing_files + new_files)]
+    if existing_files and len(changes) < spec.files_per_commit:
+        count = rng.randint(1, min(existing_files, spec.files_per_commit - len(changes)))
+        changes.extend((index, _content(rng, spec, index in binary_files))
+                       for index in rng.sample(range(existing_files), count))
+    return changes
+
+
+def _content(rng, spec, binary):
+    """Builds about file_size bytes of code-like text, or of binary data with NUL bytes."""
+    if binary:
+        return b'\0' + rng.randbytes(spec.file_size - 1)
+    lines = []
+    size = 0
+    while size < spec.file_size:
+        line = '    ' * rng.randint(0, 3) + ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        size += len(line) + 1
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _file_path(index, binary):
+    """Returns the path of a file in the synthetic tree."""
+    extension = 'bin' if binary else 'py'
+    return f"src/package_{index % 10}/module_{index:05d}.{extension}"
+
+
+def _commit(ref, mark, index, message, changes, parent, merge=None):
+    """Yields the fast-import commands of one commit."""
+    name, email = AUTHORS[index % len(AUTHORS)]
+    timestamp = BASE_TIMESTAMP + index * COMMIT_INTERVAL
+    message = message.encode('utf-8')
+    yield f"commit {ref}\nmark :{mark}\n".encode('utf-8')
+    yield f"author {name} <{email}> {timestamp} +0000\n".encode('utf-8')
+    yield f"committer {name} <{email}> {timestamp} +0000\n".encode('utf-8')
+    yield f"data {len(message)}\n".encode('utf-8') + message + b'\n'
+    if parent is not None:
+        yield f"from :{parent}\n".encode('utf-8')
+    if merge is not None:
+        yield f"merge :{merge}\n".encode('utf-8')
+    for file_index, content in changes:
+        binary = content.startswith(b'\0')
+        yield f"M 100644 inline {_file_path(file_index, binary)}\ndata {len(content)}\n".encode('utf-8')
+        yield content + b'\n'
+    yield b'\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a deterministic synthetic Git repository.")
+    parser.add_argument("path", help="Directory to create the repository in.")
+    parser.add_argument("--commits", type=int, default=200, help="Default: 200")
+    parser.add_argument("--files", type=int, default=50, help="Default: 50")
+    parser.add_argument("--file-size", type=int, default=2048, help="Approximate bytes per file. Default: 2048")
+    parser.add_argument("--binary-ratio", type=float, default=0.05, help="Share of binary files. Default: 0.05")
+    parser.add_argument("--merge-density", type=float, default=0.1,
+                        help="Share of commits that merge a topic branch. Default: 0.1")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    args = parser.parse_args()
+    spec = SyntheticRepoSpec(commits=args.commits, files=args.files, file_size=args.file_size,
+                             binary_ratio=args.binary_ratio, merge_density=args.merge_density, seed=args.seed)
+    generate_repo(args.path, spec)
+    print(f"Created {args.path} with {spec.commits} commits.")
+
+
+if __name__ == "__main__":
+    main()
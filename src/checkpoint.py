@@ -0,0 +1,176 @@
+"""
+Checkpoints that let an interrupted time-lapse run continue where it stopped.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from src.video_encoder import HeldFrame
+
+# Bump when the layout of a work directory changes.
+MANIFEST_VERSION = 2
+
+MANIFEST_FILE = 'manifest.json'
+JOURNAL_FILE = 'frames.log'
+
+
+def default_work_dir(output_path):
+    """Returns the work directory used for an output file when none is given."""
+    return f"{output_path}.work"
+
+
+class RunCheckpoint:
+    """
+    A persistent work directory holding the frames and video segments of a run.
+
+    ``manifest.json`` records the settings that determine what a frame looks
+    like. ``frames.log`` gets one line per finished frame (index, commit SHA
+    and file name, or the base and header file names of a HeldFrame joined
+    by ``+``), appended and flushed as each frame is produced, so a crash
+    loses at most the frames being written. Encoded segments are kept in
+    ``segments/`` (see VideoEncoder.create_video_from_segments).
+
+    When resuming with the same settings, a frame is reused if its index still
+    maps to the same commit; from the first index that does not (e.g. after the
+    branch was rewritten) everything is rendered again. With other settings the
+    old frames are discarded.
+    """
+    def __init__(self, work_dir, settings, resume=False):
+        """
+        Initializes the RunCheckpoint object, creating or resetting the work directory.
+
+        :param work_dir: The directory to keep the run's files in.
+        :param settings: A JSON-serializable dictionary of everything besides the commit that determines a frame.
+        :param resume: If True, continue from the frames already recorded in the work directory.
+        """
+        self.work_dir = work_dir
+        self.frame_dir = os.path.join(work_dir, 'frames')
+        self.segment_dir = os.path.join(work_dir, 'segments')
+        self.settings_key = self.make_settings_key(settings)
+        self._frames = self._load() if resume else {}
+        self._diverged = False
+        self._resumed = 0
+        if not self._frames:
+            # Nothing to resume: leftovers of an earlier run are removed
+            for path in (self.frame_dir, self.segment_dir):
+                shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(self.frame_dir, exist_ok=True)
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._write_manifest()
+        self._journal = None
+        # Rewritten rather than appended to, which also drops a line cut off by a crash
+        self._rewrite_journal(sorted(self._frames.items()))
+
+    @staticmethod
+    def make_settings_key(settings):
+        """
+        Computes the key that tells whether a work directory's frames can be reused.
+
+        :param settings: A JSON-serializable dictionary.
+        :return: A hex digest string.
+        """
+        payload = json.dumps({'version': MANIFEST_VERSION, 'settings': settings}, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    @property
+    def resumable_frames(self):
+        """The number of frames recorded by earlier runs."""
+        return len(self._frames)
+
+    def resumed_frame(self, index, sha):
+        """
+        Returns the saved frame for an index if an earlier run finished it for the same commit.
+
+        Must be called in index order.
+
+        :param index: The index of the frame.
+        :param sha: The full SHA of the commit at that index.
+        :return: The path of the frame or a HeldFrame of paths, or None if it has to be rendered.
+        """
+        if self._diverged:
+            return None
+        entry = self._frames.get(index)
+        frame_paths = [os.path.join(self.frame_dir, name) for name in entry[1].split('+')] if entry is not None else []
+        if entry is None or entry[0] != sha or not all(os.path.exists(path) for path in frame_paths):
+            self._diverge(index)
+            return None
+        self._resumed += 1
+        return HeldFrame(*frame_paths) if len(frame_paths) == 2 else frame_paths[0]
+
+    def record(self, index, sha, frame):
+        """
+        Records that a frame is finished.
+
+        :param index: The index of the frame.
+        :param sha: The full SHA of the commit at that index.
+        :param frame: The path of the frame's file inside frame_dir, or a HeldFrame of paths there.
+                      Held frames name an earlier frame's file.
+        """
+        if index < self._resumed:
+            # Resumed frames are in the journal already
+            return
+        if isinstance(frame, HeldFrame):
+            name = f"{os.path.basename(frame.base)}+{os.path.basename(frame.header)}"
+        else:
+            name = os.path.basename(frame)
+        self._journal.write(f"{index} {sha} {name}\n")
+        self._journal.flush()
+
+    def close(self):
+        """Closes the journal, keeping the work directory for a later resume."""
+        if self._journal is not None and not self._journal.closed:
+            self._journal.close()
+
+    def remove(self):
+        """Closes the journal and deletes the work directory, e.g. after the video was written."""
+        self.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _diverge(self, index):
+        """Stops resuming at an index, dropping the recorded frames from there on."""
+        self._diverged = True
+        # Later entries may be held frames that point at files about to be overwritten
+        self._rewrite_journal(sorted((i, entry) for i, entry in self._frames.items() if i < index))
+
+    def _rewrite_journal(self, entries):
+        """Replaces the journal with some (index, (sha, file name)) entries and keeps it open for appending."""
+        self.close()
+        self._journal = open(os.path.join(self.work_dir, JOURNAL_FILE), 'w', encoding='utf-8')
+        self._journal.writelines(f"{i} {sha} {name}\n" for i, (sha, name) in entries)
+        self._journal.flush()
+
+    def _load(self):
+        """Reads the frames recorded in the work directory, or returns {} if they cannot be reused."""
+        try:
+            with open(os.path.join(self.work_dir, MANIFEST_FILE), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read the checkpoint in {self.work_dir}: {e}. Starting over.")
+            return {}
+        if manifest.get('settings_key') != self.settings_key:
+            print(f"Warning: The checkpoint in {self.work_dir} was made with other settings. Starting over.")
+            return {}
+
+        frames = {}
+        try:
+            with open(os.path.join(self.work_dir, JOURNAL_FILE), encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3 or not line.endswith('\n'):
+                        # The last line was cut off by a crash
+                        break
+                    frames[int(parts[0])] = (parts[1], parts[2])
+        except FileNotFoundError:
+            pass
+        return frames
+
+    def _write_manifest(self):
+        """Writes the manifest so that a crash never leaves a partial file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.work_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'settings_key': self.settings_key}, f)
+        os.replace(tmp_path, os.path.join(self.work_dir, MANIFEST_FILE))
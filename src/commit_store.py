@@ -0,0 +1,186 @@
+"""
+Compact, column-oriented storage of commit metadata for long histories.
+"""
+from array import array
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta, timezone
+
+import git
+
+# Keys of a commit record, in the order of the dictionaries built by GitRepo.
+COMMIT_KEYS = ('hash', 'sha', 'author_name', 'author_email', 'date', 'message', 'commit_obj')
+
+
+class CommitStore(Sequence):
+    """
+    The metadata of a sequence of commits, kept in flat columns instead of one dictionary per commit.
+
+    Each commit takes a binary SHA, an index into a table of distinct
+    (author name, author email) pairs, the commit time as epoch seconds and
+    UTC offset, and its message as UTF-8 bytes in one shared buffer. That is
+    a few dozen bytes plus the message, against well over a kilobyte for a
+    dictionary with a datetime, Python strings and a GitPython object.
+
+    Indexing returns a CommitRecord, a read-only dict-like view that builds
+    each value when it is looked up, so a store can stand in for a list of
+    commit dictionaries.
+    """
+    def __init__(self, repo=None):
+        """
+        Initializes an empty CommitStore.
+
+        :param repo: The git.Repo the commits belong to, used for the 'commit_obj'
+                     of records. Records have no 'commit_obj' if None.
+        """
+        self.repo = repo
+        self._sha_size = None
+        self._shas = bytearray()
+        self._author_ids = array('I')
+        self._authors = []  # (name, email) bytes pairs
+        self._author_index = {}
+        self._times = array('q')
+        self._utc_offsets = array('h')  # minutes
+        self._messages = bytearray()
+        self._message_ends = array('Q')
+
+    def append_fields(self, fields):
+        """
+        Adds a commit from the raw fields of ``git log`` (see GitRepo._stream_log_fields).
+
+        :param fields: A list of bytes: full SHA, author name, author email, ISO 8601 committer date and raw message.
+        """
+        sha, author_name, author_email, date, message = fields
+        binsha = bytes.fromhex(sha.strip().decode('ascii'))
+        if self._sha_size is None:
+            self._sha_size = len(binsha)
+        elif len(binsha) != self._sha_size:
+            raise ValueError(f"Invalid commit SHA: '{sha.strip().decode('ascii')}'.")
+        author = (author_name, author_email)
+        author_id = self._author_index.get(author)
+        if author_id is None:
+            author_id = self._author_index[author] = len(self._authors)
+            self._authors.append(author)
+        date = datetime.fromisoformat(date.decode('ascii'))
+
+        self._shas += binsha
+        self._author_ids.append(author_id)
+        self._times.append(int(date.timestamp()))
+        self._utc_offsets.append(int(date.utcoffset().total_seconds()) // 60)
+        self._messages += message.strip()
+        self._message_ends.append(len(self._messages))
+
+    def __len__(self):
+        return len(self._times)
+
+    def __getitem__(self, index):
+        """Returns the CommitRecord at an index. Negative indexes count from the end."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return CommitRecord(self, self._check_index(index))
+
+    def sha(self, index):
+        """Returns the full SHA of a commit as a hex string."""
+        index = self._check_index(index)
+        return self._binsha(index).hex()
+
+    def author(self, index):
+        """Returns the author name and email of a commit."""
+        name, email = self._authors[self._author_ids[self._check_index(index)]]
+        return name.decode('utf-8', errors='replace'), email.decode('utf-8', errors='replace')
+
+    def date(self, index):
+        """Returns the committer date of a commit as an aware datetime in the committer's time zone."""
+        index = self._check_index(index)
+        tz = timezone(timedelta(minutes=self._utc_offsets[index]))
+        return datetime.fromtimestamp(self._times[index], tz)
+
+    def message(self, index):
+        """Returns the message of a commit, without leading and trailing whitespace."""
+        index = self._check_index(index)
+        start = self._message_ends[index - 1] if index else 0
+        return self._messages[start:self._message_ends[index]].decode('utf-8', errors='replace')
+
+    def commit_obj(self, index):
+        """Returns a GitPython commit object, read from the object database only when used."""
+        if self.repo is None:
+            raise KeyError('commit_obj')
+        return git.Commit(self.repo, self._binsha(self._check_index(index)))
+
+    def raw_fields(self, index):
+        """
+        Returns a commit as the raw fields of ``git log`` that append_fields takes.
+
+        The message comes back stripped; everything else is unchanged.
+        """
+        index = self._check_index(index)
+        name, email = self._authors[self._author_ids[index]]
+        return [self.sha(index).encode('ascii'), name, email, self.date(index).isoformat().encode('ascii'),
+                self.message(index).encode('utf-8')]
+
+    @property
+    def nbytes(self):
+        """The approximate size of the columns and the author table in bytes."""
+        columns = (self._shas, self._author_ids, self._times, self._utc_offsets, self._messages, self._message_ends)
+        authors = sum(len(name) + len(email) for name, email in self._authors)
+        return sum(len(column) * getattr(column, 'itemsize', 1) for column in columns) + authors
+
+    def _binsha(self, index):
+        """Returns the binary SHA of a commit at a non-negative index."""
+        start = index * self._sha_size
+        return bytes(self._shas[start:start + self._sha_size])
+
+    def _check_index(self, index):
+        """Turns a negative index into a non-negative one, raising IndexError if it is out of range."""
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("Commit index out of range.")
+        return index
+
+
+class CommitRecord(Mapping):
+    """
+    A read-only view of one commit of a CommitStore, with the keys of a commit dictionary.
+
+    Values are built on every lookup; convert the record with dict() to keep them.
+    """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        """
+        Initializes the CommitRecord object.
+
+        :param store: The CommitStore holding the commit.
+        :param index: The non-negative index of the commit in the store.
+        """
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key):
+        store, index = self._store, self._index
+        if key == 'hash':
+            return store.sha(index)[:7]
+        if key == 'sha':
+            return store.sha(index)
+        if key == 'author_name':
+            return store.author(index)[0]
+        if key == 'author_email':
+            return store.author(index)[1]
+        if key == 'date':
+            return store.date(index)
+        if key == 'message':
+            return store.message(index)
+        if key == 'commit_obj':
+            return store.commit_obj(index)
+        raise KeyError(key)
+
+    def __iter__(self):
+        keys = COMMIT_KEYS if self._store.repo is not None else COMMIT_KEYS[:-1]
+        return iter(keys)
+
+    def __len__(self):
+        return len(COMMIT_KEYS) if self._store.repo is not None else len(COMMIT_KEYS) - 1
+
+    def __repr__(self):
+        return f"CommitRecord({self._store.sha(self._index)[:7]})"
@@ -0,0 +1,214 @@
+"""
+Persistent on-disk cache of rendered frames, keyed by commit SHA and render settings.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Bump when a change to FrameRenderer alters the pixels produced for the same settings.
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'git-chronoscope', 'frames')
+
+# Default size cap for the cache directory (2 GB).
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class FrameCache:
+    """
+    A directory of rendered PNG frames with a size cap and LRU eviction.
+
+    Frames are stored as ``<cache_dir>/<settings key>/<sha[:2]>/<sha>.png``. The
+    last access time of a frame is its file's modification time, so the LRU order
+    survives between runs.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        """
+        Initializes the FrameCache object, creating the cache directory if needed.
+
+        :param cache_dir: The directory to store frames in.
+        :param max_bytes: The size cap of the cache, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> size, least recently used first
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def settings_key(renderer_settings):
+        """
+        Computes the part of the cache key that depends on the render settings.
+
+        :param renderer_settings: The settings of a FrameRenderer (see FrameRenderer.settings).
+        :return: A hex digest string.
+        """
+        payload = json.dumps({'version': CACHE_VERSION, 'settings': renderer_settings}, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def path_for(self, sha, settings_key):
+        """
+        Returns the path where the frame for a commit and settings is stored.
+
+        :param sha: The full hex SHA of the commit.
+        :param settings_key: The key returned by settings_key().
+        """
+        return os.path.join(self.cache_dir, settings_key, sha[:2], f"{sha}.png")
+
+    def get(self, sha, settings_key):
+        """
+        Looks up a cached frame and marks it as recently used.
+
+        :param sha: The full hex SHA of the commit.
+        :param settings_key: The key returned by settings_key().
+        :return: The path of the cached PNG file, or None on a miss.
+        """
+        path = self.path_for(sha, settings_key)
+        with self._lock:
+            if path not in self._entries or not os.path.exists(path):
+                self._entries.pop(path, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, sha, settings_key, frame):
+        """
+        Stores a rendered frame.
+
+        :param sha: The full hex SHA of the commit.
+        :param settings_key: The key returned by settings_key().
+        :param frame: A Pillow Image.
+        :return: The path of the cached PNG file.
+        """
+        path = self.path_for(sha, settings_key)
+        save_frame_atomic(frame, path)
+        self.register(path)
+        return path
+
+    def put_file(self, sha, settings_key, source_path):
+        """
+        Stores an existing PNG file as the frame for a commit, linking it if possible.
+
+        :param sha: The full hex SHA of the commit.
+        :param settings_key: The key returned by settings_key().
+        :param source_path: The path of the PNG file.
+        :return: The path of the cached PNG file.
+        """
+        path = self.path_for(sha, settings_key)
+        if os.path.abspath(source_path) != os.path.abspath(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            link_or_copy(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        self.register(path)
+        return path
+
+    def register(self, path):
+        """
+        Adds a frame file written by another process to the index and enforces the size cap.
+
+        :param path: A path returned by path_for().
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            old_size = self._entries.pop(path, None)
+            if old_size is not None:
+                self.total_bytes -= old_size
+            self._entries[path] = size
+            self.total_bytes += size
+            self._evict()
+
+    def clear(self):
+        """Removes every cached frame."""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                entry = os.path.join(self.cache_dir, name)
+                if os.path.isdir(entry):
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    os.remove(entry)
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        """Removes least recently used frames until the cache fits its size cap."""
+        while self.total_bytes > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self):
+        """Builds the in-memory index from the files already in the cache directory."""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        found.sort()
+        with self._lock:
+            for _, path, size in found:
+                self._entries[path] = size
+                self.total_bytes += size
+            self._evict()
+
+
+def save_frame_atomic(frame, path):
+    """
+    Saves a frame as PNG so that readers never see a partially written file.
+
+    :param frame: A Pillow Image.
+    :param path: The destination path.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            frame.save(f, format='PNG')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def link_or_copy(source_path, destination_path):
+    """
+    Hard-links a file, falling back to a copy across file systems.
+
+    :param source_path: The existing file.
+    :param destination_path: The new path.
+    """
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
@@ -1,10 +1,29 @@
+import hashlib
+import heapq
+from collections import OrderedDict
+
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 
+from src.glyph_atlas import GlyphAtlas, LINE_HEIGHT_SAMPLE
+
+# Text rendering backends: 'draw' shapes every line with ImageDraw.text,
+# 'atlas' blits cached glyphs and uses a fixed line height per font.
+TEXT_BACKENDS = ('draw', 'atlas')
+
+# Lines whose bounding box the 'draw' backend remembers. Successive frames show
+# mostly the same lines, so each is measured once instead of once per frame.
+TEXT_BBOX_CACHE_SIZE = 16384
+
 class FrameRenderer:
     """
     A class to render a single frame of the time-lapse video.
     """
-    def __init__(self, width, height, bg_color="#141618", text_color="#FFFFFF", font_path=None, font_size=15, no_email=False):
+    # Layout spacing, in pixels
+    X_PADDING = 30
+    Y_PADDING = 20
+    LINE_SPACING = 8
+    def __init__(self, width, height, bg_color="#141618", text_color="#FFFFFF", font_path=None, font_size=15, no_email=False,
+                 text_backend='draw'):
         """
         Initializes the FrameRenderer object.
 
@@ -15,9 +34,15 @@ class FrameRenderer:
         :param font_path: Path to a .ttf font file. If None, a default font will be used.
         :param font_size: The size of the font.
         :param no_email: If True, do not display author emails.
+        :param text_backend: How text is rasterized: 'draw' (ImageDraw.text) or 'atlas' (cached glyphs).
         """
+        if text_backend not in TEXT_BACKENDS:
+            raise ValueError(f"Unsupported text backend: '{text_backend}'")
+
         self.width = width
         self.height = height
+        self.font_path = font_path
+        self.font_size = font_size
         self.bg_color = self._hex_to_rgb(bg_color)
         self.text_color = self._hex_to_rgb(text_color)
         self.no_email = no_email
@@ -32,6 +57,29 @@ class FrameRenderer:
             self.font = ImageFont.load_default()
             self.font_header = self.font
 
+        self.text_backend = text_backend
+        self._bboxes = OrderedDict()  # (font id, text) -> bounding box
+        self._atlases = {}
+        if text_backend == 'atlas':
+            for font in (self.font, self.font_header):
+                self._atlases.setdefault(id(font), GlyphAtlas(font))
+
+    @property
+    def settings(self):
+        """
+        The options that determine how frames look, as FrameRenderer keyword arguments.
+        """
+        return {
+            'width': self.width,
+            'height': self.height,
+            'bg_color': '#%02x%02x%02x' % self.bg_color[:3],
+            'text_color': '#%02x%02x%02x' % self.text_color[:3],
+            'font_path': self.font_path,
+            'font_size': self.font_size,
+            'no_email': self.no_email,
+            'text_backend': self.text_backend,
+        }
+
     def _hex_to_rgb(self, hex_color):
         """
         Converts a hex color string to an RGB tuple.
@@ -57,76 +105,483 @@ class FrameRenderer:
         img = Image.new('RGB', (self.width, self.height), color=self.bg_color)
         draw = ImageDraw.Draw(img)
 
-        x_padding = 30
-        y_padding = 20
-        line_spacing = 8
+        x_padding = self.X_PADDING
+        y_padding = self.Y_PADDING
+        line_spacing = self.LINE_SPACING
 
         # --- 1. Render Header (Commit Info) ---
-        header_height = self._render_commit_info(draw, commit_info, x_padding, y_padding, line_spacing)
+        content_y_start = self._render_header(draw, commit_info)
 
         # --- 2. Render Content (File Tree and Code) ---
-        content_y_start = header_height
-        draw.line([(x_padding, content_y_start), (self.width - x_padding, content_y_start)], fill=self.text_color, width=1)
-        content_y_start += y_padding
-
         self._render_file_content(draw, file_contents, x_padding, content_y_start, y_padding, line_spacing)
 
         return img
 
-    def _render_commit_info(self, draw, commit_info, x_padding, y_padding, line_spacing):
-        """Renders the header part of the frame with commit information."""
+    def _render_header(self, draw, commit_info):
+        """
+        Renders the commit information and the line separating it from the content.
+
+        :return: The y where the file content starts.
+        """
+        x_padding = self.X_PADDING
+        items, header_height = self._layout_header(commit_info)
+        for x, y, text, font in items:
+            self._draw_text(draw, (x, y), text, font)
+        draw.line([(x_padding, header_height), (self.width - x_padding, header_height)], fill=self.text_color, width=1)
+        return header_height + self.Y_PADDING
+
+    def _layout_header(self, commit_info):
+        """
+        Lays out the header part of the frame with commit information, without drawing it.
+
+        :return: A tuple of (the (x, y, text, font) items, the y of the line under the header).
+        """
+        x_padding, y_padding, line_spacing = self.X_PADDING, self.Y_PADDING, self.LINE_SPACING
+        items = []
         current_y = y_padding
 
         author_email = "[email protected]" if self.no_email else commit_info['author_email']
         author_text = f"Author: {commit_info['author_name']} <{author_email}>"
         date_text = f"Date: {commit_info['date'].strftime('%Y-%m-%d %H:%M:%S')}"
 
-        draw.text((x_padding, current_y), author_text, font=self.font, fill=self.text_color)
-        text_height = self.font.getbbox(author_text)[3] - self.font.getbbox(author_text)[1]
-        current_y += text_height + line_spacing
+        items.append((x_padding, current_y, author_text, self.font))
+        current_y += self._text_height(self.font, author_text) + line_spacing
 
-        draw.text((x_padding, current_y), date_text, font=self.font, fill=self.text_color)
-        text_height = self.font.getbbox(date_text)[3] - self.font.getbbox(date_text)[1]
-        current_y += text_height + y_padding
+        items.append((x_padding, current_y, date_text, self.font))
+        current_y += self._text_height(self.font, date_text) + y_padding
 
         commit_message = f"Commit: {commit_info['hash']} - {commit_info['message'].splitlines()[0]}"
-        draw.text((x_padding, current_y), commit_message, font=self.font_header, fill=self.text_color)
-        text_height = self.font_header.getbbox(commit_message)[3] - self.font_header.getbbox(commit_message)[1]
-        current_y += text_height + y_padding
+        items.append((x_padding, current_y, commit_message, self.font_header))
+        current_y += self._text_height(self.font_header, commit_message) + y_padding
+
+        return items, current_y
+
+    def content_top(self, commit_info):
+        """
+        Returns the y where the file content of a commit's frame starts.
+
+        :param commit_info: A dictionary containing the commit metadata.
+        :return: The y, or None if the header text reaches into the content area,
+                 in which case the header cannot be repainted on its own.
+        """
+        items, header_height = self._layout_header(commit_info)
+        content_y = header_height + self.Y_PADDING
+        if any(self._ink_rows(font, text, y)[1] > content_y for _, y, text, font in items):
+            return None
+        return content_y
+
+    def content_fingerprint(self, file_contents):
+        """
+        Computes a fingerprint of the file content area a frame would display.
+
+        Two file trees with the same fingerprint render the same content area, so
+        the frame of one can stand in for the other. Files and lines that fall
+        below the visible area do not affect the result.
+
+        :param file_contents: A dictionary mapping file paths to their content.
+        :return: A hex digest string.
+        """
+        # Laid out from the top of the frame, which covers everything the content area can show
+        return self._fingerprint_content(file_contents, 0)[0]
+
+    def content_key(self, commit_info, file_contents):
+        """
+        Describes the content area of a commit's frame where it actually starts,
+        to tell whether the frame can be made from another commit's frame (see can_repaint_header).
+
+        :param commit_info: A dictionary containing the commit metadata.
+        :param file_contents: A dictionary mapping file paths to their content.
+        :return: A tuple of (the y where the content starts, its fingerprint, the lowest row
+                 its text can cover relative to that y), or None if the header cannot be
+                 repainted on its own.
+        """
+        content_y = self.content_top(commit_info)
+        if content_y is None:
+            return None
+        fingerprint, ink_bottom = self._fingerprint_content(file_contents, content_y)
+        return content_y, fingerprint, ink_bottom
+
+    def can_repaint_header(self, content_key, previous_content_key):
+        """
+        Tells whether a frame can be made from the previous frame with repaint_header.
+
+        :param content_key: The content_key of the new frame.
+        :param previous_content_key: The content_key of the previous frame.
+        """
+        if content_key is None or previous_content_key is None or content_key[1] != previous_content_key[1]:
+            return False
+        content_y, _, ink_bottom = content_key
+        previous_content_y = previous_content_key[0]
+        # Content that moves up shows rows the previous frame cut off at its bottom
+        return content_y >= previous_content_y or previous_content_y + ink_bottom <= self.height
+
+    def repaint_header(self, image, image_commit_info, commit_info):
+        """
+        Makes the frame of a commit from the frame of another commit with the same content,
+        by repainting the header and moving the content area to where it starts below it.
+
+        :param image: The frame of image_commit_info.
+        :param image_commit_info: The commit metadata the frame was rendered for.
+        :param commit_info: The commit metadata of the new frame, for which can_repaint_header is True.
+        :return: A new Pillow Image object.
+        """
+        old_content_y = self.content_top(image_commit_info)
+        content_y = self.content_top(commit_info)
+        if old_content_y is None or content_y is None:
+            raise ValueError("The header of this frame cannot be repainted on its own.")
+        img = Image.new('RGB', (self.width, self.height), color=self.bg_color)
+        bottom = min(self.height, self.height - (content_y - old_content_y))
+        if old_content_y < bottom:
+            img.paste(image.crop((0, old_content_y, self.width, bottom)), (0, content_y))
+        self._render_header(ImageDraw.Draw(img), commit_info)
+        return img
 
-        return current_y
+    @property
+    def header_overlay_height(self):
+        """
+        The number of rows at the top of a frame that header_overlay makes: room for
+        a header of the tallest lines the fonts are meant to draw and the padding under it.
+        """
+        lines_height = 2 * self._max_text_height(self.font) + self._max_text_height(self.font_header)
+        return lines_height + self.LINE_SPACING + 4 * self.Y_PADDING
+
+    def header_overlay(self, image, image_commit_info, commit_info):
+        """
+        Makes the top rows of the frame repaint_header would make, when the content area
+        stays where it is. The rows below are the same as in image, so the frame can be
+        encoded as image with these rows laid over it (see video_encoder.HeldFrame).
+
+        :param image: The frame of image_commit_info, of which only the top header_overlay_height rows are used.
+        :param image_commit_info: The commit metadata the frame was rendered for.
+        :param commit_info: The commit metadata of the new frame, for which can_repaint_header is True.
+        :return: A new Pillow Image object as wide as the frame and header_overlay_height high, or None
+                 if the content area starts at another y or below those rows.
+        """
+        overlay_height = self.header_overlay_height
+        content_y = self.content_top(commit_info)
+        if content_y is None or content_y > overlay_height or overlay_height > self.height or \
+                content_y != self.content_top(image_commit_info):
+            return None
+        img = Image.new('RGB', (self.width, overlay_height), color=self.bg_color)
+        if content_y < overlay_height:
+            img.paste(image.crop((0, content_y, self.width, overlay_height)), (0, content_y))
+        self._render_header(ImageDraw.Draw(img), commit_info)
+        return img
+
+    def plan_visible_files(self, paths):
+        """
+        Works out, from the file paths alone, which files can appear in a frame and
+        how many lines of each can be drawn.
+
+        Only the returned files need their content loaded: every file takes up at
+        least a header and the spacing after it, and every line at least the minimum
+        line advance, so anything beyond these bounds is below the bottom of the frame.
+
+        :param paths: An iterable of file paths.
+        :return: A tuple of (the candidate paths in drawing order, the maximum number of lines per file).
+        """
+        min_file_advance = self._min_text_height(self.font_header) + self.LINE_SPACING + self.Y_PADDING
+        max_files = self.height // max(1, min_file_advance) + 1
+        min_line_advance = self._min_text_height(self.font) + self.LINE_SPACING // 2
+        max_lines = self.height // max(1, min_line_advance) + 1
+        return heapq.nsmallest(max_files, paths), max_lines
 
     def _render_file_content(self, draw, file_contents, x_padding, y_start, y_padding, line_spacing):
         """
         Renders the file content in a single column.
         A more sophisticated version could use multiple columns.
         """
+        for x, y, text, font in self._layout_file_content(file_contents, x_padding, y_start, y_padding, line_spacing):
+            self._draw_text(draw, (x, y), text, font)
+
+    def _fingerprint_content(self, file_contents, content_y):
+        """
+        Hashes the layout of the file content from content_y, relative to it.
+
+        :return: A tuple of (the hex digest, the lowest row the text can cover relative to content_y).
+        """
+        x_padding, y_padding, line_spacing = self.X_PADDING, self.Y_PADDING, self.LINE_SPACING
+        digest = hashlib.blake2b(digest_size=16)
+        ink_bottom = 0
+        for x, y, text, font in self._layout_file_content(file_contents, x_padding, content_y, y_padding,
+                                                          line_spacing):
+            digest.update(f"{x},{y - content_y}:".encode('utf-8'))
+            digest.update(text.encode('utf-8', errors='replace'))
+            digest.update(b'\0')
+            ink_bottom = max(ink_bottom, self._ink_rows(font, text, y)[1] - content_y)
+        return digest.hexdigest(), ink_bottom
+
+    def _draw_text(self, draw, xy, text, font):
+        """Draws a single line of text with the configured text backend."""
+        atlas = self._atlases.get(id(font))
+        if atlas is not None:
+            atlas.draw_text(draw, xy, text, self.text_color)
+        else:
+            draw.text(xy, text, font=font, fill=self.text_color)
+
+    def _text_height(self, font, text):
+        """Returns the height a line of text takes up with the configured text backend."""
+        atlas = self._atlases.get(id(font))
+        if atlas is not None:
+            return atlas.line_height
+        bbox = self._text_bbox(font, text)
+        return bbox[3] - bbox[1]
+
+    def _ink_rows(self, font, text, y):
+        """Returns the rows (top, bottom) the glyphs of a line of text drawn at y can cover."""
+        atlas = self._atlases.get(id(font))
+        if atlas is not None:
+            top, bottom = atlas.ink_rows(text)
+        else:
+            _, top, _, bottom = self._text_bbox(font, text)
+        return y + top, y + bottom
+
+    def _text_bbox(self, font, text):
+        """Returns the bounding box of a line of text, measuring it only if it is not remembered."""
+        key = (id(font), text)
+        bbox = self._bboxes.get(key)
+        if bbox is not None:
+            self._bboxes.move_to_end(key)
+            return bbox
+        bbox = font.getbbox(text)
+        self._bboxes[key] = bbox
+        if len(self._bboxes) > TEXT_BBOX_CACHE_SIZE:
+            self._bboxes.popitem(last=False)
+        return bbox
+
+    def _max_text_height(self, font):
+        """Returns the height of the font's tallest lines with the configured text backend."""
+        atlas = self._atlases.get(id(font))
+        if atlas is not None:
+            return atlas.line_height
+        try:
+            ascent, descent = font.getmetrics()
+        except AttributeError:
+            # Bitmap fonts have no metrics
+            bbox = font.getbbox(LINE_HEIGHT_SAMPLE)
+            return bbox[3] - bbox[1]
+        return ascent + descent
+
+    def _min_text_height(self, font):
+        """Returns the smallest height a line of text can take up (0 for an empty line with 'draw')."""
+        atlas = self._atlases.get(id(font))
+        return atlas.line_height if atlas is not None else 0
+
+    def _layout_file_content(self, file_contents, x_padding, y_start, y_padding, line_spacing):
+        """
+        Lays out the file content in a single column, without drawing it.
+
+        :return: A generator of (x, y, text, font) tuples in drawing order.
+        """
+        current_y = y_start
+
+        # Files are drawn in sorted order; only the ones that can be visible are loaded
+        sorted_files, max_lines = self.plan_visible_files(file_contents.keys())
+
+        for file_path in sorted_files:
+            items, current_y, ended = self._layout_file(file_path, file_contents[file_path], max_lines,
+                                                        x_padding, current_y, y_padding, line_spacing)
+            yield from items
+            if ended:
+                return
+
+    def _layout_file(self, file_path, content, max_lines, x_padding, y_start, y_padding, line_spacing):
+        """
+        Lays out a single file of the content column, starting at y_start.
+
+        :return: A tuple of (the (x, y, text, font) items, the y where the next file starts,
+                 whether the frame ran out of vertical space in this file).
+        """
+        items = []
         current_y = y_start
         file_header_font = self.font_header
         code_font = self.font
 
-        # Sort files for consistent order
-        sorted_files = sorted(file_contents.keys())
+        # Draw file path header
+        file_header_text = f"--- {file_path} ---"
+        items.append((x_padding, current_y, file_header_text, file_header_font))
+        current_y += self._text_height(file_header_font, file_header_text) + line_spacing
 
-        for file_path in sorted_files:
-            content = file_contents[file_path]
-
-            # Draw file path header
-            file_header_text = f"--- {file_path} ---"
-            draw.text((x_padding, current_y), file_header_text, font=file_header_font, fill=self.text_color)
-            text_height = file_header_font.getbbox(file_header_text)[3] - file_header_font.getbbox(file_header_text)[1]
-            current_y += text_height + line_spacing
-
-            # Draw file content
-            lines = content.splitlines()
-            for line in lines:
-                # Stop if we run out of vertical space
-                if current_y > self.height - y_padding - 15: # 15 is buffer for '...'
-                    draw.text((x_padding, current_y), "...", font=code_font, fill=self.text_color)
-                    return # Exit the function entirely
-
-                draw.text((x_padding + 10, current_y), line, font=code_font, fill=self.text_color)
-                text_height = code_font.getbbox(line)[3] - code_font.getbbox(line)[1]
-                current_y += text_height + (line_spacing // 2)
-
-            current_y += y_padding # Space between files
+        # Draw file content
+        lines = _first_lines(content, max_lines)
+        for line in lines:
+            # Stop if we run out of vertical space
+            if current_y > self.height - y_padding - 15: # 15 is buffer for '...'
+                items.append((x_padding, current_y, "...", code_font))
+                return items, current_y, True
+
+            items.append((x_padding + 10, current_y, line, code_font))
+            current_y += self._text_height(code_font, line) + (line_spacing // 2)
+
+        current_y += y_padding # Space between files
+        return items, current_y, False
+
+class _FileBand:
+    """The rows of a frame taken up by one file, as laid out by IncrementalFrameRenderer."""
+    __slots__ = ('path', 'top', 'next_y', 'ended')
+
+    def __init__(self, path, top, next_y, ended):
+        self.path = path
+        self.top = top
+        self.next_y = next_y
+        self.ended = ended
+
+
+class IncrementalFrameRenderer:
+    """
+    Renders successive frames by repainting only the parts that changed.
+
+    The previous frame and the rows each visible file took up in it are kept.
+    The next frame starts as a copy of the previous one: the header is always
+    repainted, a changed file is repainted in place when it still takes up the
+    same rows, and when a file's rows move everything below it is repainted.
+    A different header height means the whole layout moved, so the frame is
+    rendered from scratch. So is a frame where the glyphs of a line reach out of
+    the rows of its file or header (e.g. an underscore under a large font), or
+    follows such a frame, since clearing the rows next to them would cut them
+    off. The result is identical to FrameRenderer.render_frame.
+    """
+    def __init__(self, frame_renderer):
+        """
+        Initializes the IncrementalFrameRenderer object.
+
+        :param frame_renderer: The FrameRenderer whose layout and settings are used.
+        """
+        self.frame_renderer = frame_renderer
+        self.full_renders = 0
+        self.partial_renders = 0
+        self._previous_image = None
+        self._previous_content_y = None
+        self._previous_bands = None
+        self._previous_overflows = False
+
+    def reset(self):
+        """Forgets the previous frame, so the next one is rendered from scratch."""
+        self._previous_image = None
+        self._previous_content_y = None
+        self._previous_bands = None
+        self._previous_overflows = False
+
+    def render_frame(self, commit_info, file_contents, changed_paths=None):
+        """
+        Renders a frame, reusing the unchanged parts of the previous one.
+
+        :param commit_info: A dictionary containing the commit metadata.
+        :param file_contents: A dictionary mapping file paths to their content.
+        :param changed_paths: The paths that differ from the previously rendered tree,
+                              or None if unknown (the frame is then rendered from scratch).
+        :return: A Pillow Image object. Returned images are never modified afterwards.
+        """
+        renderer = self.frame_renderer
+        if self._previous_image is None or changed_paths is None or self._previous_overflows:
+            return self._render(commit_info, file_contents, None)
+        # content_top is None when the header's glyphs reach into the content area
+        if renderer.content_top(commit_info) != self._previous_content_y:
+            return self._render(commit_info, file_contents, None)
+
+        img = self._previous_image.copy()
+        draw = ImageDraw.Draw(img)
+        self._clear(draw, 0, self._previous_content_y)
+        content_y_start = renderer._render_header(draw, commit_info)
+        return self._render(commit_info, file_contents, changed_paths, img, draw, content_y_start)
+
+    def _render(self, commit_info, file_contents, changed_paths, img=None, draw=None, content_y_start=None):
+        """
+        Lays out the file content and draws the files that are new or changed.
+
+        A partial render starts over from scratch when a line drawn in it reaches
+        out of its file's rows.
+        """
+        renderer = self.frame_renderer
+        x_padding, y_padding, line_spacing = renderer.X_PADDING, renderer.Y_PADDING, renderer.LINE_SPACING
+        previous_bands = self._previous_bands if changed_paths is not None else []
+        overflows = False
+        if img is None:
+            img = Image.new('RGB', (renderer.width, renderer.height), color=renderer.bg_color)
+            draw = ImageDraw.Draw(img)
+            content_y_start = renderer._render_header(draw, commit_info)
+            overflows = renderer.content_top(commit_info) is None
+
+        bands = []
+        current_y = content_y_start
+        # Once a file's rows move, everything below it has been cleared and is drawn again
+        shifted = changed_paths is None
+        sorted_files, max_lines = renderer.plan_visible_files(file_contents.keys())
+        for i, file_path in enumerate(sorted_files):
+            old = previous_bands[i] if i < len(previous_bands) else None
+            same_rows = not shifted and old is not None and old.path == file_path and old.top == current_y
+            if same_rows and file_path not in changed_paths:
+                bands.append(old)
+                current_y = old.next_y
+                if old.ended:
+                    break
+                continue
+
+            items, next_y, ended = renderer._layout_file(file_path, file_contents[file_path], max_lines,
+                                                         x_padding, current_y, y_padding, line_spacing)
+            if self._overflows(items, current_y, renderer.height if ended else next_y):
+                if changed_paths is not None:
+                    return self._render(commit_info, file_contents, None)
+                overflows = True
+            if not shifted:
+                if same_rows and (old.ended, old.next_y) == (ended, next_y):
+                    self._clear(draw, current_y, renderer.height if ended else next_y)
+                else:
+                    self._clear(draw, current_y, renderer.height)
+                    shifted = True
+            for x, y, text, font in items:
+                renderer._draw_text(draw, (x, y), text, font)
+            bands.append(_FileBand(file_path, current_y, next_y, ended))
+            current_y = next_y
+            if ended:
+                break
+        else:
+            if not shifted and len(previous_bands) > len(bands):
+                # Files at the end of the previous frame were removed
+                self._clear(draw, current_y, renderer.height)
+
+        if changed_paths is None:
+            self.full_renders += 1
+        else:
+            self.partial_renders += 1
+        self._previous_image = img
+        self._previous_content_y = content_y_start
+        self._previous_bands = bands
+        self._previous_overflows = overflows
+        return img
+
+    def _overflows(self, items, top, bottom):
+        """
+        Tells whether the glyphs of some laid out lines reach out of the rows from top up to bottom.
+
+        The rows come from the atlas glyphs or the remembered line measurements (see
+        FrameRenderer._ink_rows), so lines are not measured again to be checked.
+        """
+        renderer = self.frame_renderer
+        # Glyphs below the bottom of the frame are cut off anyway
+        check_bottom = bottom < renderer.height
+        for _, y, text, font in items:
+            ink_top, ink_bottom = renderer._ink_rows(font, text, y)
+            if ink_top < top or (check_bottom and ink_bottom > bottom):
+                return True
+        return False
+
+    def _clear(self, draw, top, bottom):
+        """Fills the rows from top up to (not including) bottom with the background color."""
+        renderer = self.frame_renderer
+        bottom = min(bottom, renderer.height)
+        if top < bottom:
+            draw.rectangle([0, top, renderer.width - 1, bottom - 1], fill=renderer.bg_color)
+
+
+def _first_lines(content, max_lines):
+    """
+    Returns the same lines as content.splitlines()[:max_lines], without splitting
+    the rest of a long file.
+    """
+    end = -1
+    for _ in range(max_lines):
+        end = content.find('\n', end + 1)
+        if end == -1:
+            return content.splitlines()[:max_lines]
+    return content[:end].splitlines()[:max_lines]
@@ -1,14 +1,245 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from datetime import datetime
+
 import git
+from gitdb.util import hex_to_bin
+
+from src.commit_store import CommitStore
+from src.path_filter import PathFilter
+from src.profiling import profile_stage, profile_iterator
+
+# Placeholder stored in place of the content of files that are not UTF-8 text.
+BINARY_FILE_MARKER = "[Binary File]"
+
+# Placeholder for files that are not read because the tree's read budget is used up.
+SKIPPED_FILE_MARKER = "[File Skipped]"
+
+# Only this much of a file is read; a frame never shows more (1 MB).
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024
+
+# Budget for the content read from a single commit's tree (64 MB).
+DEFAULT_MAX_COMMIT_BYTES = 64 * 1024 * 1024
+
+# Like git, a file with a NUL byte in its first 8000 bytes is treated as binary.
+BINARY_SNIFF_BYTES = 8000
+
+# Default memory budget for decoded blob contents (256 MB).
+DEFAULT_BLOB_CACHE_BYTES = 256 * 1024 * 1024
+
+# Default number of commit-metadata indexes a RepoIndex keeps.
+DEFAULT_MAX_HISTORIES = 8
+
+# `git log` format: full SHA, author name, author email, committer date, raw message.
+_LOG_FORMAT = '%H%x00%an%x00%ae%x00%cI%x00%B'
+_LOG_FIELD_COUNT = 5
+_LOG_CHUNK_SIZE = 64 * 1024
+_LOG_DATE_FIELD = 3
+
+# Time buckets that commit sampling can keep one commit per.
+SAMPLE_PERIODS = ('day', 'week')
+
+
+def check_sampling(every=None, period=None, max_frames=None):
+    """
+    Validates commit sampling options (see GitRepo.iter_commit_history).
+
+    :raises ValueError: If an option is invalid or more than one is set.
+    """
+    if sum(option is not None for option in (every, period, max_frames)) > 1:
+        raise ValueError("Only one of every, period and max_frames can be used at a time.")
+    if every is not None and (not isinstance(every, int) or every < 1):
+        raise ValueError(f"Invalid sampling interval: '{every}'. Use a positive integer.")
+    if max_frames is not None and (not isinstance(max_frames, int) or max_frames < 1):
+        raise ValueError(f"Invalid frame budget: '{max_frames}'. Use a positive integer.")
+    if period is not None and period not in SAMPLE_PERIODS:
+        raise ValueError(f"Unsupported sampling period: '{period}'. Use one of: {', '.join(SAMPLE_PERIODS)}.")
+
+
+def _period_key(date, period):
+    """Returns the day or ISO week an ISO 8601 committer date falls in, in the committer's time zone."""
+    day = date[:10]
+    if period == 'day':
+        return day
+    return datetime.fromisoformat(day).isocalendar()[:2]
+
+
+class BlobCache:
+    """
+    A thread-safe LRU cache of decoded blob contents, keyed by blob SHA.
+
+    Blobs are content-addressed, so an entry never goes stale: neighbouring
+    commits share almost all of their blobs and each distinct blob only has to
+    be read and decoded once while it stays within the memory budget.
+    """
+    def __init__(self, max_bytes=DEFAULT_BLOB_CACHE_BYTES):
+        """
+        Initializes the BlobCache object.
+
+        :param max_bytes: Approximate memory budget for cached contents, in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, sha):
+        return sha in self._entries
+
+    def get(self, sha):
+        """
+        Returns the cached content of a blob and marks it as recently used.
+
+        :param sha: The hex SHA of the blob.
+        :return: The decoded text (or BINARY_FILE_MARKER), or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(sha)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sha)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sha, content):
+        """
+        Stores the content of a blob, evicting least recently used entries if needed.
+
+        :param sha: The hex SHA of the blob.
+        :param content: The decoded text of the blob, or BINARY_FILE_MARKER.
+        """
+        size = sys.getsizeof(content)
+        if size > self.max_bytes:
+            # Never let a single huge blob flush the whole cache.
+            return
+        with self._lock:
+            old = self._entries.pop(sha, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[sha] = (content, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class RepoIndex:
+    """
+    A thread-safe cache of a repository's resolved refs and commit metadata,
+    shared by the GitRepo handles of one repository.
+
+    Resolved revisions and the branch list are kept until the ref state changes
+    (see GitRepo.ref_state). Commit-metadata indexes, the ``git log`` fields of
+    a history in a CommitStore, are keyed by the SHA of the tip commit and the pathspecs, so
+    they never go stale; the most recently used ones are kept.
+    """
+    def __init__(self, max_histories=DEFAULT_MAX_HISTORIES):
+        """
+        Initializes the RepoIndex object.
+
+        :param max_histories: The number of commit-metadata indexes kept.
+        """
+        self.max_histories = max_histories
+        self.hits = 0
+        self.misses = 0
+        self._ref_state = None
+        self._refs = {}
+        self._histories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_ref(self, ref_state, key, load):
+        """
+        Returns a value derived from the refs, loading it if the refs changed since it was cached.
+
+        :param ref_state: The current ref state, as returned by GitRepo.ref_state.
+        :param key: The key of the value, e.g. ('rev', branch).
+        :param load: Called without arguments to compute the value on a miss.
+        """
+        with self._lock:
+            if ref_state != self._ref_state:
+                self._refs.clear()
+                self._ref_state = ref_state
+            if key in self._refs:
+                self.hits += 1
+                return self._refs[key]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            if ref_state == self._ref_state:
+                self._refs[key] = value
+        return value
+
+    def get_history(self, key):
+        """
+        Returns a cached commit-metadata index and marks it as recently used.
+
+        :param key: A tuple of the tip commit SHA and the pathspec arguments.
+        :return: A CommitStore without a repo, oldest commit first, or None on a miss.
+        """
+        with self._lock:
+            fields = self._histories.get(key)
+            if fields is not None:
+                self._histories.move_to_end(key)
+            return fields
+
+    def put_history(self, key, fields):
+        """
+        Stores a commit-metadata index, evicting the least recently used ones if needed.
+
+        :param key: A tuple of the tip commit SHA and the pathspec arguments.
+        :param fields: A CommitStore without a repo, oldest commit first.
+        """
+        with self._lock:
+            self._histories[key] = fields
+            self._histories.move_to_end(key)
+            while len(self._histories) > self.max_histories:
+                self._histories.popitem(last=False)
+
+    def clear(self):
+        """Removes all cached refs and histories."""
+        with self._lock:
+            self._ref_state = None
+            self._refs.clear()
+            self._histories.clear()
+
 
 class GitRepo:
     """
     A class to interact with a Git repository.
     """
-    def __init__(self, repo_path: str):
+    def __init__(self, repo_path: str, blob_cache: BlobCache = None, path_filter: PathFilter = None,
+                 max_file_bytes: int = DEFAULT_MAX_FILE_BYTES, max_commit_bytes: int = DEFAULT_MAX_COMMIT_BYTES,
+                 repo_index: RepoIndex = None, profile=None):
         """
         Initializes the GitRepo object.
 
         :param repo_path: Path to the Git repository.
+        :param blob_cache: Cache for decoded blob contents. A private cache is created if None.
+        :param path_filter: If set, only the files it selects are listed, and only the
+                            commits that touch them are part of the history.
+        :param max_file_bytes: The most bytes read from a single file; longer files are cut off.
+        :param max_commit_bytes: The most content read from a single commit's tree; files
+                                 read after the budget is used up become SKIPPED_FILE_MARKER.
+        :param repo_index: Cache of resolved refs and commit metadata, usually shared with
+                           other handles of the same repository. Nothing is cached if None.
+        :param profile: An optional PipelineProfile that times the commit_history,
+                        file_tree and read_blob stages. Can be set later.
         """
         try:
             self.repo = git.Repo(repo_path)
@@ -16,13 +247,208 @@ class GitRepo:
             raise ValueError(f"'{repo_path}' is not a valid Git repository.")
         except git.exc.NoSuchPathError:
             raise FileNotFoundError(f"The path '{repo_path}' does not exist.")
+        self.repo_path = repo_path
+        self.blob_cache = blob_cache if blob_cache is not None else BlobCache()
+        self.path_filter = path_filter
+        self.max_file_bytes = max_file_bytes
+        self.max_commit_bytes = max_commit_bytes
+        self.repo_index = repo_index
+        self.profile = profile
 
-    def get_commit_history(self, branch: str = None):
+    def close(self):
+        """Stops the git helper processes (e.g. ``git cat-file --batch``) kept by the repository."""
+        self.repo.close()
+
+    def ref_state(self):
+        """
+        Returns a fingerprint of HEAD, packed-refs and the loose refs.
+
+        git replaces a ref file whenever it updates it, so the fingerprint changes
+        whenever a branch moves or a ref is created, deleted or packed. Only file
+        metadata is read.
+        """
+        paths = [os.path.join(self.repo.git_dir, 'HEAD'), os.path.join(self.repo.common_dir, 'packed-refs')]
+        for root, _, files in os.walk(os.path.join(self.repo.common_dir, 'refs')):
+            paths.extend(os.path.join(root, name) for name in files)
+        state = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            state.append((path, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(state)
+
+    def get_branches(self):
+        """
+        Gets the names of the local branches and tags.
+
+        :return: A list of ref names, without remote-tracking branches.
+        """
+        def load():
+            return [ref.name for ref in self.repo.references if 'remotes' not in ref.name]
+        if self.repo_index is None:
+            return load()
+        return list(self.repo_index.get_ref(self.ref_state(), ('branches',), load))
+
+    def get_commit_history(self, branch: str = None, every: int = None, period: str = None, max_frames: int = None):
         """
         Gets the commit history of a given branch.
 
         :param branch: The name of the branch to get the history from. Defaults to the active branch.
-        :return: A list of dictionaries, where each dictionary represents a commit.
+        :param every: If set, keep one commit out of every this many.
+        :param period: If set, keep one commit per 'day' or 'week'.
+        :param max_frames: If set, keep at most this many commits, spread evenly over the history.
+        :return: A CommitStore, a sequence of dict-like commit records that keeps the
+                 metadata in compact columns, so long histories fit in memory.
+        """
+        store = CommitStore(self.repo)
+        commit_fields = self._sampled_log_fields(branch, every, period, max_frames)
+        for fields in profile_iterator(commit_fields, self.profile, 'commit_history'):
+            store.append_fields(fields)
+        return store
+
+    def iter_commit_history(self, branch: str = None, every: int = None, period: str = None, max_frames: int = None):
+        """
+        Streams the commit history of a given branch, oldest commit first.
+
+        All metadata comes from a single ``git log`` process and is parsed as it
+        arrives, so callers can start working on the first commit before the rest
+        of the history has been read. The branch is resolved eagerly, so an unknown
+        branch raises here rather than on the first iteration.
+
+        The history can be sampled with one of every, period or max_frames. Commits
+        are split into consecutive groups (of ``every`` commits, of commits made on
+        the same day or week, or ``max_frames`` equal parts of the history) and the
+        last commit of each group is kept, so the tip is always included. Skipped
+        commits are dropped while parsing, before a dictionary is built for them.
+
+        :param branch: The name of the branch to get the history from. Defaults to the active branch.
+        :param every: If set, keep one commit out of every this many.
+        :param period: If set, keep one commit per 'day' or 'week'.
+        :param max_frames: If set, keep at most this many commits, spread evenly over the history.
+        :return: A generator of dictionaries, where each dictionary represents a commit.
+        """
+        records = (self._make_commit_record(fields)
+                   for fields in self._sampled_log_fields(branch, every, period, max_frames))
+        if self.profile is None:
+            return records
+        return profile_iterator(records, self.profile, 'commit_history')
+
+    def count_commits(self, branch: str = None, every: int = None, period: str = None, max_frames: int = None):
+        """
+        Counts the commits reachable from a given branch without loading them.
+
+        :param branch: The name of the branch. Defaults to the active branch.
+        :param every: If set, count one commit out of every this many (see iter_commit_history).
+        :param period: If set, count one commit per 'day' or 'week'.
+        :param max_frames: If set, count at most this many commits.
+        :return: The number of commits iter_commit_history yields with the same options.
+        """
+        check_sampling(every, period, max_frames)
+        rev = self._resolve_branch(branch)
+        if period is not None:
+            cached = self._cached_log_fields(rev)
+            if cached is not None:
+                dates = [cached.date(i).isoformat() for i in range(len(cached))]
+            else:
+                # Only the dates are listed
+                dates = self.repo.git.log(rev, '--reverse', '--format=%cI', *self._pathspec_args()).split()
+            keys = [_period_key(date, period) for date in dates]
+            return sum(1 for key, next_key in zip(keys, keys[1:]) if key != next_key) + (1 if keys else 0)
+        total = self._count_log(rev)
+        if every is not None:
+            return -(-total // every)
+        if max_frames is not None:
+            return min(total, max_frames)
+        return total
+
+    def get_latest_commit(self, branch: str = None):
+        """
+        Gets the most recent commit of a given branch without walking its history.
+
+        With a path filter, this is the latest commit that touches a selected file.
+
+        :param branch: The name of the branch. Defaults to the active branch.
+        :return: A commit dictionary like those of get_commit_history, or None if no commit matches.
+        """
+        rev = self._resolve_branch(branch)
+        cached = self._cached_log_fields(rev)
+        if cached is not None:
+            return self._make_commit_record(cached.raw_fields(-1)) if cached else None
+        commit_fields = self._stream_log_fields(rev, max_count=1)
+        try:
+            fields = next(commit_fields, None)
+        finally:
+            commit_fields.close()
+        return self._make_commit_record(fields) if fields is not None else None
+
+    def get_branch_tip(self, branch: str = None):
+        """
+        Resolves a branch to the full SHA of its tip commit.
+
+        Unlike get_latest_commit, the path filter is not applied.
+
+        :param branch: The name of the branch. Defaults to the active branch.
+        :return: The SHA as a hex string.
+        """
+        rev = self._resolve_branch(branch)
+        if self.repo_index is None:
+            rev = self.repo.git.rev_parse(f'{rev}^{{commit}}')
+        return rev
+
+    def _sampled_log_fields(self, branch, every, period, max_frames):
+        """
+        Returns a generator of the raw fields of the commits kept by the sampling options.
+
+        The options and the branch are checked before returning, so errors are raised
+        here rather than on the first iteration.
+        """
+        check_sampling(every, period, max_frames)
+        rev = self._resolve_branch(branch)
+        group_key = self._sampling_key(rev, every, period, max_frames)
+        commit_fields = self._log_fields(rev)
+        if group_key is not None:
+            commit_fields = _last_of_each_group(commit_fields, group_key)
+        return commit_fields
+
+    def _sampling_key(self, rev, every, period, max_frames):
+        """
+        Returns a function mapping (index, raw log fields) to the sampling group of
+        a commit, or None when every commit is kept.
+        """
+        if every is not None:
+            return lambda index, fields: index // every
+        if max_frames is not None:
+            total = self._count_log(rev)
+            if max_frames >= total:
+                return None
+            return lambda index, fields: index * max_frames // total
+        if period is not None:
+            return lambda index, fields: _period_key(fields[_LOG_DATE_FIELD].decode('ascii'), period)
+        return None
+
+    def _resolve_branch(self, branch):
+        """
+        Resolves a branch name to a revision that git can walk.
+
+        With a repo index, the branch is resolved to the SHA of its tip commit and
+        cached until a ref changes, so the cached histories of that SHA can be used.
+
+        :param branch: The name of the branch, or None for the active branch.
+        :return: The revision string.
+        """
+        if self.repo_index is None:
+            return self._find_branch(branch)
+        return self.repo_index.get_ref(self.ref_state(), ('rev', branch),
+                                       lambda: self.repo.git.rev_parse(f'{self._find_branch(branch)}^{{commit}}'))
+
+    def _find_branch(self, branch):
+        """
+        Finds the revision of a branch, falling back from 'main' to 'master'.
+
+        :param branch: The name of the branch, or None for the active branch.
+        :return: The revision string.
         """
         if branch is None:
             try:
@@ -31,46 +457,324 @@ class GitRepo:
                 # Detached HEAD state
                 branch = self.repo.head.commit.hexsha
 
+        if self._rev_exists(branch):
+            return branch
+        # A common case is that the default branch is 'master' not 'main'
+        if branch == 'main':
+            if self._rev_exists('master'):
+                return 'master'
+            raise ValueError("Could not find branch 'main' or 'master'. Please specify a branch.")
+        raise ValueError(f"Could not find branch '{branch}'.")
+
+    def _rev_exists(self, rev):
+        """Returns True if the revision resolves to a commit."""
         try:
-            commits = list(self.repo.iter_commits(branch, reverse=True))
+            self.repo.git.rev_parse('--verify', '--quiet', f'{rev}^{{commit}}')
+            return True
         except git.exc.GitCommandError:
-            # A common case is that the default branch is 'master' not 'main'
-            if branch == 'main':
-                try:
-                    commits = list(self.repo.iter_commits('master', reverse=True))
-                except git.exc.GitCommandError:
-                    raise ValueError("Could not find branch 'main' or 'master'. Please specify a branch.")
+            return False
+
+    def _pathspec_args(self):
+        """Returns the arguments that limit a history walk to the filtered paths."""
+        if self.path_filter is None:
+            return []
+        return ['--'] + self.path_filter.pathspecs()
+
+    def _count_log(self, rev):
+        """Counts the commits of a revision, using a cached commit-metadata index if there is one."""
+        cached = self._cached_log_fields(rev)
+        if cached is not None:
+            return len(cached)
+        return int(self.repo.git.rev_list('--count', rev, *self._pathspec_args()))
+
+    def _cached_log_fields(self, rev):
+        """Returns the cached CommitStore of a revision, or None if it is not cached."""
+        if self.repo_index is None:
+            return None
+        return self.repo_index.get_history((rev, tuple(self._pathspec_args())))
+
+    def _log_fields(self, rev):
+        """
+        Yields the raw fields of each commit of a revision, oldest first.
+
+        With a repo index, a history that was read to the end is kept in the index
+        and later walks of the same tip and pathspecs are served from memory.
+        """
+        cached = self._cached_log_fields(rev)
+        if cached is not None:
+            yield from (cached.raw_fields(i) for i in range(len(cached)))
+            return
+        if self.repo_index is None:
+            yield from self._stream_log_fields(rev)
+            return
+        read = CommitStore()
+        for fields in self._stream_log_fields(rev):
+            read.append_fields(fields)
+            yield fields
+        self.repo_index.put_history((rev, tuple(self._pathspec_args())), read)
+
+    def _stream_log_fields(self, rev, max_count=None):
+        """
+        Splits the output of ``git log`` for a revision into the raw fields of each commit.
+
+        :param rev: A revision that is known to exist.
+        :param max_count: If set, only this many of the latest commits are listed.
+        :return: A generator of lists of bytes, one list per commit.
+        """
+        # Fields are NUL separated and, with -z, so are the commits themselves.
+        # git applies --max-count before --reverse, so it always keeps the latest commits.
+        limit = [f'--max-count={max_count}'] if max_count is not None else []
+        proc = self.repo.git.log(rev, '-z', '--reverse', *limit, f'--format={_LOG_FORMAT}', *self._pathspec_args(),
+                                 as_process=True)
+        fields = []
+        pending = b''
+        finished = False
+        try:
+            while True:
+                chunk = proc.proc.stdout.read(_LOG_CHUNK_SIZE)
+                if not chunk:
+                    finished = True
+                    break
+                tokens = (pending + chunk).split(b'\0')
+                pending = tokens.pop()
+                for token in tokens:
+                    fields.append(token)
+                    if len(fields) == _LOG_FIELD_COUNT:
+                        yield fields
+                        fields = []
+            if pending:
+                fields.append(pending)
+            if len(fields) == _LOG_FIELD_COUNT:
+                yield fields
+        finally:
+            proc.proc.stdout.close()
+            if finished:
+                proc.wait()
             else:
-                raise ValueError(f"Could not find branch '{branch}'.")
-
-        history = []
-        for commit in commits:
-            history.append({
-                'hash': commit.hexsha[:7],
-                'author_name': commit.author.name,
-                'author_email': commit.author.email,
-                'date': commit.committed_datetime,
-                'message': commit.message.strip(),
-                'commit_obj': commit, # Keep the commit object for later use
-            })
-        return history
-
-    def get_file_tree_at_commit(self, commit_obj):
+                # Closed before the end of the log: git would die of SIGPIPE, so its status means nothing
+                proc.proc.kill()
+                proc.proc.wait()
+
+    def _make_commit_record(self, fields):
+        """Builds a commit dictionary from the raw ``git log`` fields."""
+        sha, author_name, author_email, date, message = (
+            field.decode('utf-8', errors='replace') for field in fields
+        )
+        sha = sha.strip()
+        return {
+            'hash': sha[:7],
+            'sha': sha,
+            'author_name': author_name,
+            'author_email': author_email,
+            'date': datetime.fromisoformat(date),
+            'message': message.strip(),
+            # The commit object is only read from the object database when used
+            'commit_obj': git.Commit(self.repo, hex_to_bin(sha)),
+        }
+
+    def get_file_tree_at_commit(self, commit_obj, lazy=False):
         """
         Gets the file tree of the repository at a specific commit, including file content.
 
+        Blob contents are looked up in the blob cache by SHA, so unchanged files are
+        not re-read or re-decoded from one commit to the next. At most max_file_bytes
+        are read from each file and max_commit_bytes from the whole tree.
+
         :param commit_obj: The commit object from GitPython.
-        :return: A dictionary mapping file paths to their content.
-        """
-        tree = commit_obj.tree
-        file_contents = {}
-        # Recursively traverse the tree
-        for item in tree.traverse():
-            if item.type == 'blob':  # 'blob' represents a file
-                # Decode the file content to a string, handling potential binary files
-                try:
-                    file_contents[item.path] = item.data_stream.read().decode('utf-8')
-                except UnicodeDecodeError:
-                    # If it's not a UTF-8 text file, we can either skip it or mark it as binary.
-                    file_contents[item.path] = "[Binary File]"
-        return file_contents
+        :param lazy: If True, return a LazyFileTree that only reads a file when its content is accessed.
+        :return: A dictionary (or LazyFileTree) mapping file paths to their content.
+        """
+        with profile_stage(self.profile, 'file_tree'):
+            file_tree = LazyFileTree(self, commit_obj)
+            if lazy:
+                return file_tree
+            return dict(file_tree)
+
+    def _iter_blobs(self, tree):
+        """
+        Yields the blobs (files) of a tree, recursively.
+
+        With a path filter, directories that cannot contain a selected file are
+        skipped without being read.
+        """
+        if self.path_filter is None:
+            for item in tree.traverse():
+                if item.type == 'blob':  # 'blob' represents a file
+                    yield item
+            return
+        for item in tree:
+            if item.type == 'tree':
+                if self.path_filter.may_contain(item.path):
+                    yield from self._iter_blobs(item)
+            elif item.type == 'blob' and self.path_filter.matches(item.path):
+                yield item
+
+    def get_changed_paths(self, old_commit, new_commit):
+        """
+        Gets the paths of the files that differ between two commits.
+
+        The trees are compared by object SHA, so directories that are the same in
+        both commits are skipped without being listed. The commits do not need to
+        be parent and child.
+
+        :param old_commit: The earlier commit object from GitPython.
+        :param new_commit: The later commit object from GitPython.
+        :return: A set of the paths that were added, removed or modified.
+        """
+        changed = set()
+        self._diff_trees(old_commit.tree, new_commit.tree, changed)
+        return changed
+
+    def _diff_trees(self, old_tree, new_tree, changed):
+        """Adds the paths of the files that differ between two tree objects to changed."""
+        if old_tree is not None and new_tree is not None and old_tree.binsha == new_tree.binsha:
+            return
+        old_items = {item.name: item for item in old_tree} if old_tree is not None else {}
+        new_items = {item.name: item for item in new_tree} if new_tree is not None else {}
+        for name in old_items.keys() | new_items.keys():
+            old_item = old_items.get(name)
+            new_item = new_items.get(name)
+            if old_item is not None and new_item is not None and old_item.binsha == new_item.binsha:
+                continue
+            path = (new_item if new_item is not None else old_item).path
+            old_subtree = old_item if old_item is not None and old_item.type == 'tree' else None
+            new_subtree = new_item if new_item is not None and new_item.type == 'tree' else None
+            if (old_subtree is not None or new_subtree is not None) and \
+                    (self.path_filter is None or self.path_filter.may_contain(path)):
+                self._diff_trees(old_subtree, new_subtree, changed)
+            for item in (old_item, new_item):
+                if item is not None and item.type == 'blob' and \
+                        (self.path_filter is None or self.path_filter.matches(item.path)):
+                    changed.add(item.path)
+
+    def _read_blob(self, blob):
+        """
+        Returns the decoded content of a blob, reading it only on a cache miss.
+
+        :param blob: The blob object from GitPython.
+        :return: The decoded text, or BINARY_FILE_MARKER for non UTF-8 files.
+        """
+        content = self.blob_cache.get(blob.hexsha)
+        if content is None:
+            with profile_stage(self.profile, 'read_blob') as sample:
+                # The size comes from the object header, so large files are never loaded whole
+                truncated = blob.size > self.max_file_bytes
+                if truncated:
+                    data = self._read_blob_prefix(blob.hexsha, self.max_file_bytes)
+                else:
+                    data = blob.data_stream.read()
+                sample.byte_count = len(data)
+                content = _decode_blob(data, truncated=truncated)
+            self.blob_cache.put(blob.hexsha, content)
+        return content
+
+    def _read_blob_prefix(self, sha, size):
+        """
+        Reads the first bytes of a blob without reading the rest of it.
+
+        :param sha: The hex SHA of the blob.
+        :param size: The number of bytes to read.
+        :return: The bytes read.
+        """
+        # A separate process, since the shared cat-file --batch pipe must be drained to the end of each object
+        proc = self.repo.git.cat_file('blob', sha, as_process=True)
+        try:
+            return proc.proc.stdout.read(size)
+        finally:
+            proc.proc.stdout.close()
+            proc.proc.kill()
+            proc.proc.wait()
+
+
+def _decode_blob(data, truncated):
+    """
+    Decodes the content of a blob, or its first bytes.
+
+    :param data: The bytes of the blob.
+    :param truncated: True if data is only the beginning of the blob.
+    :return: The decoded text, or BINARY_FILE_MARKER for binary and non UTF-8 files.
+    """
+    if b'\0' in data[:BINARY_SNIFF_BYTES]:
+        return BINARY_FILE_MARKER
+    if truncated:
+        # Drop the partial last line
+        end = data.rfind(b'\n')
+        if end != -1:
+            data = data[:end]
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if truncated and e.reason == 'unexpected end of data':
+            # The cut split a multi-byte character
+            return data[:e.start].decode('utf-8')
+        # If it's not a UTF-8 text file, we can either skip it or mark it as binary.
+        return BINARY_FILE_MARKER
+
+
+def _last_of_each_group(items, group_key):
+    """
+    Yields the last item of each run of consecutive items in the same group.
+
+    :param items: An iterable of raw commit fields.
+    :param group_key: A function mapping (index, item) to its group.
+    """
+    previous = None
+    previous_key = None
+    for index, item in enumerate(items):
+        key = group_key(index, item)
+        if previous is not None and key != previous_key:
+            yield previous
+        previous, previous_key = item, key
+    if previous is not None:
+        yield previous
+
+
+class LazyFileTree(Mapping):
+    """
+    A read-only mapping of file paths to content that reads blobs on first access.
+
+    Listing the paths only walks the tree objects. Renderers that draw just the
+    files that fit in a frame therefore only read those blobs. Once the content
+    read reaches the GitRepo's max_commit_bytes, further files are not read and
+    show up as SKIPPED_FILE_MARKER.
+    """
+    def __init__(self, git_repo, commit_obj):
+        """
+        Initializes the LazyFileTree object.
+
+        :param git_repo: The GitRepo used to read (and cache) blob contents.
+        :param commit_obj: The commit object from GitPython.
+        """
+        self._git_repo = git_repo
+        self._blobs = {item.path: item for item in git_repo._iter_blobs(commit_obj.tree)}
+        self._contents = {}
+        self._bytes_loaded = 0
+
+    @property
+    def loaded_paths(self):
+        """The paths whose content has been read so far."""
+        return set(self._contents)
+
+    def blob_sha(self, path):
+        """Returns the blob SHA of a file without reading its content."""
+        return self._blobs[path].hexsha
+
+    def __getitem__(self, path):
+        content = self._contents.get(path)
+        if content is None:
+            if self._bytes_loaded >= self._git_repo.max_commit_bytes:
+                content = SKIPPED_FILE_MARKER
+            else:
+                content = self._git_repo._read_blob(self._blobs[path])
+                self._bytes_loaded += len(content)
+            self._contents[path] = content
+        return content
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __contains__(self, path):
+        return path in self._blobs
@@ -0,0 +1,81 @@
+"""
+Glyph-atlas text rasterizer used by FrameRenderer's 'atlas' text backend.
+"""
+from PIL import Image, ImageDraw
+
+# Text used to measure the fixed line height: tall capitals, descenders and brackets.
+LINE_HEIGHT_SAMPLE = "Ag|()[]{}"
+
+
+class GlyphAtlas:
+    """
+    Rasterizes each glyph of a font once and draws text by blitting the cached glyphs.
+
+    Glyphs are stored as 8-bit coverage masks, so one atlas serves every text
+    color: the color is applied when a mask is blitted, exactly as ImageDraw.text
+    does it. Lines are laid out with the glyph advances, without shaping, which
+    matches ImageDraw.text for code and commit text.
+    """
+    def __init__(self, font):
+        """
+        Initializes the GlyphAtlas object.
+
+        :param font: A Pillow font object (e.g., from ImageFont.truetype).
+        """
+        self.font = font
+        self._glyphs = {}
+        self._ink_rows = {}  # char -> (top, bottom) of its mask, for glyphs with ink
+        bbox = font.getbbox(LINE_HEIGHT_SAMPLE)
+        # Every line gets the same height instead of a per-line bounding box measurement
+        self.line_height = bbox[3] - bbox[1]
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    def draw_text(self, draw, xy, text, fill):
+        """
+        Draws a single line of text.
+
+        :param draw: The ImageDraw object of the target image.
+        :param xy: The (x, y) position, with the same anchor as ImageDraw.text.
+        :param text: The text to draw. Must not contain newlines.
+        :param fill: The text color.
+        """
+        x, y = xy
+        cursor = float(x)
+        glyphs = self._glyphs
+        for char in text:
+            glyph = glyphs.get(char)
+            if glyph is None:
+                glyph = self._rasterize(char)
+            mask, offset_x, offset_y, advance = glyph
+            if mask is not None:
+                draw.bitmap((round(cursor) + offset_x, y + offset_y), mask, fill=fill)
+            cursor += advance
+
+    def ink_rows(self, text):
+        """
+        Returns the rows a line of text covers when drawn, relative to its y, from the cached glyphs.
+
+        :param text: The text of the line.
+        :return: A tuple of (top, bottom), or (0, 0) if no glyph has ink.
+        """
+        chars = set(text)
+        for char in chars.difference(self._glyphs):
+            self._rasterize(char)
+        rows = [row for row in map(self._ink_rows.get, chars) if row is not None]
+        if not rows:
+            return 0, 0
+        return min(top for top, _ in rows), max(bottom for _, bottom in rows)
+
+    def _rasterize(self, char):
+        """Renders a glyph mask and stores it in the atlas."""
+        left, top, right, bottom = self.font.getbbox(char)
+        mask = None
+        if right > left and bottom > top:
+            mask = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text((-left, -top), char, font=self.font, fill=255)
+            self._ink_rows[char] = (top, bottom)
+        glyph = (mask, left, top, self.font.getlength(char))
+        self._glyphs[char] = glyph
+        return glyph
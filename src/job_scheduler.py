@@ -0,0 +1,119 @@
+"""
+Bounded scheduler for the web app's time-lapse jobs.
+"""
+import heapq
+import itertools
+import threading
+
+# Default number of jobs that run at the same time.
+DEFAULT_MAX_WORKERS = 2
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+class JobScheduler:
+    """
+    Runs jobs on a fixed number of worker threads, taking them from a priority queue.
+
+    Jobs with a higher priority run first; jobs with the same priority run in the
+    order they were submitted. A job is any object with a ``status`` attribute
+    and a ``cancel_requested`` threading.Event. Queued jobs have the status
+    'queued'; the run function sets the status from then on.
+    """
+    def __init__(self, run_job, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Initializes the JobScheduler object.
+
+        :param run_job: The function that runs a job, called with the job on a worker thread.
+        :param max_workers: The maximum number of jobs running at the same time.
+        """
+        if max_workers < 1:
+            raise ValueError(f"Invalid number of workers: '{max_workers}'. Use a positive integer.")
+        self.run_job = run_job
+        self.max_workers = max_workers
+        self._queue = []  # heap of (-priority, sequence, job)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._running = set()
+
+    def submit(self, job, priority=0):
+        """
+        Queues a job, starting another worker thread if fewer than max_workers exist.
+
+        :param job: The job to run.
+        :param priority: Jobs with a higher priority are started first.
+        """
+        with self._condition:
+            job.status = 'queued'
+            heapq.heappush(self._queue, (-priority, next(self._sequence), job))
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name=f"job-worker-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify()
+
+    def queue_position(self, job):
+        """
+        Returns the position of a queued job, starting at 1 for the next job to run.
+
+        :return: The position, or None if the job is not queued.
+        """
+        with self._condition:
+            for position, (_, _, queued_job) in enumerate(sorted(self._queue), start=1):
+                if queued_job is job:
+                    return position
+        return None
+
+    def cancel(self, job):
+        """
+        Cancels a job.
+
+        A queued job is removed from the queue and marked 'cancelled'. A running
+        job has its cancel_requested event set; the run function is expected to
+        check it between steps and raise JobCancelled.
+
+        :return: True if the job was queued or running, False if it had already finished.
+        """
+        with self._condition:
+            for i, (_, _, queued_job) in enumerate(self._queue):
+                if queued_job is job:
+                    self._queue.pop(i)
+                    heapq.heapify(self._queue)
+                    job.status = 'cancelled'
+                    return True
+            if job in self._running:
+                job.cancel_requested.set()
+                return True
+        return False
+
+    @property
+    def queued_count(self):
+        """The number of jobs waiting for a worker."""
+        with self._condition:
+            return len(self._queue)
+
+    @property
+    def running_count(self):
+        """The number of jobs being run."""
+        with self._condition:
+            return len(self._running)
+
+    def _work(self):
+        """Worker thread loop: runs queued jobs one after another."""
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, job = heapq.heappop(self._queue)
+                self._running.add(job)
+            try:
+                self.run_job(job)
+            except Exception as e:
+                # run_job reports its own errors; this only keeps the worker alive
+                print(f"Warning: Job failed with an unhandled error: {e}")
+            finally:
+                with self._condition:
+                    self._running.discard(job)
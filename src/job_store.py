@@ -0,0 +1,360 @@
+"""
+Persistent store of the web app's jobs, with retention of finished jobs and their outputs.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Finished jobs older than this many seconds are deleted with their output.
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+# Outputs of finished jobs are deleted, oldest first, beyond this total size in bytes.
+DEFAULT_MAX_OUTPUT_BYTES = 10 * 1024 * 1024 * 1024
+
+# Seconds between two retention sweeps.
+DEFAULT_SWEEP_INTERVAL = 300
+
+# Job states after which a job never changes again.
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    repo_path TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    error TEXT,
+    output_path TEXT,
+    output_bytes INTEGER NOT NULL,
+    frames_deduplicated INTEGER NOT NULL,
+    profile TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    request_key TEXT,
+    source_job_id TEXT,
+    reuse TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_created_at ON jobs (created_at, job_id);
+CREATE INDEX IF NOT EXISTS jobs_by_finished_at ON jobs (finished_at) WHERE finished_at IS NOT NULL;
+"""
+
+# Columns added after the first release of the schema, with their types
+_ADDED_COLUMNS = (('request_key', 'TEXT'), ('source_job_id', 'TEXT'), ('reuse', 'TEXT'))
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_by_request_key ON jobs (request_key, finished_at) WHERE request_key IS NOT NULL;
+"""
+
+_COLUMNS = ('job_id, repo_path, options, status, progress, message, error, output_path, frames_deduplicated, '
+            'profile, created_at, request_key, source_job_id, reuse')
+
+
+class SavedProfile:
+    """The summary of a finished job's PipelineProfile, as read back from the store."""
+    def __init__(self, summary):
+        self.summary = summary
+
+    def to_dict(self):
+        return self.summary
+
+
+class JobStore:
+    """
+    Keeps the jobs of the web app in an SQLite database, so their history survives a restart.
+
+    Jobs that have not finished stay in memory as well, since their worker and
+    status streams update them in place; get returns those same objects. A
+    finished job is saved one last time and then only read back from the
+    database, so memory use does not grow with the history.
+
+    Changes to a job are written when save is called, which the web app does
+    when the status changes; progress in between is only kept in memory.
+
+    Finished jobs are deleted, with their output file, once they are older
+    than max_age. Beyond max_output_bytes of outputs, the oldest outputs are
+    deleted first and their jobs stay in the history without an output. A
+    background thread sweeps every sweep_interval seconds once started.
+    """
+    def __init__(self, db_path, job_factory, max_age=DEFAULT_MAX_AGE, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL, clock=time.time):
+        """
+        Initializes the JobStore object, creating the database if needed.
+
+        :param db_path: Path to the SQLite database file.
+        :param job_factory: Called with the job id, repository path and options to recreate a stored job.
+        :param max_age: Seconds a finished job is kept, or None to keep jobs forever.
+        :param max_output_bytes: Total size of the outputs kept, or None for no limit.
+        :param sweep_interval: Seconds between two sweeps of the background thread.
+        :param clock: Returns the current time as epoch seconds.
+        """
+        if max_age is not None and max_age <= 0:
+            raise ValueError(f"Invalid job retention: '{max_age}'. Use a positive number of seconds.")
+        if max_output_bytes is not None and max_output_bytes < 0:
+            raise ValueError(f"Invalid output size limit: '{max_output_bytes}'. Use a non-negative number of bytes.")
+        if sweep_interval <= 0:
+            raise ValueError(f"Invalid sweep interval: '{sweep_interval}'. Use a positive number of seconds.")
+        self.db_path = db_path
+        self.job_factory = job_factory
+        self.max_age = max_age
+        self.max_output_bytes = max_output_bytes
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self._live = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # One connection shared by all threads, each use under the lock
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        existing = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        for name, column_type in _ADDED_COLUMNS:
+            if name not in existing:
+                self._db.execute(f'ALTER TABLE jobs ADD COLUMN {name} {column_type}')
+        self._db.executescript(_INDEXES)
+
+    def add(self, job):
+        """Adds a new job, or replaces a stored job with the same id (e.g. one resumed after a restart)."""
+        self.save(job)
+
+    def __setitem__(self, job_id, job):
+        if job_id != job.job_id:
+            raise ValueError(f"Job '{job.job_id}' cannot be stored as '{job_id}'.")
+        self.save(job)
+
+    def save(self, job):
+        """
+        Writes the current state of a job.
+
+        A finished job is no longer kept in memory afterwards.
+        """
+        finished = job.status in FINISHED_STATUSES
+        output_bytes = 0
+        # The output of a reused job belongs to its source job and is only counted there
+        if job.output_path is not None and job.source_job_id is None:
+            try:
+                output_bytes = os.path.getsize(job.output_path)
+            except OSError:
+                pass
+        row = (job.job_id, job.repo_path, json.dumps(job.options), job.status, job.progress, job.message, job.error,
+               job.output_path, output_bytes, job.frames_deduplicated,
+               json.dumps(job.profile.to_dict()) if job.profile is not None else None,
+               job.created_at, self.clock() if finished else None, job.request_key, job.source_job_id, job.reuse)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, repo_path, options, status, progress, message, error, output_path, "
+                "output_bytes, frames_deduplicated, profile, created_at, finished_at, request_key, source_job_id, reuse) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET repo_path = excluded.repo_path, options = excluded.options, "
+                "status = excluded.status, progress = excluded.progress, message = excluded.message, "
+                "error = excluded.error, output_path = excluded.output_path, output_bytes = excluded.output_bytes, "
+                "frames_deduplicated = excluded.frames_deduplicated, profile = excluded.profile, "
+                "created_at = excluded.created_at, request_key = excluded.request_key, "
+                "source_job_id = excluded.source_job_id, reuse = excluded.reuse, "
+                # A finished job saved again keeps the time it first finished at
+                "finished_at = CASE WHEN excluded.finished_at IS NULL THEN NULL "
+                "ELSE COALESCE(jobs.finished_at, excluded.finished_at) END",
+                row)
+            if finished:
+                self._live.pop(job.job_id, None)
+            else:
+                self._live[job.job_id] = job
+
+    def get(self, job_id, default=None):
+        """Returns the job with an id: the object in memory if it has not finished, otherwise a copy read back."""
+        with self._lock:
+            job = self._live.get(job_id)
+            if job is not None:
+                return job
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._job_from_row(row) if row is not None else default
+
+    def __getitem__(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+    def live(self, job_id):
+        """Returns the job with an id if it is kept in memory (it has not finished), otherwise None."""
+        with self._lock:
+            return self._live.get(job_id)
+
+    def find_reusable(self, request_key):
+        """
+        Finds a job whose video can serve a new request with the same key.
+
+        :param request_key: The key of the request.
+        :return: A job that has not finished yet (to attach to), or else the latest completed
+                 job whose output still exists, or None. Jobs that reuse another job are skipped.
+        """
+        with self._lock:
+            for job in self._live.values():
+                if job.request_key == request_key and job.source_job_id is None:
+                    return job
+            rows = self._db.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE request_key = ? AND status = 'completed' "
+                "AND output_path IS NOT NULL AND source_job_id IS NULL ORDER BY finished_at DESC",
+                (request_key,)).fetchall()
+        for row in rows:
+            if os.path.exists(row[7]):
+                return self._job_from_row(row)
+        return None
+
+    def list_page(self, limit=50, cursor=None):
+        """
+        Lists jobs from the newest to the oldest, a page at a time.
+
+        :param limit: The most jobs returned.
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :return: The jobs and the cursor of the next page (None on the last page).
+        :raises ValueError: If the cursor is invalid.
+        """
+        if limit < 1:
+            raise ValueError(f"Invalid page size: '{limit}'. Use a positive integer.")
+        query = f"SELECT {_COLUMNS} FROM jobs"
+        params = []
+        if cursor:
+            created_at, separator, job_id = cursor.partition(':')
+            if not separator:
+                raise ValueError(f"Invalid cursor: '{cursor}'.")
+            query += " WHERE (created_at, job_id) < (?, ?)"
+            params += [float(created_at), job_id]
+        query += " ORDER BY created_at DESC, job_id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+            live = dict(self._live)
+        page = [live.get(row[0]) or self._job_from_row(row) for row in rows[:limit]]
+        next_cursor = f"{rows[limit - 1][10]!r}:{rows[limit - 1][0]}" if len(rows) > limit else None
+        return page, next_cursor
+
+    def count_by_status(self):
+        """Returns the number of jobs in each state."""
+        with self._lock:
+            live = [job.status for job in self._live.values()]
+            placeholders = ', '.join('?' * len(self._live))
+            rows = self._db.execute(
+                f"SELECT status, COUNT(*) FROM jobs WHERE job_id NOT IN ({placeholders}) GROUP BY status",
+                list(self._live)).fetchall()
+        counts = dict(rows)
+        for status in live:
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def fail_interrupted(self):
+        """
+        Marks the stored jobs that had not finished, and are not in memory, as failed.
+
+        Called at startup: their worker stopped with the previous server process.
+
+        :return: The number of jobs marked.
+        """
+        with self._lock:
+            placeholders = ', '.join('?' * len(self._live))
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart.', "
+                "message = 'Error: Interrupted by a server restart.', finished_at = ? "
+                f"WHERE finished_at IS NULL AND job_id NOT IN ({placeholders})",
+                [self.clock()] + list(self._live))
+            return cursor.rowcount
+
+    def sweep(self):
+        """
+        Deletes the finished jobs older than max_age and, beyond max_output_bytes, the oldest outputs.
+
+        :return: The number of jobs and the number of output files deleted.
+        """
+        removed_outputs = []
+        with self._lock:
+            removed_jobs = 0
+            if self.max_age is not None:
+                cutoff = self.clock() - self.max_age
+                expired = self._db.execute(
+                    "SELECT output_path, source_job_id FROM jobs WHERE finished_at < ?", (cutoff,)).fetchall()
+                self._db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+                removed_jobs = len(expired)
+                # A reused output is deleted with the job that made it
+                removed_outputs += [output_path for output_path, source_job_id in expired
+                                    if output_path and source_job_id is None]
+
+            if self.max_output_bytes is not None:
+                total = self._db.execute(
+                    "SELECT COALESCE(SUM(output_bytes), 0) FROM jobs WHERE output_path IS NOT NULL").fetchone()[0]
+                if total > self.max_output_bytes:
+                    oldest = self._db.execute(
+                        "SELECT job_id, output_path, output_bytes FROM jobs "
+                        "WHERE output_path IS NOT NULL AND finished_at IS NOT NULL ORDER BY finished_at")
+                    dropped = []
+                    for job_id, output_path, output_bytes in oldest:
+                        if total <= self.max_output_bytes:
+                            break
+                        dropped.append(job_id)
+                        removed_outputs.append(output_path)
+                        total -= output_bytes
+                    self._db.executemany(
+                        "UPDATE jobs SET output_path = NULL, output_bytes = 0, "
+                        "message = 'The output was deleted to free disk space.' WHERE job_id = ?",
+                        [(job_id,) for job_id in dropped])
+            # Jobs that reused a deleted output lose it as well
+            self._db.executemany("UPDATE jobs SET output_path = NULL WHERE output_path = ?",
+                                 [(output_path,) for output_path in removed_outputs])
+
+        deleted = 0
+        for output_path in removed_outputs:
+            try:
+                os.remove(output_path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Warning: Could not delete job output {output_path}: {e}")
+        return removed_jobs, deleted
+
+    def clear(self):
+        """Forgets every job. Output files are kept."""
+        with self._lock:
+            self._live.clear()
+            self._db.execute("DELETE FROM jobs")
+
+    def start_sweeper(self):
+        """Starts the thread that applies the retention limits, if it is not running."""
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="job-store-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        """Sweeper thread loop."""
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Warning: Could not delete expired jobs: {e}")
+            time.sleep(self.sweep_interval)
+
+    def _job_from_row(self, row):
+        """Recreates a job from a database row of the _COLUMNS."""
+        (job_id, repo_path, options, status, progress, message, error, output_path, frames_deduplicated,
+         profile, created_at, request_key, source_job_id, reuse) = row
+        job = self.job_factory(job_id, repo_path, json.loads(options))
+        job.status = status
+        job.progress = progress
+        job.message = message
+        job.error = error
+        job.output_path = output_path
+        job.frames_deduplicated = frames_deduplicated
+        job.profile = SavedProfile(json.loads(profile)) if profile is not None else None
+        job.created_at = created_at
+        job.request_key = request_key
+        job.source_job_id = source_job_id
+        job.reuse = reuse
+        return job
@@ -1,10 +1,15 @@
 import argparse
-import os
+import cProfile
 import tempfile
 import shutil
-from src.git_utils import GitRepo
+from src.git_utils import GitRepo, SAMPLE_PERIODS
+from src.path_filter import PathFilter
 from src.frame_renderer import FrameRenderer
 from src.video_encoder import VideoEncoder
+from src.parallel_renderer import render_frames, resolve_jobs, checkpoint_settings, RenderStats
+from src.checkpoint import RunCheckpoint, default_work_dir
+from src.profiling import PipelineProfile
+from src.frame_cache import FrameCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES
 
 try:
     from tqdm import tqdm
@@ -20,19 +25,57 @@ def main():
         description="Generate a time-lapse video of a Git repository's history.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument("repo_path", help="Path to the local Git repository.")
-    parser.add_argument("output_path", help="Path to the output video file (e.g., 'timelapse.mp4').")
+    parser.add_argument("repo_path", nargs="?", help="Path to the local Git repository.")
+    parser.add_argument("output_path", nargs="?", help="Path to the output video file (e.g., 'timelapse.mp4').")
     parser.add_argument(
         "--format",
         default="mp4",
         choices=["mp4", "gif"],
-        help="Output video format. Default: mp4"
+        help="Output video format. A GIF's palette is made from frames spread over the whole video, so the stream "
+             "encoder saves a GIF's frames as PNG files until the end. Default: mp4"
     )
     parser.add_argument(
         "--branch",
         default=None,
         help="The Git branch to generate the time-lapse for. Defaults to the current active branch."
     )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=None,
+        metavar="PATTERN",
+        help="Only show files matching this glob pattern (git pathspec syntax, e.g.\n"
+             "'services/billing' or 'src/**/*.py'). Commits that touch no matching file\n"
+             "are skipped. Can be given several times."
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=None,
+        metavar="PATTERN",
+        help="Hide files matching this glob pattern. Can be given several times."
+    )
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument(
+        "--sample-every",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Render one frame for every N commits (the last commit of each group of N)."
+    )
+    sampling.add_argument(
+        "--sample-period",
+        default=None,
+        choices=list(SAMPLE_PERIODS),
+        help="Render one frame per day or week (the last commit made in it)."
+    )
+    sampling.add_argument(
+        "--max-frames",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Render at most N frames, sampled evenly over the history."
+    )
     parser.add_argument(
         "--fps",
         type=int,
@@ -66,17 +109,124 @@ def main():
         default=15,
         help="Font size for the text. Default: 15"
     )
+    parser.add_argument(
+        "--text-backend",
+        default="draw",
+        choices=["draw", "atlas"],
+        help="How text is rasterized: 'draw' shapes each line with Pillow's ImageDraw,\n"
+             "'atlas' blits cached glyphs with a fixed line height (much faster). Default: draw"
+    )
     parser.add_argument(
         "--no-email",
         action="store_true",
         help="Do not display author emails in the video."
     )
+    parser.add_argument(
+        "--encoder",
+        default="stream",
+        choices=["stream", "concat", "segmented"],
+        help="How frames reach FFmpeg: 'stream' pipes raw frames without touching disk,\n"
+             "'concat' saves PNG frames to a temporary directory first, 'segmented' also saves\n"
+             "them and encodes chunks of the video in parallel (mp4 only). Default: stream"
+    )
+    parser.add_argument(
+        "--segments",
+        default="auto",
+        help="Number of chunks the segmented encoder splits the video into, or 'auto' for one\n"
+             "per CPU core. Chunks hold whole 250-frame groups of pictures. Default: auto"
+    )
+    parser.add_argument(
+        "--segment-jobs",
+        default="auto",
+        help="Number of chunks the segmented encoder encodes at the same time, or 'auto' for\n"
+             "one per CPU core. Default: auto"
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Keep the frames and encoded segments of the run in this directory, with a manifest\n"
+             "of the finished ones, instead of a temporary directory. It is kept if the run fails\n"
+             "or is interrupted, and deleted once the video is written."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its work directory (--work-dir, or\n"
+             "'<output_path>.work' by default), skipping the frames and segments it finished."
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Reuse the previous frame for commits that do not change the visible file content,\n"
+             "repainting only its header with the commit info instead of drawing the files again.\n"
+             "The encoder holds the previous frame and lays the new header over it."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Start each frame from the previous one and repaint only the header and the\n"
+             "files that changed. The frames are identical to fully rendered ones."
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Read frames from the rendered-frame cache and add new frames to it, so reruns with\n"
+             "other encoding options skip rendering. Every new frame is then saved as a PNG file,\n"
+             "even with the stream encoder."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory of the rendered-frame cache used with --cache. Default: {DEFAULT_CACHE_DIR}"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024),
+        help=f"Size cap of the frame cache in MB. Default: {DEFAULT_CACHE_MAX_BYTES // (1024 * 1024)}"
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="Delete every frame in the cache. Exits afterwards unless a repository and output are given."
+    )
+    parser.add_argument(
+        "--jobs",
+        default="1",
+        help="Number of processes used to render frames, or 'auto' for one per CPU core. Default: 1"
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="OUT_JSON",
+        help="Write per-stage timings (git reads, rendering, PNG saving, encoding) to this JSON file:\n"
+             "count, total, mean and p95 time, bytes and frames of each stage."
+    )
+    parser.add_argument(
+        "--cprofile",
+        default=None,
+        metavar="OUT_PROF",
+        help="Run the render and encode loop under cProfile and dump the stats to this file\n"
+             "(read it with 'python -m pstats'). With --jobs > 1, only the main process is covered."
+    )
 
     args = parser.parse_args()
 
-    # Create a temporary directory to store frames
-    temp_dir = tempfile.mkdtemp()
-    print(f"Using temporary directory for frames: {temp_dir}")
+    if args.clear_cache:
+        FrameCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024).clear()
+        print(f"Cleared frame cache: {args.cache_dir}")
+        if args.repo_path is None and args.output_path is None:
+            return
+    if args.repo_path is None or args.output_path is None:
+        parser.error("the following arguments are required: repo_path, output_path")
+
+    # Frames only go to a temporary directory when using the concat or segmented encoder
+    temp_dir = None
+    # Resumable runs keep their frames in a work directory instead
+    checkpoint = None
+    completed = False
+    profile = PipelineProfile() if args.profile else None
+    profiler = None
 
     try:
         # --- 1. Initialize modules ---
@@ -86,6 +236,9 @@ def main():
             "4k": (3840, 2160)
         }
         width, height = resolutions[args.resolution]
+        jobs = resolve_jobs(args.jobs)
+        segments = resolve_jobs(args.segments)
+        segment_jobs = resolve_jobs(args.segment_jobs)
 
         frame_renderer = FrameRenderer(
             width=width,
@@ -94,54 +247,116 @@ def main():
             text_color=args.text_color,
             font_path=args.font_path,
             font_size=args.font_size,
-            no_email=args.no_email
+            no_email=args.no_email,
+            text_backend=args.text_backend
         )
-        git_repo = GitRepo(args.repo_path)
+        path_filter = PathFilter(args.include, args.exclude) if args.include or args.exclude else None
+        git_repo = GitRepo(args.repo_path, path_filter=path_filter, profile=profile)
 
         # --- 2. Get Git history ---
         print(f"Analyzing repository and fetching commit history for branch '{args.branch or git_repo.repo.active_branch.name}'...")
-        history = git_repo.get_commit_history(branch=args.branch)
+        sampling = {'every': args.sample_every, 'period': args.sample_period, 'max_frames': args.max_frames}
+        total_commits = git_repo.count_commits(branch=args.branch, **sampling)
 
-        if not history:
+        if not total_commits:
             print("No commits found in the specified branch. Exiting.")
             return
 
-        print(f"Found {len(history)} commits. Starting frame rendering...")
+        # Commits are streamed, so rendering starts before the whole history is parsed
+        history = git_repo.iter_commit_history(branch=args.branch, **sampling)
+        print(f"Found {total_commits} commits. Starting frame rendering...")
+
+        video_encoder = VideoEncoder(args.output_path, frame_rate=args.fps, format=args.format, profile=profile)
+        encoder = args.encoder
+        if args.work_dir is not None or args.resume:
+            work_dir = args.work_dir or default_work_dir(args.output_path)
+            checkpoint = RunCheckpoint(work_dir, checkpoint_settings(frame_renderer, git_repo, args.dedupe),
+                                       resume=args.resume)
+            print(f"Using work directory: {work_dir}")
+            if checkpoint.resumable_frames:
+                print(f"Resuming: {checkpoint.resumable_frames} frames were finished by an earlier run.")
+            if encoder == "stream":
+                # A stream into FFmpeg cannot be resumed, so the frames are kept on disk
+                print("Frames of a resumable run are saved to the work directory; using the concat encoder.")
+                encoder = "concat"
+        elif encoder != "stream":
+            temp_dir = tempfile.mkdtemp()
+            print(f"Using temporary directory for frames: {temp_dir}")
 
         # --- 3. Render frames for each commit ---
-        frame_paths = []
+        frame_cache = None
+        if args.cache:
+            frame_cache = FrameCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+
+        render_stats = RenderStats()
+        frames = render_frames(history, git_repo, frame_renderer, frame_dir=temp_dir, jobs=jobs,
+                               dedupe=args.dedupe, stats=render_stats, frame_cache=frame_cache,
+                               incremental=args.incremental, checkpoint=checkpoint, profile=profile)
+        if args.cprofile:
+            profiler = cProfile.Profile()
+            profiler.enable()
         
         # Use tqdm if available, otherwise simple progress
         if HAS_TQDM:
-            commit_iterator = tqdm(enumerate(history), total=len(history), desc="Rendering frames", unit="frame")
+            frame_iterator = tqdm(frames, total=total_commits, desc="Rendering frames", unit="frame")
         else:
-            commit_iterator = enumerate(history)
-        
-        for i, commit in commit_iterator:
-            if not HAS_TQDM:
-                progress = f"[{i+1}/{len(history)}]"
-                print(f"{progress} Rendering frame for commit {commit['hash']}...")
-
-            file_contents = git_repo.get_file_tree_at_commit(commit['commit_obj'])
-            frame = frame_renderer.render_frame(commit, file_contents)
-
-            frame_path = os.path.join(temp_dir, f"frame_{i:05d}.png")
-            frame.save(frame_path)
-            frame_paths.append(frame_path)
+            frame_iterator = _print_progress(frames, total_commits)
 
         # --- 4. Encode video from frames ---
-        print("All frames rendered. Starting video encoding...")
-        video_encoder = VideoEncoder(args.output_path, frame_rate=args.fps, format=args.format)
-        video_encoder.create_video_from_frames(frame_paths)
+        if encoder == "stream":
+            # Frames are encoded as they are rendered
+            video_encoder.create_video_from_stream(
+                (frame for _, _, frame in frame_iterator), width, height
+            )
+        else:
+            frame_paths = [frame_path for _, _, frame_path in frame_iterator]
+            print("All frames rendered. Starting video encoding...")
+            if encoder == "segmented":
+                video_encoder.create_video_from_segments(
+                    frame_paths, segments, jobs=segment_jobs,
+                    segment_dir=checkpoint.segment_dir if checkpoint is not None else None)
+            else:
+                video_encoder.create_video_from_frames(frame_paths)
+        if profiler is not None:
+            profiler.disable()
 
+        completed = True
+        if render_stats.frames_resumed:
+            print(f"Reused {render_stats.frames_resumed} of {render_stats.total_frames} frames from the earlier run.")
+        if frame_cache is not None:
+            print(f"Loaded {render_stats.frames_cached} of {render_stats.total_frames} frames from the cache.")
+        if args.dedupe:
+            print(f"Deduplicated {render_stats.frames_deduplicated} of {render_stats.total_frames} frames.")
         print(f"\nTime-lapse video successfully generated at: {args.output_path}")
 
     except (ValueError, FileNotFoundError, RuntimeError) as e:
         print(f"\nAn error occurred: {e}")
     finally:
         # --- 5. Cleanup ---
-        print(f"Cleaning up temporary directory: {temp_dir}")
-        shutil.rmtree(temp_dir)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f"cProfile stats written to: {args.cprofile}")
+        if profile is not None:
+            profile.write(args.profile)
+            print(f"Stage timings written to: {args.profile}")
+        if temp_dir is not None:
+            print(f"Cleaning up temporary directory: {temp_dir}")
+            shutil.rmtree(temp_dir)
+        if checkpoint is not None:
+            if completed:
+                checkpoint.remove()
+            else:
+                checkpoint.close()
+                print(f"Progress is saved in {checkpoint.work_dir}. Run again with --resume to continue.")
+
+def _print_progress(frames, total_commits):
+    """
+    Prints a line per rendered frame, for when tqdm is not available.
+    """
+    for i, commit, frame in frames:
+        print(f"[{i+1}/{total_commits}] Rendered frame for commit {commit['hash']}")
+        yield i, commit, frame
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,212 @@
+"""
+Metrics in the Prometheus text exposition format, without a client library.
+"""
+import os
+import threading
+from bisect import bisect_left
+
+# Content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """A value that only goes up, optionally split by labels."""
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        """
+        Initializes the Counter object.
+
+        :param name: The metric name, ending in _total by convention.
+        :param help_text: The HELP line of the metric.
+        :param labels: The label names; inc then takes one value per name.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Adds a non-negative amount to the counter."""
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Returns the current value for the given labels."""
+        with self._lock:
+            return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def samples(self):
+        """Returns the (suffix, labels, value) samples of the metric."""
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('', dict(zip(self.labels, key)), value) for key, value in values]
+
+
+class Gauge:
+    """A value read when the metrics are collected."""
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text, collect, labels=()):
+        """
+        Initializes the Gauge object.
+
+        :param name: The metric name.
+        :param help_text: The HELP line of the metric.
+        :param collect: Returns the value, or None to leave the metric out. With labels,
+                        returns a dictionary of values by label value tuple instead.
+        :param labels: The label names.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.labels = tuple(labels)
+
+    def samples(self):
+        """Returns the (suffix, labels, value) samples of the metric."""
+        values = self.collect()
+        if values is None:
+            return []
+        if not self.labels:
+            return [('', {}, values)]
+        return [('', dict(zip(self.labels, key)), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Counts observed values in cumulative buckets, with their sum and count."""
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, buckets):
+        """
+        Initializes the Histogram object.
+
+        :param name: The metric name, usually ending in the unit (e.g. _seconds).
+        :param help_text: The HELP line of the metric.
+        :param buckets: The increasing upper bounds of the buckets; +Inf is added.
+        """
+        if list(buckets) != sorted(set(buckets)):
+            raise ValueError("Histogram buckets must be increasing.")
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Adds one value."""
+        self.observe_many((value,))
+
+    def observe_many(self, values):
+        """Adds a sequence of values under a single lock acquisition."""
+        counts = [0] * len(self._counts)
+        total = 0.0
+        for value in values:
+            # A value equal to a bound belongs to that bucket (le means <=)
+            counts[bisect_left(self.buckets, value)] += 1
+            total += value
+        with self._lock:
+            for i, count in enumerate(counts):
+                self._counts[i] += count
+            self._sum += total
+
+    def samples(self):
+        """Returns the (suffix, labels, value) samples of the metric."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            samples.append(('_bucket', {'le': _format_value(float(bound))}, cumulative))
+        samples.append(('_sum', {}, total))
+        samples.append(('_count', {}, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """An ordered set of metrics, rendered together for a scrape."""
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """
+        Adds a metric.
+
+        :return: The metric, so it can be created and registered in one go.
+        """
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"A metric named '{metric.name}' is already registered.")
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Returns every metric in the text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.help_text, quote=False)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{name}="{_escape(str(label))}"' for name, label in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ''
+                lines.append(f"{metric.name}{suffix}{label_text} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def process_rss_bytes():
+    """
+    Returns the resident set size of this process in bytes.
+
+    :return: The size, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def directory_size(path):
+    """Returns the total size of the files under a directory in bytes, or 0 if it does not exist."""
+    total = 0
+    pending = [path]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    # Removed while scanning, e.g. a job's temporary files
+                    continue
+    return total
+
+
+def _escape(text, quote=True):
+    """Escapes a HELP text or label value."""
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _format_value(value):
+    """Formats a sample value or bucket bound."""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return f"{value:.1f}"
+    return repr(value) if isinstance(value, float) else str(int(value))
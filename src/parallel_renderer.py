@@ -0,0 +1,516 @@
+"""
+Frame rendering loop shared by the CLI and the web app, with an optional
+multi-process mode.
+"""
+import multiprocessing
+import os
+from collections import deque
+
+from PIL import Image
+
+from src.git_utils import GitRepo
+from src.frame_renderer import FrameRenderer, IncrementalFrameRenderer
+from src.frame_cache import FrameCache, CACHE_VERSION, save_frame_atomic, link_or_copy
+from src.profiling import PipelineProfile, profile_stage
+from src.video_encoder import HeldFrame, save_header
+
+# Per-process state of pool workers, set up once by _init_worker.
+_worker_repo = None
+_worker_renderer = None
+_worker_incremental = None
+_worker_last_commit = None
+_worker_profile = None
+
+
+def resolve_jobs(jobs):
+    """
+    Converts a --jobs value into a number of worker processes.
+
+    :param jobs: A positive integer (or its string form), or 'auto' for one job per CPU.
+    :return: The number of jobs, at least 1.
+    """
+    if jobs is None:
+        return 1
+    if isinstance(jobs, str) and jobs.strip().lower() == 'auto':
+        return os.cpu_count() or 1
+    try:
+        jobs = int(jobs)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid number of jobs: '{jobs}'. Use a positive integer or 'auto'.")
+    if jobs < 1:
+        raise ValueError(f"Invalid number of jobs: '{jobs}'. Use a positive integer or 'auto'.")
+    return jobs
+
+
+def frame_path_for(frame_dir, index):
+    """Returns the path of the PNG file for a frame index."""
+    return os.path.join(frame_dir, f"frame_{index:05d}.png")
+
+
+def header_path_for(frame_dir, index):
+    """Returns the path of the PNG file for the header of a held frame."""
+    return os.path.join(frame_dir, f"frame_{index:05d}_header.png")
+
+
+class RenderStats:
+    """
+    Counts of the frames produced by render_frames.
+    """
+    def __init__(self):
+        self.frames_rendered = 0
+        self.frames_deduplicated = 0
+        self.frames_cached = 0
+        self.frames_resumed = 0
+
+    @property
+    def total_frames(self):
+        return self.frames_rendered + self.frames_deduplicated + self.frames_cached + self.frames_resumed
+
+
+def render_frames(commits, git_repo, frame_renderer, frame_dir=None, jobs=1, dedupe=False, stats=None,
+                  frame_cache=None, incremental=False, checkpoint=None, profile=None):
+    """
+    Renders one frame per commit and yields the frames in commit order.
+
+    With more than one job, commits are rendered out of order by a pool of
+    worker processes, each with its own GitRepo and FrameRenderer, and the
+    results are handed back in order.
+
+    With dedupe, a commit whose file content area would look the same as the
+    previous frame's is not rendered: its frame is a copy of the previous one
+    with the header repainted (see FrameRenderer.repaint_header). If the content
+    stays where it is, only the new header is made and the frame is a HeldFrame,
+    which the encoder lays over the earlier frame (see FrameRenderer.header_overlay).
+    Held frames are still repainted whole with a frame cache, to be cached.
+
+    With a frame cache, commits already rendered with the same settings are
+    loaded from the cache instead of being rendered, and new frames are added to it.
+
+    With incremental rendering, each frame starts from the previously rendered
+    one and only the header and the files changed since then are repainted
+    (see IncrementalFrameRenderer). In parallel mode every worker does this
+    relative to the last commit it rendered itself.
+
+    With a checkpoint, frames are saved in its work directory, frames an earlier
+    run finished are reused without being rendered, and every frame is recorded
+    as soon as it is yielded, so an interrupted run can be resumed.
+
+    :param commits: An iterable of commit dictionaries, oldest first.
+    :param git_repo: The GitRepo used for single-process rendering.
+    :param frame_renderer: The FrameRenderer used for single-process rendering.
+    :param frame_dir: If set, frames are saved there as PNG files and their paths are yielded.
+    :param jobs: The number of processes to render with.
+    :param dedupe: If True, reuse the previous frame's content area when the visible file content is unchanged.
+    :param stats: An optional RenderStats object that is updated as frames are produced.
+    :param frame_cache: An optional FrameCache to read frames from and store them in.
+    :param incremental: If True, repaint only the parts of a frame that changed since the last rendered one.
+    :param checkpoint: An optional RunCheckpoint, whose frame_dir replaces frame_dir.
+    :param profile: An optional PipelineProfile that times the render_frame and save_frame
+                    stages, in worker processes too. The GitRepo's profile times the git stages.
+    :return: A generator of (index, commit, frame) tuples, where frame is a path or a Pillow Image,
+             or a HeldFrame of them.
+    """
+    if checkpoint is not None:
+        frame_dir = checkpoint.frame_dir
+    output = _FrameOutput(_cache_settings(frame_renderer, git_repo) if frame_cache is not None else None,
+                          frame_dir, dedupe, stats, frame_cache, checkpoint, profile, frame_renderer)
+    if jobs <= 1:
+        frames = _render_serial(commits, git_repo, frame_renderer, output, incremental)
+    else:
+        parallel_renderer = ParallelFrameRenderer(git_repo.repo_path, frame_renderer.settings, jobs, incremental,
+                                                  path_filter=git_repo.path_filter, profile=profile is not None)
+        frames = parallel_renderer.render(commits, output)
+    if checkpoint is not None:
+        frames = _record_frames(frames, checkpoint)
+    return frames
+
+
+def checkpoint_settings(frame_renderer, git_repo, dedupe=False):
+    """
+    Returns everything besides the commit that determines the frames of a run, for a RunCheckpoint.
+
+    With dedupe, some frames reuse an earlier commit's content area, so it is part of the settings.
+    """
+    return dict(_cache_settings(frame_renderer, git_repo), cache_version=CACHE_VERSION, dedupe=dedupe)
+
+
+def _record_frames(frames, checkpoint):
+    """Records each frame in the checkpoint before passing it on."""
+    try:
+        for index, commit, frame in frames:
+            checkpoint.record(index, commit['sha'], frame)
+            yield index, commit, frame
+    finally:
+        frames.close()
+
+
+def _cache_settings(frame_renderer, git_repo):
+    """Returns everything besides the commit that determines a frame, for the frame cache key."""
+    settings = frame_renderer.settings
+    if git_repo.path_filter is not None:
+        # Filtered frames show a subset of the files, so they are cached separately
+        settings = dict(settings, path_filter=git_repo.path_filter.spec)
+    return settings
+
+
+class _FrameOutput:
+    """
+    Turns rendered, cached and held frames into the frames yielded by render_frames.
+
+    Results must be passed in commit order; the previous frame is remembered so
+    held commits can reuse it.
+    """
+    def __init__(self, renderer_settings, frame_dir, dedupe, stats, frame_cache, checkpoint=None, profile=None,
+                 frame_renderer=None):
+        self.frame_renderer = frame_renderer
+        self.frame_dir = frame_dir
+        self.dedupe = dedupe
+        self.stats = stats if stats is not None else RenderStats()
+        self.frame_cache = frame_cache
+        self.checkpoint = checkpoint
+        self.profile = profile
+        self.settings_key = FrameCache.settings_key(renderer_settings) if frame_cache is not None else None
+        self.previous_frame = None
+        # The previous frame as an Image (only the header of a HeldFrame), when it is at hand
+        self.previous_image = None
+
+    def lookup_resumed(self, index, commit):
+        """Returns the frame an earlier run finished for a commit, or None. Must be called in commit order."""
+        if self.checkpoint is None:
+            return None
+        return self.checkpoint.resumed_frame(index, commit['sha'])
+
+    def resumed(self, frame):
+        """Produces the frame for a commit an earlier run finished (a path or a HeldFrame)."""
+        self.stats.frames_resumed += 1
+        self.previous_frame = frame
+        self.previous_image = None
+        return frame
+
+    def lookup(self, commit):
+        """Returns the cached frame path for a commit, or None."""
+        if self.frame_cache is None:
+            return None
+        return self.frame_cache.get(commit['sha'], self.settings_key)
+
+    def cache_path_for(self, commit):
+        """Returns where a newly rendered frame should be cached, or None without a cache."""
+        if self.frame_cache is None:
+            return None
+        return self.frame_cache.path_for(commit['sha'], self.settings_key)
+
+    def cached(self, index, cache_path):
+        """Produces the frame for a cache hit."""
+        self.stats.frames_cached += 1
+        if self.frame_dir is not None:
+            frame = frame_path_for(self.frame_dir, index)
+            link_or_copy(cache_path, frame)
+        else:
+            with Image.open(cache_path) as image:
+                frame = image.convert('RGB')
+        self.previous_frame = frame
+        self.previous_image = frame if self.frame_dir is None else None
+        return frame
+
+    def held(self, index, commit, previous_commit):
+        """
+        Produces the frame for a commit whose content matches the previous frame,
+        by repainting the header of the previous frame (that of previous_commit).
+        """
+        self.stats.frames_deduplicated += 1
+        header = None
+        with profile_stage(self.profile, 'repaint_header') as sample:
+            if self.frame_cache is None:
+                header = self.frame_renderer.header_overlay(self._previous_image(top_only=True), previous_commit,
+                                                            commit)
+            if header is None:
+                image = self.frame_renderer.repaint_header(self._previous_image(), previous_commit, commit)
+            sample.frames = 1
+        if header is not None:
+            return self._held_header(index, header)
+        frame_path = frame_path_for(self.frame_dir, index) if self.frame_dir is not None else None
+        cache_path = self.cache_path_for(commit)
+        frame = _save_frame(image, frame_path, cache_path, self.profile)
+        if cache_path is not None:
+            self.frame_cache.register(cache_path)
+        self.previous_frame = frame
+        self.previous_image = image
+        return frame
+
+    def _held_header(self, index, header):
+        """Produces a HeldFrame of the previous frame (or its base) with a new header."""
+        previous_frame = self.previous_frame
+        base = previous_frame.base if isinstance(previous_frame, HeldFrame) else previous_frame
+        header_frame = header
+        if self.frame_dir is not None:
+            header_frame = header_path_for(self.frame_dir, index)
+            with profile_stage(self.profile, 'save_frame') as sample:
+                save_header(header, header_frame)
+                if self.profile is not None:
+                    sample.byte_count = os.path.getsize(header_frame)
+        frame = HeldFrame(base, header_frame)
+        self.previous_frame = frame
+        self.previous_image = header
+        return frame
+
+    def _previous_image(self, top_only=False):
+        """
+        Returns the previous frame as an Image in RGB mode.
+
+        :param top_only: True if only the rows of a header overlay are used, so the header of a HeldFrame will do.
+        """
+        frame = self.previous_frame
+        if isinstance(frame, HeldFrame):
+            if self.previous_image is None:
+                return frame.to_image()
+            if top_only:
+                return self.previous_image
+            return HeldFrame(frame.base, self.previous_image).to_image()
+        if self.previous_image is not None:
+            return self.previous_image
+        with Image.open(frame) as image:
+            return image.convert('RGB')
+
+    def rendered(self, frame, cache_path=None, image=None):
+        """
+        Produces the frame for a newly rendered commit (an Image or a saved path).
+
+        :param image: The rendered Image, if the frame is a saved path and the Image is at hand.
+        """
+        self.stats.frames_rendered += 1
+        if cache_path is not None:
+            self.frame_cache.register(cache_path)
+        self.previous_frame = frame
+        self.previous_image = frame if isinstance(frame, Image.Image) else image
+        return frame
+
+
+def _render_serial(commits, git_repo, frame_renderer, output, incremental=False):
+    """Renders frames one after another in the current process."""
+    previous_content_key = None
+    previous_commit = None
+    incremental_renderer = IncrementalFrameRenderer(frame_renderer) if incremental else None
+    last_rendered_commit = None
+    for i, commit in enumerate(commits):
+        frame = None
+        resumed_frame = output.lookup_resumed(i, commit)
+        if resumed_frame is not None:
+            frame = output.resumed(resumed_frame)
+        else:
+            cache_path = output.lookup(commit)
+            if cache_path is not None:
+                frame = output.cached(i, cache_path)
+        if frame is not None:
+            # The tree is not read, so the next commit cannot be compared with this one
+            previous_content_key = None
+            if incremental_renderer is not None:
+                incremental_renderer.reset()
+                last_rendered_commit = None
+            previous_commit = commit
+            yield i, commit, frame
+            continue
+
+        # Only the files that fit in the frame are read
+        file_contents = git_repo.get_file_tree_at_commit(commit['commit_obj'], lazy=True)
+        if output.dedupe:
+            content_key = frame_renderer.content_key(commit, file_contents)
+            held = frame_renderer.can_repaint_header(content_key, previous_content_key)
+            previous_content_key = content_key
+            if held:
+                frame = output.held(i, commit, previous_commit)
+                previous_commit = commit
+                yield i, commit, frame
+                continue
+
+        with profile_stage(output.profile, 'render_frame') as sample:
+            if incremental_renderer is not None:
+                frame = _render_incremental(incremental_renderer, git_repo, last_rendered_commit,
+                                            commit, commit['commit_obj'], file_contents)
+                last_rendered_commit = commit['commit_obj']
+            else:
+                frame = frame_renderer.render_frame(commit, file_contents)
+            sample.frames = 1
+        frame_path = frame_path_for(output.frame_dir, i) if output.frame_dir is not None else None
+        cache_path = output.cache_path_for(commit)
+        previous_commit = commit
+        yield i, commit, output.rendered(_save_frame(frame, frame_path, cache_path, output.profile), cache_path, frame)
+
+
+def _render_incremental(incremental_renderer, git_repo, last_rendered_commit, commit, commit_obj, file_contents):
+    """Renders a frame relative to the last rendered commit (from scratch if there is none)."""
+    changed_paths = None
+    if last_rendered_commit is not None:
+        changed_paths = git_repo.get_changed_paths(last_rendered_commit, commit_obj)
+    return incremental_renderer.render_frame(commit, file_contents, changed_paths)
+
+
+def _save_frame(frame, frame_path, cache_path, profile=None):
+    """
+    Writes a rendered frame to the cache and/or the frame directory.
+
+    :param profile: An optional PipelineProfile; encoding the PNG is timed as the save_frame stage.
+    :return: The frame path if one is given, otherwise the Image.
+    """
+    if cache_path is None and frame_path is None:
+        return frame
+    with profile_stage(profile, 'save_frame') as sample:
+        if cache_path is not None:
+            save_frame_atomic(frame, cache_path)
+        if frame_path is not None:
+            if cache_path is not None:
+                link_or_copy(cache_path, frame_path)
+            else:
+                frame.save(frame_path)
+        if profile is not None:
+            sample.byte_count = os.path.getsize(cache_path if cache_path is not None else frame_path)
+    return frame_path if frame_path is not None else frame
+
+
+class _CachedResult:
+    """A pending result for a commit that was found in the frame cache."""
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    def ready(self):
+        return True
+
+
+class _ResumedResult:
+    """A pending result for a commit whose frame an earlier run finished."""
+    def __init__(self, frame):
+        self.frame = frame
+
+    def ready(self):
+        return True
+
+
+class ParallelFrameRenderer:
+    """
+    Renders frames in a pool of worker processes.
+    """
+    def __init__(self, repo_path, renderer_settings, jobs, incremental=False, path_filter=None, profile=False):
+        """
+        Initializes the ParallelFrameRenderer object.
+
+        :param repo_path: Path to the Git repository, opened once in every worker.
+        :param renderer_settings: FrameRenderer keyword arguments, so fonts are loaded once per worker.
+        :param jobs: The number of worker processes.
+        :param incremental: If True, workers repaint only what changed since the last frame they rendered.
+        :param path_filter: An optional PathFilter applied to every worker's GitRepo.
+        :param profile: If True, workers time their stages and send the samples back with each frame.
+        """
+        self.repo_path = repo_path
+        self.renderer_settings = renderer_settings
+        self.jobs = jobs
+        self.incremental = incremental
+        self.path_filter = path_filter
+        self.profile = profile
+        # Bounds the number of frames in flight so results never pile up in memory
+        self.max_pending = jobs * 2
+
+    def render(self, commits, output=None):
+        """
+        Renders commits in parallel and yields the frames in commit order.
+
+        With dedupe, each worker compares its commit with the previous one and
+        skips rendering when the visible file content is unchanged; the header of
+        the previous frame is then repainted here. Cache hits are resolved here and
+        never reach a worker.
+
+        :param commits: An iterable of commit dictionaries, oldest first.
+        :param output: The _FrameOutput describing where frames go, as built by render_frames.
+        :return: A generator of (index, commit, frame) tuples.
+        """
+        if output is None:
+            output = _FrameOutput(None, None, False, None, None)
+        # 'spawn' keeps workers independent of the parent's threads and git processes
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(self.jobs, initializer=_init_worker,
+                          initargs=(self.repo_path, self.renderer_settings, self.incremental,
+                                    self.path_filter, self.profile)) as pool:
+            pending = deque()
+            previous_commit = None
+            for i, commit in enumerate(commits):
+                resumed_frame = output.lookup_resumed(i, commit)
+                cache_path = output.lookup(commit) if resumed_frame is None else None
+                if resumed_frame is not None:
+                    result = _ResumedResult(resumed_frame)
+                elif cache_path is not None:
+                    result = _CachedResult(cache_path)
+                else:
+                    frame_path = frame_path_for(output.frame_dir, i) if output.frame_dir is not None else None
+                    task = (_picklable_commit(commit), _picklable_commit(previous_commit) if output.dedupe and
+                            previous_commit is not None else None, frame_path, output.cache_path_for(commit))
+                    result = pool.apply_async(_render_task, (task,))
+                # A held frame is made from the frame of the commit before it
+                pending.append((i, commit, result, previous_commit))
+                previous_commit = commit
+                while len(pending) >= self.max_pending or (pending and pending[0][2].ready()):
+                    index, pending_commit, result, pending_previous = pending.popleft()
+                    yield index, pending_commit, self._collect(index, pending_commit, result, output, pending_previous)
+            while pending:
+                index, pending_commit, result, pending_previous = pending.popleft()
+                yield index, pending_commit, self._collect(index, pending_commit, result, output, pending_previous)
+
+    @staticmethod
+    def _collect(index, commit, result, output, previous_commit):
+        """Waits for a result and turns it into the frame to yield."""
+        if isinstance(result, _ResumedResult):
+            return output.resumed(result.frame)
+        if isinstance(result, _CachedResult):
+            return output.cached(index, result.cache_path)
+        frame, samples = result.get()
+        if samples and output.profile is not None:
+            output.profile.merge(samples)
+        if frame is None:
+            return output.held(index, commit, previous_commit)
+        return output.rendered(frame, output.cache_path_for(commit))
+
+
+def _picklable_commit(commit):
+    """Returns the commit metadata without the live GitPython object."""
+    return {key: value for key, value in commit.items() if key != 'commit_obj'}
+
+
+def _init_worker(repo_path, renderer_settings, incremental=False, path_filter=None, profile=False):
+    """Opens the repository and loads fonts once per worker process."""
+    global _worker_repo, _worker_renderer, _worker_incremental, _worker_profile
+    _worker_profile = PipelineProfile() if profile else None
+    _worker_repo = GitRepo(repo_path, path_filter=path_filter, profile=_worker_profile)
+    _worker_renderer = FrameRenderer(**renderer_settings)
+    _worker_incremental = IncrementalFrameRenderer(_worker_renderer) if incremental else None
+
+
+def _render_task(task):
+    """
+    Renders a single commit inside a worker process.
+
+    :return: A tuple of the frame, or None when the previous commit's file content
+             area would look the same, and the worker's profile samples (or None).
+    """
+    frame = _render_commit(*task)
+    return frame, _worker_profile.drain() if _worker_profile is not None else None
+
+
+def _render_commit(commit, previous_commit, frame_path, cache_path):
+    """Renders and saves the frame of a commit in a worker process, or returns None for a held frame."""
+    global _worker_last_commit
+    commit_obj = _worker_repo.repo.commit(commit['sha'])
+    file_contents = _worker_repo.get_file_tree_at_commit(commit_obj, lazy=True)
+    if previous_commit is not None:
+        content_key = _worker_renderer.content_key(commit, file_contents)
+        if content_key is not None:
+            previous_contents = _worker_repo.get_file_tree_at_commit(
+                _worker_repo.repo.commit(previous_commit['sha']), lazy=True)
+            if _worker_renderer.can_repaint_header(content_key,
+                                                   _worker_renderer.content_key(previous_commit, previous_contents)):
+                return None
+    with profile_stage(_worker_profile, 'render_frame') as sample:
+        if _worker_incremental is not None:
+            frame = _render_incremental(_worker_incremental, _worker_repo, _worker_last_commit,
+                                        commit, commit_obj, file_contents)
+            _worker_last_commit = commit_obj
+        else:
+            frame = _worker_renderer.render_frame(commit, file_contents)
+        sample.frames = 1
+    return _save_frame(frame, frame_path, cache_path, _worker_profile)
@@ -0,0 +1,153 @@
+"""
+Glob include/exclude filters for the paths shown in a time-lapse.
+"""
+import re
+
+# Characters that make a pattern segment a wildcard rather than a literal name.
+_WILDCARD_CHARS = '*?['
+
+
+class PathFilter:
+    """
+    Selects files by glob patterns, with the semantics of git's ``:(glob)`` pathspecs.
+
+    ``*`` and ``?`` do not match ``/``, ``**/`` matches any number of directories
+    and a trailing ``/**`` everything inside a directory. A pattern without
+    wildcards also matches everything below it, so ``services/billing`` selects
+    that directory. A file is selected when it matches an include pattern (or
+    there are none) and no exclude pattern.
+
+    The same patterns are passed to git as pathspecs, so the history walk only
+    visits commits that touch selected files, and directories that cannot
+    contain a selected file are never read while walking a tree.
+    """
+    def __init__(self, include=None, exclude=None):
+        """
+        Initializes the PathFilter object.
+
+        :param include: Glob patterns of the paths to show. Everything is shown if empty.
+        :param exclude: Glob patterns of the paths to hide.
+        :raises ValueError: If a pattern is empty.
+        """
+        self.include = [_normalize_pattern(pattern) for pattern in include or ()]
+        self.exclude = [_normalize_pattern(pattern) for pattern in exclude or ()]
+        self._include = [_Pattern(pattern) for pattern in self.include]
+        self._exclude = [_Pattern(pattern) for pattern in self.exclude]
+
+    @property
+    def spec(self):
+        """The patterns as a JSON-serializable dictionary."""
+        return {'include': list(self.include), 'exclude': list(self.exclude)}
+
+    def pathspecs(self):
+        """
+        Returns the patterns as git pathspec arguments, to be passed after ``--``.
+        """
+        return [f":(glob){pattern}" for pattern in self.include] + \
+               [f":(glob,exclude){pattern}" for pattern in self.exclude]
+
+    def matches(self, path):
+        """
+        Checks whether a file is selected.
+
+        :param path: The path of a file, relative to the repository root.
+        """
+        if self._include and not any(pattern.matches(path) for pattern in self._include):
+            return False
+        return not any(pattern.matches(path) for pattern in self._exclude)
+
+    def may_contain(self, directory):
+        """
+        Checks whether a directory can contain a selected file, so it is worth reading.
+
+        :param directory: The path of a directory, relative to the repository root.
+        """
+        if any(pattern.covers(directory) for pattern in self._exclude):
+            return False
+        return not self._include or any(pattern.may_match_below(directory) for pattern in self._include)
+
+
+class _Pattern:
+    """A single compiled glob pattern."""
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.literal = not any(char in pattern for char in _WILDCARD_CHARS)
+        self.regex = re.compile(_glob_to_regex(pattern))
+        self.segments = [re.compile(_glob_to_regex(segment)) if segment != '**' else None
+                         for segment in pattern.split('/')]
+        # The directory whose whole content the pattern matches, e.g. 'docs' for 'docs/**'
+        covered = pattern if self.literal else pattern[:-3] if pattern.endswith('/**') else None
+        self.covered = re.compile(_glob_to_regex(covered)) if covered else None
+
+    def matches(self, path):
+        if self.regex.fullmatch(path):
+            return True
+        return self.literal and path.startswith(self.pattern + '/')
+
+    def covers(self, directory):
+        """Whether every file below the directory matches."""
+        if self.covered is None:
+            return False
+        parts = directory.split('/')
+        return any(self.covered.fullmatch('/'.join(parts[:i])) for i in range(1, len(parts) + 1))
+
+    def may_match_below(self, directory):
+        """Whether some file below the directory could match."""
+        parts = directory.split('/')
+        for i, part in enumerate(parts):
+            if i == len(self.segments):
+                # The whole pattern matched a leading directory, which selects its content if literal
+                return self.literal
+            segment = self.segments[i]
+            if segment is None:
+                return True
+            if not segment.fullmatch(part):
+                return False
+        # With segments left, deeper paths can match; otherwise the pattern names the directory itself
+        return len(parts) < len(self.segments) or self.literal
+
+
+def _normalize_pattern(pattern):
+    """Strips the leading and trailing slashes git ignores in a pathspec."""
+    normalized = pattern.strip().strip('/')
+    if not normalized:
+        raise ValueError(f"Invalid path pattern: '{pattern}'.")
+    return normalized
+
+
+def _glob_to_regex(pattern):
+    """Translates a glob pattern into a regular expression for whole paths."""
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        char = pattern[i]
+        at_segment_start = i == 0 or pattern[i - 1] == '/'
+        if at_segment_start and pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif at_segment_start and pattern[i:] == '**':
+            out.append('.*')
+            i += 2
+        elif char == '*':
+            out.append('[^/]*')
+            while i < n and pattern[i] == '*':
+                i += 1
+        elif char == '?':
+            out.append('[^/]')
+            i += 1
+        elif char == '[':
+            end = pattern.find(']', i + 2 if pattern.startswith('[!', i) or pattern.startswith('[^', i) else i + 1)
+            if end == -1:
+                out.append(re.escape(char))
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end + 1
+        else:
+            out.append(re.escape(char))
+            i += 1
+    return ''.join(out)
@@ -0,0 +1,133 @@
+"""
+Cached preview images of a repository's latest commit, for the web app.
+"""
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+
+# Image formats a preview can be encoded in: Pillow format, MIME type and save options.
+# Lossless WebP keeps text crisp and is a fraction of the size of a PNG.
+PREVIEW_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'lossless': True}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 90}),
+    'png': ('PNG', 'image/png', {}),
+}
+
+# Default memory budget for encoded preview images (64 MB).
+DEFAULT_PREVIEW_CACHE_BYTES = 64 * 1024 * 1024
+
+# Default number of renderers kept, one per combination of render settings.
+DEFAULT_MAX_RENDERERS = 4
+
+
+class PreviewCache:
+    """
+    A thread-safe LRU cache of encoded preview images and of the renderers that draw them.
+
+    A preview is keyed by the commit SHA, the render settings, the path filter
+    and the image format. Commits are immutable, so an entry never goes stale
+    and its key doubles as the HTTP ETag. Renderers are kept per render
+    settings, so fonts are loaded once rather than on every request.
+    """
+    def __init__(self, renderer_factory, max_bytes=DEFAULT_PREVIEW_CACHE_BYTES, max_renderers=DEFAULT_MAX_RENDERERS):
+        """
+        Initializes the PreviewCache object.
+
+        :param renderer_factory: Called with the render settings as keyword arguments to create a FrameRenderer.
+        :param max_bytes: Approximate memory budget for encoded images, in bytes.
+        :param max_renderers: The number of renderers kept.
+        """
+        self.renderer_factory = renderer_factory
+        self.max_bytes = max_bytes
+        self.max_renderers = max_renderers
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()  # etag -> encoded image
+        self._renderers = OrderedDict()  # settings key -> (renderer, lock)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(sha, settings, path_filter, image_format):
+        """
+        Returns the key of a preview, which is also its ETag.
+
+        :param sha: The full SHA of the commit shown.
+        :param settings: The keyword arguments of the FrameRenderer.
+        :param path_filter: The PathFilter the files were selected with, or None.
+        :param image_format: One of PREVIEW_FORMATS.
+        """
+        key = json.dumps([sha, settings, path_filter.spec if path_filter else None, image_format],
+                         sort_keys=True, default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_image(self, git_repo, commit_info, settings, image_format):
+        """
+        Returns a preview of a commit, rendering and encoding it on a miss.
+
+        :param git_repo: The GitRepo the commit belongs to.
+        :param commit_info: A commit dictionary, as returned by GitRepo.get_latest_commit.
+        :param settings: The keyword arguments of the FrameRenderer.
+        :param image_format: One of PREVIEW_FORMATS.
+        :return: A tuple of the encoded image and its ETag.
+        """
+        if image_format not in PREVIEW_FORMATS:
+            raise ValueError(f"Unsupported preview format: '{image_format}'. "
+                             f"Use one of: {', '.join(PREVIEW_FORMATS)}.")
+        etag = self.etag(commit_info['sha'], settings, git_repo.path_filter, image_format)
+        with self._lock:
+            data = self._images.get(etag)
+            if data is not None:
+                self._images.move_to_end(etag)
+                self.hits += 1
+                return data, etag
+            self.misses += 1
+
+        renderer, renderer_lock = self._get_renderer(settings)
+        file_contents = git_repo.get_file_tree_at_commit(commit_info['commit_obj'], lazy=True)
+        with renderer_lock:
+            frame = renderer.render_frame(commit_info, file_contents)
+        pil_format, _, save_options = PREVIEW_FORMATS[image_format]
+        buffered = io.BytesIO()
+        frame.save(buffered, format=pil_format, **save_options)
+        data = buffered.getvalue()
+        self._put(etag, data)
+        return data, etag
+
+    def clear(self):
+        """Removes all images and renderers from the cache."""
+        with self._lock:
+            self._images.clear()
+            self._renderers.clear()
+            self.current_bytes = 0
+
+    def _get_renderer(self, settings):
+        """Returns the renderer for some render settings and the lock that guards it, creating it if needed."""
+        key = json.dumps(settings, sort_keys=True, default=str)
+        with self._lock:
+            entry = self._renderers.get(key)
+            if entry is not None:
+                self._renderers.move_to_end(key)
+                return entry
+        # Loading fonts can take a while, so it happens outside the lock
+        entry = (self.renderer_factory(**settings), threading.Lock())
+        with self._lock:
+            entry = self._renderers.setdefault(key, entry)
+            while len(self._renderers) > self.max_renderers:
+                self._renderers.popitem(last=False)
+        return entry
+
+    def _put(self, etag, data):
+        """Stores an encoded image, evicting least recently used images if needed."""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if etag in self._images:
+                return
+            self._images[etag] = data
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.current_bytes -= len(evicted)
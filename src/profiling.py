@@ -0,0 +1,193 @@
+"""
+Per-stage timing of the generation pipeline.
+"""
+import json
+import threading
+import time
+from array import array
+from contextlib import contextmanager, nullcontext
+
+# Stages recorded by the pipeline, in pipeline order. Stages can nest: files are
+# read lazily while a frame is drawn, so render_frame includes read_blob time.
+STAGES = (
+    'commit_history',  # parsing each commit's metadata from git log
+    'file_tree',       # listing the files of a commit's tree
+    'read_blob',       # reading and decoding a file missing from the blob cache
+    'render_frame',    # drawing a frame (FrameRenderer.render_frame)
+    'repaint_header',  # repainting the header of a held frame (FrameRenderer.repaint_header)
+    'save_frame',      # writing a frame to a PNG file (Image.save)
+    'encode_write',    # sending a frame to a streaming FFmpeg process
+    'encode',          # FFmpeg encoding frame files, or finishing a stream
+)
+
+
+class StageSample:
+    """What a timed block reports besides its duration."""
+    __slots__ = ('byte_count', 'frames')
+
+    def __init__(self, byte_count=0, frames=0):
+        self.byte_count = byte_count
+        self.frames = frames
+
+
+class _StageStats:
+    """The durations and totals of one stage."""
+    __slots__ = ('durations', 'byte_count', 'frames')
+
+    def __init__(self):
+        self.durations = array('d')
+        self.byte_count = 0
+        self.frames = 0
+
+
+class PipelineProfile:
+    """
+    Thread-safe timings of the stages of a generation run.
+
+    Each timed block adds one sample to its stage: the duration, the bytes it
+    read or wrote and the frames it produced. Durations are kept (8 bytes each)
+    so percentiles are exact.
+    """
+    def __init__(self, clock=time.perf_counter):
+        """
+        Initializes the PipelineProfile object.
+
+        :param clock: Returns the current time in seconds.
+        """
+        self.clock = clock
+        self.started = clock()
+        self.stopped = None
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a block as one sample of a stage.
+
+        :param name: The stage, usually one of STAGES.
+        :return: A StageSample whose byte_count and frames the block can set.
+        """
+        sample = StageSample()
+        start = self.clock()
+        try:
+            yield sample
+        finally:
+            self.record(name, self.clock() - start, sample.byte_count, sample.frames)
+
+    def record(self, name, seconds, byte_count=0, frames=0):
+        """Adds one sample to a stage."""
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = _StageStats()
+            stats.durations.append(seconds)
+            stats.byte_count += byte_count
+            stats.frames += frames
+
+    def stop(self):
+        """Ends the wall time of the run; stages can still be recorded."""
+        if self.stopped is None:
+            self.stopped = self.clock()
+
+    def stage_samples(self, name):
+        """
+        Returns the samples of one stage.
+
+        :return: The durations in seconds (an array of doubles), total bytes and total frames.
+        """
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                return array('d'), 0, 0
+            return array('d', stats.durations), stats.byte_count, stats.frames
+
+    def drain(self):
+        """
+        Returns the samples recorded so far and forgets them, e.g. to send them from a worker process.
+
+        :return: A picklable dictionary for merge.
+        """
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        return {name: (stats.durations.tobytes(), stats.byte_count, stats.frames) for name, stats in stages.items()}
+
+    def merge(self, drained):
+        """Adds the samples returned by another profile's drain."""
+        with self._lock:
+            for name, (durations, byte_count, frames) in drained.items():
+                stats = self._stages.get(name)
+                if stats is None:
+                    stats = self._stages[name] = _StageStats()
+                stats.durations.frombytes(durations)
+                stats.byte_count += byte_count
+                stats.frames += frames
+
+    def to_dict(self):
+        """
+        Summarizes the stages.
+
+        :return: A JSON-serializable dictionary with the wall time and, per stage,
+                 the count, total seconds, mean and p95 milliseconds, bytes and frames.
+        """
+        with self._lock:
+            stages = {name: (sorted(stats.durations), stats.byte_count, stats.frames)
+                      for name, stats in self._stages.items()}
+            wall = (self.stopped if self.stopped is not None else self.clock()) - self.started
+        order = {name: i for i, name in enumerate(STAGES)}
+        summary = {}
+        for name in sorted(stages, key=lambda name: (order.get(name, len(order)), name)):
+            durations, byte_count, frames = stages[name]
+            total = sum(durations)
+            summary[name] = {
+                'count': len(durations),
+                'total_s': round(total, 6),
+                'mean_ms': round(total / len(durations) * 1000, 3),
+                'p95_ms': round(durations[max(0, -(-len(durations) * 95 // 100) - 1)] * 1000, 3),
+                'bytes': byte_count,
+                'frames': frames,
+            }
+        return {'wall_s': round(wall, 6), 'stages': summary}
+
+    def write(self, path):
+        """Writes the summary to a JSON file."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def profile_stage(profile, name):
+    """
+    Times a block as a stage of a profile, or does nothing if profile is None.
+
+    :return: A context manager giving a StageSample.
+    """
+    if profile is None:
+        return nullcontext(StageSample())
+    return profile.stage(name)
+
+
+def profile_iterator(iterable, profile, name):
+    """
+    Yields the items of an iterable, timing the production of each item as a stage sample.
+
+    :param iterable: The iterable, e.g. a generator that parses as it goes.
+    :param profile: A PipelineProfile, or None to yield the items untimed.
+    :param name: The stage.
+    """
+    if profile is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = profile.clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            profile.record(name, profile.clock() - start)
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,177 @@
+"""
+Pool of repository handles shared by the web app's requests and jobs.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from src.git_utils import BlobCache, RepoIndex
+
+# Seconds an unused handle is kept before its git helper processes are stopped.
+DEFAULT_IDLE_TIMEOUT = 300
+
+# Default number of unused handles kept per repository.
+DEFAULT_MAX_IDLE_HANDLES = 4
+
+
+class _PoolEntry:
+    """The handles and caches of one repository."""
+    __slots__ = ('key', 'blob_cache', 'repo_index', 'idle', 'in_use', 'last_used')
+
+    def __init__(self, key, now):
+        self.key = key
+        self.blob_cache = BlobCache()
+        self.repo_index = RepoIndex()
+        self.idle = []  # (handle, time it was released)
+        self.in_use = 0
+        self.last_used = now
+
+
+class RepoPool:
+    """
+    A thread-safe pool of GitRepo handles, keyed by the real path of the repository.
+
+    GitPython's helper processes cannot be shared between threads, so a handle
+    is used by one caller at a time: it is checked out with acquire (or the
+    repo context manager) and returned with release. All handles of a
+    repository share one BlobCache and one RepoIndex, so blobs, resolved refs
+    and commit metadata are read once for every request.
+
+    Handles unused for idle_timeout seconds are closed, stopping their git
+    processes, by a background thread; a repository without handles left has
+    its caches dropped as well.
+    """
+    def __init__(self, repo_factory, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_idle=DEFAULT_MAX_IDLE_HANDLES,
+                 clock=time.monotonic):
+        """
+        Initializes the RepoPool object.
+
+        :param repo_factory: Called with the repository path and the blob_cache and
+                             repo_index keyword arguments to create a GitRepo.
+        :param idle_timeout: Seconds an unused handle is kept.
+        :param max_idle: The most unused handles kept per repository; extra handles are closed when released.
+        :param clock: Returns the current time in seconds.
+        """
+        if idle_timeout <= 0:
+            raise ValueError(f"Invalid idle timeout: '{idle_timeout}'. Use a positive number of seconds.")
+        self.repo_factory = repo_factory
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.clock = clock
+        self._entries = {}
+        self._owners = {}  # id(handle) -> entry, for handles checked out
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    @contextmanager
+    def repo(self, repo_path, path_filter=None):
+        """
+        Checks out a handle for the duration of a with block.
+
+        :param repo_path: Path to the Git repository.
+        :param path_filter: The PathFilter the handle applies, or None.
+        """
+        git_repo = self.acquire(repo_path, path_filter)
+        try:
+            yield git_repo
+        finally:
+            self.release(git_repo)
+
+    def acquire(self, repo_path, path_filter=None):
+        """
+        Checks out a handle of a repository, opening a new one if none is unused.
+
+        :param repo_path: Path to the Git repository.
+        :param path_filter: The PathFilter the handle applies, or None.
+        :return: A GitRepo, to be given back with release.
+        :raises ValueError: If the path is not a Git repository.
+        :raises FileNotFoundError: If the path does not exist.
+        """
+        key = os.path.realpath(repo_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _PoolEntry(key, self.clock())
+            entry.in_use += 1
+            git_repo = entry.idle.pop()[0] if entry.idle else None
+        if git_repo is None:
+            try:
+                git_repo = self.repo_factory(repo_path, blob_cache=entry.blob_cache, repo_index=entry.repo_index)
+            except Exception:
+                with self._lock:
+                    entry.in_use -= 1
+                raise
+        git_repo.path_filter = path_filter
+        with self._lock:
+            self._owners[id(git_repo)] = entry
+        return git_repo
+
+    def release(self, git_repo):
+        """
+        Gives back a handle checked out with acquire.
+
+        :param git_repo: The GitRepo returned by acquire.
+        """
+        git_repo.path_filter = None
+        with self._lock:
+            entry = self._owners.pop(id(git_repo), None)
+            if entry is not None:
+                now = self.clock()
+                entry.in_use -= 1
+                entry.last_used = now
+                if self._entries.get(entry.key) is entry and len(entry.idle) < self.max_idle:
+                    entry.idle.append((git_repo, now))
+                    git_repo = None
+                self._start_sweeper()
+        if git_repo is not None:
+            git_repo.close()
+
+    def evict_idle(self):
+        """
+        Closes the handles that have been unused for idle_timeout seconds.
+
+        :return: The number of handles closed.
+        """
+        now = self.clock()
+        expired = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                kept = [(git_repo, released) for git_repo, released in entry.idle
+                        if now - released < self.idle_timeout]
+                expired.extend(git_repo for git_repo, released in entry.idle if now - released >= self.idle_timeout)
+                entry.idle = kept
+                if not entry.idle and not entry.in_use and now - entry.last_used >= self.idle_timeout:
+                    del self._entries[key]
+        for git_repo in expired:
+            git_repo.close()
+        return len(expired)
+
+    @property
+    def idle_count(self):
+        """The number of unused handles kept."""
+        with self._lock:
+            return sum(len(entry.idle) for entry in self._entries.values())
+
+    def close(self):
+        """Closes every unused handle and drops all caches. Handles checked out are closed when released."""
+        with self._lock:
+            idle = [git_repo for entry in self._entries.values() for git_repo, _ in entry.idle]
+            self._entries.clear()
+        for git_repo in idle:
+            git_repo.close()
+
+    def _start_sweeper(self):
+        """Starts the thread that evicts idle handles, if it is not running. Called with the lock held."""
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep, name="repo-pool-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep(self):
+        """Sweeper thread loop: evicts idle handles a few times per idle timeout."""
+        while True:
+            time.sleep(max(self.idle_timeout / 4, 1))
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"Warning: Could not close idle repository handles: {e}")
@@ -1,19 +1,116 @@
+import hashlib
 import subprocess
 import shutil
 import tempfile
+import threading
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from src.profiling import profile_stage
+
+# Keyframe interval of segmented encoding (x264's default). Every segment holds a
+# whole number of these groups of pictures, so it starts on a keyframe.
+SEGMENT_GOP_FRAMES = 250
+
+# Most frames a GIF palette is made from. They are spread evenly over the video.
+GIF_PALETTE_SAMPLE_FRAMES = 32
+
+# Seconds between checks for a cancelled encode while an FFmpeg process runs
+CANCEL_POLL_SECONDS = 0.2
+
+# Frame rate the image demuxer reads each file of a concat list with. Timestamps are
+# rounded to its frames, so lists for faster videos set their own rate on every entry.
+IMAGE_DEMUXER_FRAME_RATE = 25
+
+# FFmpeg processes started by the encoders of this process that have not exited yet
+_active_processes = 0
+_active_processes_lock = threading.Lock()
+
+
+def active_ffmpeg_processes():
+    """Returns the number of FFmpeg encoding processes running for this process."""
+    return _active_processes
+
+
+def _count_process(delta):
+    """Adds delta to the number of running FFmpeg processes."""
+    global _active_processes
+    with _active_processes_lock:
+        _active_processes += delta
+
+
+class HeldFrame:
+    """
+    A frame that is an earlier frame with another header over its top rows.
+
+    A deduplicated commit only changes the header of the frame before it, so
+    the encoder gets that frame again, which it holds on screen without reading
+    it again, and a strip of the top rows to lay over it (see FrameRenderer.header_overlay).
+
+    The base and the header are both paths of PNG files or both Pillow Images, like
+    the other frames of the video. Header files have an alpha channel (see save_header),
+    and all headers of a video are as wide as the frames and as high as each other.
+    """
+    def __init__(self, base, header):
+        """
+        Initializes the HeldFrame object.
+
+        :param base: The whole frame the header is laid over.
+        :param header: The top rows of the held frame.
+        """
+        self.base = base
+        self.header = header
+
+    def to_image(self):
+        """Returns the whole frame as a Pillow Image in RGB mode."""
+        image = _rgb_image(self.base)
+        if image is self.base:
+            image = image.copy()
+        image.paste(_rgb_image(self.header), (0, 0))
+        return image
+
+
+def save_header(header, header_path):
+    """
+    Saves the header of a HeldFrame as a PNG file for create_video_from_frames.
+
+    It gets an alpha channel, so it is read in the same pixel format as the
+    transparent image listed for frames without a header.
+    """
+    header.convert('RGBA').save(header_path)
+
+
+def _frame_files(frame):
+    """Returns the files a frame path or a HeldFrame of paths is read from."""
+    if isinstance(frame, HeldFrame):
+        return frame.base, frame.header
+    return frame,
+
+
+def _rgb_image(frame):
+    """Returns a frame path or Pillow Image as an Image in RGB mode."""
+    if isinstance(frame, Image.Image):
+        return frame if frame.mode == 'RGB' else frame.convert('RGB')
+    with Image.open(frame) as image:
+        return image.convert('RGB')
+
 
 class VideoEncoder:
     """
     A class to encode a sequence of frames into a video file using FFmpeg.
     """
-    def __init__(self, output_path, frame_rate=10, format='mp4'):
+    def __init__(self, output_path, frame_rate=10, format='mp4', profile=None, cancel_check=None):
         """
         Initializes the VideoEncoder object.
 
         :param output_path: The path to the output video file.
         :param frame_rate: The frame rate of the video.
         :param format: The format of the video ('mp4', 'gif', etc.).
+        :param profile: An optional PipelineProfile that times the encode and encode_write stages.
+        :param cancel_check: An optional callable that raises to stop the encode. It is called
+                             while FFmpeg runs, which is killed before the exception propagates.
         """
         if not self.is_ffmpeg_installed():
             raise RuntimeError("FFmpeg is not installed or not found in the system's PATH. Please install it to use this feature.")
@@ -21,6 +118,17 @@ class VideoEncoder:
         self.output_path = output_path
         self.frame_rate = frame_rate
         self.format = format.lower()
+        self.profile = profile
+        self.cancel_check = cancel_check
+        self._process = None
+        self._stderr_chunks = []
+        self._stderr_thread = None
+        self._frame_size = None
+        self._last_frame = None
+        self._last_buffer = None
+        self._gif_frame_dir = None
+        self._gif_frames = None
+        self._last_frame_path = None
 
     @staticmethod
     def is_ffmpeg_installed():
@@ -34,70 +142,654 @@ class VideoEncoder:
         """
         Creates a video from a sequence of frame images.
 
-        :param frame_paths: A list of paths to the frame images.
+        Consecutive repeats of the same path are written as a single entry that is
+        held on screen for several frame durations, instead of being decoded again.
+        So is the base of a HeldFrame, and FFmpeg lays its header over it.
+
+        :param frame_paths: A list of paths to the frame images, or HeldFrames of paths.
         """
         if not frame_paths:
             print("Warning: No frames provided to create video.")
             return
 
-        # Using a temporary file to list the input frames is safer for many files
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt', encoding='utf-8') as tmpfile:
-            for frame_path in frame_paths:
-                # Path needs to be absolute and properly escaped for ffmpeg
-                tmpfile.write(f"file '{os.path.abspath(frame_path)}'\n")
-            list_filepath = tmpfile.name
+        list_dir = tempfile.mkdtemp()
+        try:
+            list_filepath, header_list, has_held_frames = self._write_frame_lists(frame_paths, list_dir)
 
-        print(f"Generating video: {self.output_path}")
+            print(f"Generating video: {self.output_path}")
 
-        command = self._build_ffmpeg_command(list_filepath)
+            with profile_stage(self.profile, 'encode') as sample:
+                palette_path = None
+                if self.format == 'gif':
+                    palette_path = self._make_gif_palette(frame_paths, list_dir)
+                command = self._build_ffmpeg_command(list_filepath, with_durations=has_held_frames,
+                                                     palette_path=palette_path, header_list=header_list,
+                                                     frame_count=len(frame_paths))
+                self._run_ffmpeg(command)
+                sample.frames = len(frame_paths)
+            print(f"Video created successfully: {self.output_path}")
+        finally:
+            shutil.rmtree(list_dir, ignore_errors=True)
+
+    def _make_gif_palette(self, frame_paths, palette_dir):
+        """
+        Makes a GIF palette from at most GIF_PALETTE_SAMPLE_FRAMES distinct frames, spread evenly.
+
+        FFmpeg only keeps a color histogram while doing this, and the GIF is then
+        encoded in a single pass with the finished palette, so memory use does not
+        grow with the number of frames.
+
+        :param frame_paths: A list of paths to the frame images, or HeldFrames of paths.
+        :param palette_dir: The directory to write the palette image to.
+        :return: The path of the palette image.
+        """
+        # Headers have the colors of the frames they are laid over
+        distinct = list(dict.fromkeys(_frame_files(frame_path)[0] for frame_path in frame_paths))
+        sample = [distinct[i] for i in self._palette_sample(len(distinct))]
+        sample_list = os.path.join(palette_dir, 'sample.txt')
+        with open(sample_list, 'w', encoding='utf-8') as f:
+            for frame_path in sample:
+                f.write(f"file '{os.path.abspath(frame_path)}'\n")
+        palette_path = os.path.join(palette_dir, 'palette.png')
+        self._run_ffmpeg(self._build_gif_palette_command(['-f', 'concat', '-safe', '0', '-i', sample_list],
+                                                         palette_path))
+        return palette_path
 
+    @staticmethod
+    def _palette_sample(count):
+        """Returns the indexes of at most GIF_PALETTE_SAMPLE_FRAMES of count frames, spread evenly."""
+        step = max(1, count / GIF_PALETTE_SAMPLE_FRAMES)
+        return [int(i * step) for i in range(min(count, GIF_PALETTE_SAMPLE_FRAMES))]
+
+    @staticmethod
+    def _build_gif_palette_command(input_args, palette_path):
+        """
+        Builds the FFmpeg command that makes one palette image from all frames of an input.
+        """
+        return ['ffmpeg', '-y'] + input_args + ['-vf', 'palettegen=stats_mode=full', '-update', '1',
+                                                palette_path]
+
+    def create_video_from_segments(self, frame_paths, segments, jobs=None, segment_dir=None):
+        """
+        Creates an MP4 video by encoding chunks of the frames in parallel and joining them.
+
+        The frames are split into at most ``segments`` consecutive chunks whose
+        lengths are multiples of SEGMENT_GOP_FRAMES, and each chunk is encoded by
+        its own FFmpeg process with the same x264 settings as a single pass and a
+        fixed keyframe interval. The chunks are then joined with the concat
+        demuxer and stream copy, without re-encoding, so the result plays like a
+        single-pass encode. Other formats are encoded in a single pass.
+
+        Segments written to a given segment_dir are kept, named after their frames
+        (paths, sizes and modification times) and settings, so a rerun after a
+        crash only encodes the segments that were not finished.
+
+        :param frame_paths: A list of paths to the frame images, or HeldFrames of paths. Repeated paths
+                            are held frames.
+        :param segments: The maximum number of chunks.
+        :param jobs: The number of FFmpeg processes running at the same time. Defaults to segments.
+        :param segment_dir: A directory to keep finished segments in. A temporary directory is used if None.
+        """
+        if segments < 1:
+            raise ValueError(f"Invalid number of segments: '{segments}'. Use a positive integer.")
+        chunks = self._split_segments(frame_paths, segments)
+        if self.format != 'mp4' or len(chunks) < 2:
+            if self.format != 'mp4':
+                print(f"Warning: Segmented encoding only supports mp4; encoding the {self.format} in a single pass.")
+            self.create_video_from_frames(frame_paths)
+            return
+
+        jobs = min(jobs or len(chunks), len(chunks))
+        # The encoders share the CPU cores instead of each starting a thread per core
+        threads = max(1, (os.cpu_count() or 1) // jobs)
+        keep_segments = segment_dir is not None
+        if keep_segments:
+            os.makedirs(segment_dir, exist_ok=True)
+        else:
+            segment_dir = tempfile.mkdtemp()
+        print(f"Generating video: {self.output_path} ({len(chunks)} segments, {jobs} at a time)")
         try:
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            if result.stdout:
-                print("FFmpeg output:\n", result.stdout)
-            if result.stderr:
-                print("FFmpeg info/warnings:\n", result.stderr)
+            with profile_stage(self.profile, 'encode') as sample:
+                self._encode_and_join(chunks, segment_dir, keep_segments, jobs, threads)
+                sample.frames = len(frame_paths)
             print(f"Video created successfully: {self.output_path}")
+        finally:
+            if not keep_segments:
+                shutil.rmtree(segment_dir, ignore_errors=True)
+
+    def _encode_and_join(self, chunks, segment_dir, keep_segments, jobs, threads):
+        """Encodes the segments that are not finished yet and joins all of them into the output file."""
+        segment_paths = [os.path.join(segment_dir, f"segment_{i:04d}_{self._segment_key(chunk)}.ts")
+                         for i, chunk in enumerate(chunks)]
+        if keep_segments:
+            self._remove_stale_segments(segment_dir, segment_paths)
+        todo = [(chunk, path) for chunk, path in zip(chunks, segment_paths) if not os.path.exists(path)]
+        if len(todo) < len(chunks):
+            print(f"Reusing {len(chunks) - len(todo)} of {len(chunks)} encoded segments.")
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # list() waits for every segment and raises the first error
+            list(executor.map(lambda args: self._encode_segment(*args, threads=threads), todo))
+
+        join_list = os.path.join(segment_dir, 'segments.txt')
+        with open(join_list, 'w', encoding='utf-8') as f:
+            for chunk, segment_path in zip(chunks, segment_paths):
+                # Exact durations place each segment right after the previous one
+                f.write(f"file '{segment_path}'\nduration {len(chunk) / self.frame_rate:.6f}\n")
+        self._run_ffmpeg(['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', join_list,
+                          '-c', 'copy', '-movflags', '+faststart', self.output_path])
+
+    @staticmethod
+    def _split_segments(frame_paths, segments):
+        """
+        Splits the frames into at most ``segments`` consecutive chunks of whole GOPs.
+
+        Only the last chunk can be shorter than the others or end mid-GOP.
+        """
+        gops = -(-len(frame_paths) // SEGMENT_GOP_FRAMES)
+        chunk_frames = -(-gops // segments) * SEGMENT_GOP_FRAMES
+        return [frame_paths[start:start + chunk_frames] for start in range(0, len(frame_paths), chunk_frames)]
+
+    def _segment_key(self, frame_paths):
+        """Returns a digest of a chunk's frame files and the encoding settings, naming its segment file."""
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(repr((self.frame_rate, self._x264_args(), SEGMENT_GOP_FRAMES)).encode('utf-8'))
+        for frame in frame_paths:
+            # A HeldFrame is its base and its header, and the header list is part of the key
+            for frame_path in _frame_files(frame):
+                stat = os.stat(frame_path)
+                digest.update(f"{os.path.abspath(frame_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    @staticmethod
+    def _remove_stale_segments(segment_dir, segment_paths):
+        """Deletes segment files (and partial ones) that are not part of the current encode."""
+        keep = {os.path.basename(path) for path in segment_paths}
+        for name in os.listdir(segment_dir):
+            if name.startswith('segment_') and name not in keep:
+                os.remove(os.path.join(segment_dir, name))
+
+    def _encode_segment(self, frame_paths, segment_path, threads):
+        """Encodes one chunk of frames into an MPEG-TS file, which keeps its timestamps for the join."""
+        list_dir = tempfile.mkdtemp()
+        # Written under another name first, so a segment file always holds a finished encode
+        partial_path = segment_path + '.partial'
+        try:
+            list_filepath, header_list, has_held_frames = self._write_frame_lists(frame_paths, list_dir)
+            overlay_args = ['-filter_complex', self._overlay_filter(0)] if header_list is not None else []
+            command = ['ffmpeg', '-y'] + \
+                self._build_input_args(list_filepath, has_held_frames, header_list, len(frame_paths)) + \
+                overlay_args + self._x264_args() + ['-g', str(SEGMENT_GOP_FRAMES), '-sc_threshold', '0',
+                                                    '-threads', str(threads), '-f', 'mpegts', partial_path]
+            self._run_ffmpeg(command)
+            os.replace(partial_path, segment_path)
+        finally:
+            shutil.rmtree(list_dir, ignore_errors=True)
+
+    def _write_frame_lists(self, frame_paths, list_dir):
+        """
+        Writes concat demuxer lists of the frames to a directory.
+
+        Consecutive repeats of the same path become a single entry with a duration.
+        HeldFrames repeat their base in the list of frames, and their headers go in a
+        second list, with a transparent image for the frames that have no header.
+
+        :return: A tuple of the frame list's path, the header list's path (None without
+                 HeldFrames) and whether the lists hold durations.
+        """
+        bases = [_frame_files(frame)[0] for frame in frame_paths]
+        headers = [frame.header if isinstance(frame, HeldFrame) else None for frame in frame_paths]
+        header_list = None
+        if any(header is not None for header in headers):
+            no_header_path = self._write_no_header(next(header for header in headers if header is not None),
+                                                   list_dir)
+            header_list = self._write_frame_list([header if header is not None else no_header_path
+                                                  for header in headers],
+                                                 os.path.join(list_dir, 'headers.txt'), with_durations=True)
+        has_held_frames = header_list is not None or len(self._group_repeated_frames(bases)) < len(bases)
+        list_filepath = self._write_frame_list(bases, os.path.join(list_dir, 'frames.txt'), has_held_frames)
+        return list_filepath, header_list, has_held_frames
+
+    def _write_frame_list(self, frame_paths, list_filepath, with_durations=False):
+        """
+        Writes a concat demuxer list of frame files.
+
+        :param with_durations: True to write consecutive repeats of the same path as a single
+                               entry with a duration, instead of one entry per frame.
+        :return: The list's path.
+        """
+        frame_duration = 1.0 / self.frame_rate
+        entry_options = ''
+        if with_durations and self.frame_rate > IMAGE_DEMUXER_FRAME_RATE:
+            entry_options = f"option framerate {self.frame_rate}\n"
+
+        with open(list_filepath, 'w', encoding='utf-8') as f:
+            if not with_durations:
+                for frame_path in frame_paths:
+                    # Path needs to be absolute and properly escaped for ffmpeg
+                    f.write(f"file '{os.path.abspath(frame_path)}'\n")
+                return list_filepath
+            for frame_path, count in self._group_repeated_frames(frame_paths):
+                f.write(f"file '{os.path.abspath(frame_path)}'\n{entry_options}")
+                f.write(f"duration {count * frame_duration:.6f}\n")
+            # The concat demuxer ignores the duration of the last entry unless it is listed again
+            f.write(f"file '{os.path.abspath(frame_paths[-1])}'\n{entry_options}")
+        return list_filepath
+
+    @staticmethod
+    def _write_no_header(header_path, list_dir):
+        """Writes the transparent image listed for frames without a header, as big as a header."""
+        with Image.open(header_path) as header:
+            size = header.size
+        no_header_path = os.path.join(list_dir, 'no_header.png')
+        Image.new('RGBA', size, (0, 0, 0, 0)).save(no_header_path)
+        return no_header_path
+
+    def _run_ffmpeg(self, command):
+        """Runs an FFmpeg command to completion, printing its output. It is killed if the encode is cancelled."""
+        if self.cancel_check is not None:
+            self.cancel_check()
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         except FileNotFoundError:
             raise RuntimeError("FFmpeg is not installed or not found in the system's PATH.")
-        except subprocess.CalledProcessError as e:
+        _count_process(1)
+        try:
+            stdout, stderr = self._communicate(process)
+        finally:
+            _count_process(-1)
+            process.stdout.close()
+            process.stderr.close()
+
+        if process.returncode != 0:
             print("Error during video encoding with FFmpeg.")
             print(f"Command: {' '.join(command)}")
-            print("FFmpeg stdout:\n", e.stdout)
-            print("FFmpeg stderr:\n", e.stderr)
+            print("FFmpeg stdout:\n", stdout)
+            print("FFmpeg stderr:\n", stderr)
             raise RuntimeError("FFmpeg failed to encode the video.")
+        if stdout:
+            print("FFmpeg output:\n", stdout)
+        if stderr:
+            print("FFmpeg info/warnings:\n", stderr)
+
+    def _communicate(self, process):
+        """Reads an FFmpeg process's output until it exits, checking for cancellation meanwhile."""
+        if self.cancel_check is None:
+            return process.communicate()
+        while True:
+            try:
+                # Output read before a timeout is kept for the next call
+                return process.communicate(timeout=CANCEL_POLL_SECONDS)
+            except subprocess.TimeoutExpired:
+                self._kill_if_cancelled(process)
+
+    def _kill_if_cancelled(self, process):
+        """Calls cancel_check, killing the FFmpeg process before letting its exception through."""
+        try:
+            self.cancel_check()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+
+    @staticmethod
+    def _group_repeated_frames(frame_paths):
+        """
+        Collapses runs of the same frame path into (path, count) pairs.
+        """
+        groups = []
+        for frame_path in frame_paths:
+            if groups and groups[-1][0] == frame_path:
+                groups[-1][1] += 1
+            else:
+                groups.append([frame_path, 1])
+        return [(frame_path, count) for frame_path, count in groups]
+
+    def create_video_from_stream(self, frames, width, height):
+        """
+        Creates a video by piping frames straight into FFmpeg, without writing them to disk.
+
+        A GIF's palette is made from frames of the whole video, so its frames are saved
+        as PNG files instead and encoded when the stream is finished (see start_stream).
+
+        :param frames: An iterable of Pillow Images (or raw RGB buffers) of size width x height, or
+                       HeldFrames of Images. Yielding the same Image object again repeats it without
+                       converting it again, and so does a HeldFrame for its base.
+        :param width: The width of the frames in pixels.
+        :param height: The height of the frames in pixels.
+        """
+        self.start_stream(width, height)
+        try:
+            for frame in frames:
+                self.write_frame(frame)
+        except BaseException:
+            self.abort_stream()
+            raise
+        self.finish_stream()
+
+    def start_stream(self, width, height):
+        """
+        Starts a single FFmpeg process that reads raw RGB frames from its stdin.
+
+        A GIF is encoded with create_video_from_frames when the stream is finished,
+        from PNG files of the frames in a temporary directory. Repeats of a frame
+        are saved once, and the header of a HeldFrame is saved on its own.
+
+        :param width: The width of the frames in pixels.
+        :param height: The height of the frames in pixels.
+        """
+        if self._process is not None or self._gif_frames is not None:
+            raise RuntimeError("A video stream is already in progress.")
+
+        self._frame_size = (width, height)
+        if self.format == 'gif':
+            self._gif_frame_dir = tempfile.mkdtemp()
+            self._gif_frames = []
+            return
+        print(f"Generating video: {self.output_path}")
+        self._start_process(self._build_ffmpeg_stream_command(width, height))
+
+    def _start_process(self, command):
+        """Starts the FFmpeg process of a stream, reading raw frames from its stdin."""
+        try:
+            self._process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise RuntimeError("FFmpeg is not installed or not found in the system's PATH.")
+        _count_process(1)
+
+        self._stderr_chunks = []
+        # FFmpeg's log output must be drained, or it can block while we block on stdin
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, args=(self._process.stderr,), daemon=True)
+        self._stderr_thread.start()
+
+    def write_frame(self, frame):
+        """
+        Sends one frame to the running FFmpeg process.
+
+        Writes block while FFmpeg's input pipe is full, so a producer that is faster
+        than the encoder is held back instead of buffering frames in memory.
+
+        :param frame: A Pillow Image, a HeldFrame of Images or a raw RGB24 buffer of the stream's frame size.
+        """
+        if self._process is None and self._gif_frames is None:
+            raise RuntimeError("No video stream in progress. Call start_stream() first.")
+
+        if self._gif_frames is not None:
+            with profile_stage(self.profile, 'encode_write') as sample:
+                self._gif_frames.append(self._save_gif_frame(frame))
+                sample.frames = 1
+            return
+
+        if isinstance(frame, HeldFrame):
+            frame = self._held_buffer(frame)
+        elif frame is self._last_frame:
+            # A held frame: send the same buffer again
+            frame = self._last_buffer
+        elif hasattr(frame, 'tobytes'):
+            frame = self._frame_buffer(frame)
+
+        try:
+            with profile_stage(self.profile, 'encode_write') as sample:
+                # Blocks while FFmpeg is behind, so this is the encoder's share of a streamed run
+                self._process.stdin.write(frame)
+                sample.byte_count = len(frame)
+                sample.frames = 1
+        except (BrokenPipeError, OSError):
+            self._wait_process(self._process)
+            stderr = self._collect_stderr()
+            self._process = None
+            print("Error during video encoding with FFmpeg.")
+            print("FFmpeg stderr:\n", stderr)
+            raise RuntimeError("FFmpeg failed to encode the video.")
+
+    def _frame_buffer(self, frame):
+        """Converts an Image to a raw RGB24 buffer and remembers both, so a repeat is not converted again."""
+        self._check_frame_size(frame)
+        image = frame
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        self._last_frame = frame
+        self._last_buffer = image.tobytes()
+        return self._last_buffer
+
+    def _held_buffer(self, frame):
+        """Returns the raw RGB24 buffer of a HeldFrame: the rows of its header, then those of its base."""
+        if frame.base is not self._last_frame:
+            self._frame_buffer(frame.base)
+        header = frame.header
+        self._check_header_size(header)
+        if header.mode != 'RGB':
+            header = header.convert('RGB')
+        header_bytes = header.tobytes()
+        return header_bytes + self._last_buffer[len(header_bytes):]
+
+    def _save_gif_frame(self, frame):
+        """
+        Saves a frame of a streamed GIF as a PNG file, unless it repeats the last one.
+
+        :return: The path of the frame, or a HeldFrame of paths, for create_video_from_frames.
+        """
+        if isinstance(frame, HeldFrame):
+            self._check_header_size(frame.header)
+            header_path = os.path.join(self._gif_frame_dir, f"header_{len(self._gif_frames):05d}.png")
+            save_header(frame.header, header_path)
+            return HeldFrame(self._save_gif_frame(frame.base), header_path)
+        if frame is self._last_frame:
+            return self._last_frame_path
+        if hasattr(frame, 'tobytes'):
+            self._check_frame_size(frame)
+            image = frame
+        else:
+            image = Image.frombytes('RGB', self._frame_size, bytes(frame))
+        frame_path = os.path.join(self._gif_frame_dir, f"frame_{len(self._gif_frames):05d}.png")
+        image.save(frame_path)
+        self._last_frame, self._last_frame_path = frame, frame_path
+        return frame_path
+
+    def _check_frame_size(self, frame):
+        """Raises ValueError if an Image is not of the stream's frame size."""
+        if frame.size != self._frame_size:
+            raise ValueError(f"Frame size {frame.size} does not match the stream size {self._frame_size}.")
+
+    def _check_header_size(self, header):
+        """Raises ValueError if the header of a HeldFrame does not fit the stream's frame size."""
+        width, height = self._frame_size
+        if header.size[0] != width or header.size[1] > height:
+            raise ValueError(f"Header size {header.size} does not fit the stream size {self._frame_size}.")
+
+    def finish_stream(self):
+        """
+        Closes FFmpeg's input and waits for the video to be written.
+        """
+        if self._gif_frames is not None:
+            frames = self._gif_frames
+            try:
+                self.create_video_from_frames(frames)
+            finally:
+                self._remove_gif_frames()
+            return
+        if self._process is None:
+            raise RuntimeError("No video stream in progress. Call start_stream() first.")
+
+        process = self._process
+        self._process = None
+        self._last_frame = self._last_buffer = None
+        try:
+            with profile_stage(self.profile, 'encode'):
+                try:
+                    process.stdin.close()
+                except (BrokenPipeError, OSError):
+                    pass
+                returncode = self._wait_process(process, cancellable=True)
         finally:
-            os.remove(list_filepath)
+            stderr = self._collect_stderr()
+        if returncode != 0:
+            print("Error during video encoding with FFmpeg.")
+            print("FFmpeg stderr:\n", stderr)
+            raise RuntimeError("FFmpeg failed to encode the video.")
+        if stderr:
+            print("FFmpeg info/warnings:\n", stderr)
+        print(f"Video created successfully: {self.output_path}")
+
+    def abort_stream(self):
+        """
+        Kills a running FFmpeg stream process, e.g. after rendering failed.
+        """
+        self._remove_gif_frames()
+        if self._process is None:
+            return
+        process = self._process
+        self._process = None
+        self._last_frame = self._last_buffer = None
+        process.kill()
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._wait_process(process)
+        self._collect_stderr()
+
+    def _wait_process(self, process, cancellable=False):
+        """
+        Waits for the FFmpeg process of a stream to exit and returns its exit code.
 
-    def _build_ffmpeg_command(self, list_filepath):
+        :param cancellable: True to kill the process if the encode is cancelled meanwhile.
+        """
+        try:
+            if not cancellable or self.cancel_check is None:
+                return process.wait()
+            while True:
+                try:
+                    return process.wait(timeout=CANCEL_POLL_SECONDS)
+                except subprocess.TimeoutExpired:
+                    self._kill_if_cancelled(process)
+        finally:
+            _count_process(-1)
+
+    def _remove_gif_frames(self):
+        """Deletes the temporary PNG files of a streamed GIF's frames."""
+        if self._gif_frame_dir is not None:
+            shutil.rmtree(self._gif_frame_dir, ignore_errors=True)
+        self._gif_frame_dir = self._gif_frames = None
+        self._last_frame = self._last_frame_path = None
+
+    def _drain_stderr(self, pipe):
+        """Reads FFmpeg's stderr until the process closes it."""
+        for chunk in iter(lambda: pipe.read(4096), b''):
+            self._stderr_chunks.append(chunk)
+        pipe.close()
+
+    def _collect_stderr(self):
+        """Waits for the stderr reader and returns everything FFmpeg logged."""
+        if self._stderr_thread is not None:
+            self._stderr_thread.join()
+            self._stderr_thread = None
+        return b''.join(self._stderr_chunks).decode('utf-8', errors='replace')
+
+    def _build_ffmpeg_command(self, list_filepath, with_durations=False, palette_path=None, header_list=None,
+                              frame_count=None):
         """
         Builds the FFmpeg command based on the specified format.
+
+        :param list_filepath: Path to the concat list file.
+        :param with_durations: True if the list holds frames with 'duration' entries.
+        :param palette_path: A GIF palette image made beforehand, see _make_gif_palette.
+        :param header_list: Path to the concat list of headers laid over the frames, see _write_frame_lists.
+        :param frame_count: The number of frames of the video, which lists with durations end after.
+        """
+        return ['ffmpeg', '-y'] + self._build_palette_input_args(palette_path) + \
+            self._build_input_args(list_filepath, with_durations, header_list, frame_count) + \
+            self._build_output_args(palette_path, overlay=header_list is not None)
+
+    @staticmethod
+    def _build_palette_input_args(palette_path):
+        """
+        Builds the FFmpeg options that read a palette image. It comes first, as input 0,
+        so that options trailing the frames' input do not apply to it.
+        """
+        if palette_path is None:
+            return []
+        return ['-i', palette_path]
+
+    def _build_input_args(self, list_filepath, with_durations=False, header_list=None, frame_count=None):
+        """
+        Builds the FFmpeg options that read the frames of a concat list, and the headers
+        of another one as the next input if there is one (it must hold durations).
+        """
+        if not with_durations:
+            return ['-r', str(self.frame_rate), '-f', 'concat', '-safe', '0', '-i', list_filepath]
+        args = ['-f', 'concat', '-safe', '0', '-i', list_filepath]
+        if header_list is not None:
+            args += ['-f', 'concat', '-safe', '0', '-i', header_list]
+        # Frame timing comes from the list; the output -r turns it into a constant rate
+        args += ['-r', str(self.frame_rate)]
+        if frame_count is not None:
+            # The last entry is listed twice, which would otherwise add a frame
+            args += ['-frames:v', str(frame_count)]
+        return args
+
+    def _overlay_filter(self, frames_input):
+        """
+        Builds the filter graph that lays the headers (the input after frames_input) over the frames.
+
+        Overlays are only drawn on frames of the first input, so held frames are repeated
+        at the frame rate first, and both inputs are put on the same frame times.
+        """
+        return (f'[{frames_input}:v] fps={self.frame_rate} [frames]; '
+                f'[{frames_input + 1}:v] fps={self.frame_rate} [headers]; '
+                f'[frames][headers] overlay=format=rgb')
+
+    def _build_ffmpeg_stream_command(self, width, height):
+        """
+        Builds the FFmpeg command that reads raw RGB frames from stdin.
+        """
+        return ['ffmpeg', '-y'] + self._build_raw_input_args(width, height, '-') + self._build_output_args()
+
+    def _build_raw_input_args(self, width, height, source):
+        """
+        Builds the FFmpeg options that read raw RGB frames from a file, or from stdin if source is '-'.
+        """
+        return [
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{width}x{height}',
+            '-r', str(self.frame_rate),
+            '-i', source,
+        ]
+
+    @staticmethod
+    def _x264_args():
+        """
+        Builds the H.264 encoding options shared by single-pass and segmented encoding.
+        """
+        return [
+            '-c:v', 'libx264',
+            '-pix_fmt', 'yuv420p', # For compatibility
+            '-preset', 'medium',
+        ]
+
+    def _build_output_args(self, palette_path=None, overlay=False):
+        """
+        Builds the FFmpeg output options based on the specified format.
+
+        :param palette_path: The palette image of a GIF, read as input 0 before the frames.
+        :param overlay: True if the input after the frames holds headers to lay over them.
         """
         if self.format == 'mp4':
-            return [
-                'ffmpeg',
-                '-y',  # Overwrite output file if it exists
-                '-r', str(self.frame_rate),
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', list_filepath,
-                '-c:v', 'libx264',
-                '-pix_fmt', 'yuv420p', # For compatibility
-                '-preset', 'medium',
-                self.output_path,
-            ]
+            overlay_args = ['-filter_complex', self._overlay_filter(0)] if overlay else []
+            return overlay_args + self._x264_args() + [self.output_path]
         elif self.format == 'gif':
-            # Two-pass encoding for better quality GIF
-            # For now, a simpler one-pass command is implemented.
-            return [
-                'ffmpeg',
-                '-y',
-                '-r', str(self.frame_rate),
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', list_filepath,
-                '-filter_complex', '[0:v] split [a][b];[a] palettegen [p];[b][p] paletteuse',
-                self.output_path,
-            ]
+            if palette_path is None:
+                raise ValueError("A GIF is encoded with a palette made beforehand.")
+            # The palette is ready, so frames are converted as they arrive
+            if overlay:
+                return ['-filter_complex', f'{self._overlay_filter(1)} [held]; [held][0:v] paletteuse',
+                        self.output_path]
+            return ['-filter_complex', '[1:v][0:v] paletteuse', self.output_path]
         else:
             raise ValueError(f"Unsupported video format: '{self.format}'")
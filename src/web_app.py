@@ -8,40 +8,387 @@ import tempfile
 import shutil
 import threading
 import time
-import io
+import json
 import base64
+import hashlib
+import uuid
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, render_template, request, jsonify, send_file
-from src.git_utils import GitRepo
+from flask import Flask, Response, render_template, request, jsonify, send_file, stream_with_context
+from src.git_utils import GitRepo, check_sampling
+from src.path_filter import PathFilter
 from src.frame_renderer import FrameRenderer
-from src.video_encoder import VideoEncoder
+from src.video_encoder import VideoEncoder, active_ffmpeg_processes
+from src.parallel_renderer import render_frames, resolve_jobs, checkpoint_settings, RenderStats
+from src.checkpoint import RunCheckpoint
+from src.profiling import PipelineProfile
+from src.metrics import (MetricsRegistry, Counter, Gauge, Histogram, CONTENT_TYPE, process_rss_bytes,
+                         directory_size)
+from src.frame_cache import FrameCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES
+from src.job_scheduler import JobScheduler, JobCancelled, DEFAULT_MAX_WORKERS
+from src.preview import PreviewCache, PREVIEW_FORMATS, DEFAULT_PREVIEW_CACHE_BYTES
+from src.repo_pool import RepoPool, DEFAULT_IDLE_TIMEOUT
+from src.job_store import (JobStore, FINISHED_STATUSES, DEFAULT_MAX_AGE, DEFAULT_MAX_OUTPUT_BYTES,
+                           DEFAULT_SWEEP_INTERVAL)
 
 app = Flask(__name__, 
             template_folder='../templates',
             static_folder='../static')
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max upload
-app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+# Generated videos and the job database; kept across restarts, within the retention limits below
+app.config['UPLOAD_FOLDER'] = os.path.join(os.path.expanduser('~'), '.cache', 'git-chronoscope', 'outputs')
+app.config['FRAME_CACHE_DIR'] = DEFAULT_CACHE_DIR
+app.config['FRAME_CACHE_MAX_BYTES'] = DEFAULT_CACHE_MAX_BYTES
+# Jobs beyond this many wait in a queue instead of rendering at the same time
+app.config['MAX_CONCURRENT_JOBS'] = DEFAULT_MAX_WORKERS
+# Seconds an unused repository handle is kept open before its git processes are stopped
+app.config['REPO_IDLE_TIMEOUT'] = DEFAULT_IDLE_TIMEOUT
+# Memory budget for rendered previews, kept per commit and render settings
+app.config['PREVIEW_CACHE_MAX_BYTES'] = DEFAULT_PREVIEW_CACHE_BYTES
+# Resumable jobs keep their options and finished frames here, so they continue after a restart
+app.config['JOB_STATE_DIR'] = os.path.join(os.path.expanduser('~'), '.cache', 'git-chronoscope', 'jobs')
+# Status streams send at most one update per interval (seconds), so per-frame progress is coalesced
+app.config['STATUS_STREAM_INTERVAL'] = 0.25
+# Seconds between keep-alive comments on an idle status stream
+app.config['STATUS_STREAM_KEEPALIVE'] = 15
+# Finished jobs are deleted with their output after this many seconds (None keeps them)
+app.config['JOB_MAX_AGE'] = DEFAULT_MAX_AGE
+# Outputs beyond this total size in bytes are deleted, oldest first (None for no limit)
+app.config['JOB_MAX_OUTPUT_BYTES'] = DEFAULT_MAX_OUTPUT_BYTES
+# Seconds between two sweeps applying the limits above
+app.config['JOB_SWEEP_INTERVAL'] = DEFAULT_SWEEP_INTERVAL
+# Default and largest page size of /api/jobs
+app.config['JOBS_PAGE_SIZE'] = 50
+app.config['JOBS_MAX_PAGE_SIZE'] = 500
+
+# Job history, kept in an SQLite database in the upload folder, created on first use.
+# Only jobs started with the 'resumable' option continue running after a restart.
+_job_store = None
+_job_store_lock = threading.Lock()
+
+# Rendered-frame cache shared by all jobs, created on first use
+_frame_cache = None
+_frame_cache_lock = threading.Lock()
+
+# Repository handles shared by all requests and jobs, created on first use
+_repo_pool = None
+_repo_pool_lock = threading.Lock()
+
+# Preview images and renderers shared by all requests, created on first use
+_preview_cache = None
+_preview_cache_lock = threading.Lock()
+
+# Scheduler that runs the jobs, created on first use
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# Held while a generate request looks for a job to reuse and adds its own,
+# so identical requests arriving together share one render
+_generate_lock = threading.Lock()
+
+
+JOB_STATUSES = ('pending', 'queued', 'running') + FINISHED_STATUSES
+
+
+def count_jobs_by_status():
+    """Returns the number of jobs in each state, keyed by (status,)."""
+    counts = {(status,): 0 for status in JOB_STATUSES}
+    for status, count in get_job_store().count_by_status().items():
+        counts[(status,)] = count
+    return counts
+
+
+# Metrics reported by /metrics. Gauges are read on each scrape; the render loop
+# only counts frames, and the stage timings of a job are added once it ends.
+metrics = MetricsRegistry()
+metrics.register(Gauge('chronoscope_jobs', 'Jobs known to the server, by state.',
+                       count_jobs_by_status, labels=('state',)))
+metrics.register(Gauge('chronoscope_job_queue_depth', 'Jobs waiting for a worker.',
+                       lambda: _scheduler.queued_count if _scheduler is not None else 0))
+frames_rendered = metrics.register(Counter(
+    'chronoscope_frames_rendered_total', 'Frames produced by jobs, including cached and held frames.'))
+frame_render_seconds = metrics.register(Histogram(
+    'chronoscope_frame_render_seconds', 'Time to draw one frame, recorded when its job ends.',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+job_encode_seconds = metrics.register(Histogram(
+    'chronoscope_job_encode_seconds', 'Time a job spent in FFmpeg, including waiting on a streamed encode.',
+    (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)))
+reused_requests = metrics.register(Counter(
+    'chronoscope_reused_requests_total', 'Generate requests served by another job\'s render, by kind of reuse.',
+    labels=('reuse',)))
+git_read_bytes = metrics.register(Counter(
+    'chronoscope_git_read_bytes_total', 'Bytes of file content read from Git repositories by jobs.'))
+metrics.register(Gauge('chronoscope_upload_folder_bytes', 'Size of the files in the upload folder (job outputs).',
+                       lambda: directory_size(app.config['UPLOAD_FOLDER'])))
+metrics.register(Gauge('chronoscope_ffmpeg_processes', 'FFmpeg processes currently encoding.',
+                       active_ffmpeg_processes))
+metrics.register(Gauge('process_resident_memory_bytes', 'Resident memory size in bytes.', process_rss_bytes))
+
+
+def record_job_metrics(profile):
+    """Adds the stage timings of a finished job's PipelineProfile to the metrics."""
+    render_durations, _, _ = profile.stage_samples('render_frame')
+    frame_render_seconds.observe_many(render_durations)
+    _, read_bytes, _ = profile.stage_samples('read_blob')
+    git_read_bytes.inc(read_bytes)
+    encode_durations = profile.stage_samples('encode')[0] + profile.stage_samples('encode_write')[0]
+    if encode_durations:
+        job_encode_seconds.observe(sum(encode_durations))
 
-# Store job status in memory (in production, use Redis or database)
-# Note: Jobs are lost on server restart in development mode
-jobs = {}
 
 
 class TimelapseJob:
-    """Represents a time-lapse generation job."""
+    """
+    Represents a time-lapse generation job.
+
+    Setting one of the attributes reported by /api/status wakes up the threads
+    waiting in wait_for_change, which is how status streams learn about progress.
+
+    A job can reuse the render of another one with the same request key: it is
+    attached to a job that has not finished, copying its status as it changes,
+    or it is created completed with the output of a finished job.
+    """
+    _WATCHED_FIELDS = frozenset(('status', 'progress', 'message', 'error', 'output_path', 'frames_deduplicated'))
+
     def __init__(self, job_id, repo_path, options):
+        self._changed = threading.Condition()
+        self._version = 0
+        self._followers = []
         self.job_id = job_id
         self.repo_path = repo_path
         self.options = options
-        self.status = 'pending'  # pending, running, completed, failed
+        self.status = 'pending'  # pending, queued, running, completed, failed, cancelled
         self.progress = 0  # 0-100
         self.message = ''
         self.output_path = None
         self.error = None
         self.created_at = time.time()
+        self.frames_deduplicated = 0
+        self.profile = None  # PipelineProfile of the run once started, or a SavedProfile from the job store
+        self.request_key = None  # see request_key()
+        self.reuse = None  # 'attached' or 'cached' if the job reuses the render of another job
+        self.source_job_id = None  # the job whose render is reused
+        self.source = None  # that job, while this one is attached to it
+        self.cancel_requested = threading.Event()
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self._WATCHED_FIELDS:
+            with self._changed:
+                self._version += 1
+                self._changed.notify_all()
+                for follower in self._followers:
+                    setattr(follower, name, value)
+
+    @property
+    def followers(self):
+        """The jobs attached to this one."""
+        with self._changed:
+            return list(self._followers)
+
+    def attach(self, follower):
+        """Makes another job copy the status of this one from now on, reusing its render."""
+        with self._changed:
+            follower.reuse = 'attached'
+            follower.source_job_id = self.job_id
+            follower.source = self
+            for name in self._WATCHED_FIELDS:
+                setattr(follower, name, getattr(self, name))
+            self._followers.append(follower)
+
+    def detach(self, follower):
+        """Stops a job from copying the status of this one."""
+        with self._changed:
+            if follower in self._followers:
+                self._followers.remove(follower)
+            follower.source = None
+
+    def wait_for_change(self, version, timeout):
+        """
+        Waits until the job changes after the given version.
+
+        :param version: The version returned by the previous call, or -1.
+        :param timeout: The maximum number of seconds to wait.
+        :return: The current version, which equals version if nothing changed in time.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+
+def get_job_store():
+    """Returns the store of all jobs, starting its retention sweeper."""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs.sqlite3'), TimelapseJob,
+                                  max_age=app.config['JOB_MAX_AGE'],
+                                  max_output_bytes=app.config['JOB_MAX_OUTPUT_BYTES'],
+                                  sweep_interval=app.config['JOB_SWEEP_INTERVAL'])
+            _job_store.start_sweeper()
+        return _job_store
+
+
+def get_frame_cache():
+    """Returns the frame cache shared by all jobs."""
+    global _frame_cache
+    with _frame_cache_lock:
+        if _frame_cache is None:
+            _frame_cache = FrameCache(app.config['FRAME_CACHE_DIR'],
+                                      max_bytes=app.config['FRAME_CACHE_MAX_BYTES'])
+        return _frame_cache
+
+
+def get_repo_pool():
+    """Returns the pool of repository handles shared by all requests and jobs."""
+    global _repo_pool
+    with _repo_pool_lock:
+        if _repo_pool is None:
+            _repo_pool = RepoPool(lambda repo_path, **shared: GitRepo(repo_path, **shared),
+                                  idle_timeout=app.config['REPO_IDLE_TIMEOUT'])
+        return _repo_pool
+
+
+def get_scheduler():
+    """Returns the scheduler that runs all jobs."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(generate_timelapse_worker, max_workers=app.config['MAX_CONCURRENT_JOBS'])
+        return _scheduler
+
+
+def check_cancelled(job):
+    """Raises JobCancelled if cancelling the job was requested."""
+    if job.cancel_requested.is_set():
+        raise JobCancelled()
+
+
+def parse_path_filter(data):
+    """
+    Builds a PathFilter from the 'include' and 'exclude' request fields.
+
+    Each field is a list of glob patterns, or a string of patterns separated by
+    commas or newlines.
+
+    :return: A PathFilter, or None if no patterns are given.
+    """
+    patterns = {}
+    for field in ('include', 'exclude'):
+        value = data.get(field) or []
+        if isinstance(value, str):
+            value = value.replace('\n', ',').split(',')
+        patterns[field] = [pattern for pattern in value if pattern.strip()]
+    if not patterns['include'] and not patterns['exclude']:
+        return None
+    return PathFilter(patterns['include'], patterns['exclude'])
+
+
+def job_resolution(options):
+    """Returns the frame width and height of a job from its custom size or resolution preset."""
+    width = options.get('width')
+    height = options.get('height')
+    if not width or not height:
+        resolutions = {
+            "720p": (1280, 720),
+            "1080p": (1920, 1080),
+            "4k": (3840, 2160)
+        }
+        width, height = resolutions.get(options.get('resolution', '1080p'), (1920, 1080))
+    return width, height
+
+
+# Job options that change how a video is made, but not the video itself
+EXECUTION_OPTIONS = frozenset(('jobs', 'encoder', 'segments', 'segment_jobs', 'incremental', 'use_cache',
+                               'resumable'))
+
+
+def request_key(tip_sha, options):
+    """
+    Returns the key under which generate requests share a render.
+
+    Requests with the same key make the same video: the key is made of the tip
+    commit of the branch and the options that change the output, with the
+    frame size and path patterns normalized.
+
+    :param tip_sha: The SHA the branch resolved to when the request was made.
+    :param options: The job options.
+    :return: The key as a hex string.
+    """
+    normalized = {name: value for name, value in options.items()
+                  if name not in EXECUTION_OPTIONS and name not in ('branch', 'resolution', 'width', 'height')}
+    normalized['size'] = job_resolution(options)
+    normalized['include'] = sorted(options.get('include') or [])
+    normalized['exclude'] = sorted(options.get('exclude') or [])
+    return hashlib.sha256(json.dumps([tip_sha, normalized], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_job(job):
+    """Saves a job to the job store, with the jobs attached to it."""
+    get_job_store().save(job)
+    for follower in job.followers:
+        get_job_store().save(follower)
+
+
+def job_state_dir(job_id):
+    """Returns the directory that keeps the state of a resumable job."""
+    return os.path.join(app.config['JOB_STATE_DIR'], job_id)
+
+
+def save_job_state(job, priority):
+    """
+    Saves what is needed to run a resumable job again after a server restart.
+
+    :param job: The TimelapseJob.
+    :param priority: The priority the job was submitted with.
+    """
+    state_dir = job_state_dir(job.job_id)
+    os.makedirs(state_dir, exist_ok=True)
+    state = {
+        'job_id': job.job_id,
+        'repo_path': job.repo_path,
+        'options': job.options,
+        'created_at': job.created_at,
+        'priority': priority,
+        'request_key': job.request_key,
+    }
+    tmp_path = os.path.join(state_dir, 'job.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(state_dir, 'job.json'))
+
+
+def resume_interrupted_jobs():
+    """
+    Queues again the resumable jobs that had not finished when the server stopped.
+
+    Their frames are taken from the job's checkpoint, so only the missing ones are rendered.
+
+    :return: The number of jobs queued.
+    """
+    state_root = app.config['JOB_STATE_DIR']
+    if not os.path.isdir(state_root):
+        return 0
+    resumed = 0
+    for job_id in sorted(os.listdir(state_root)):
+        if get_job_store().live(job_id) is not None:
+            continue
+        try:
+            with open(os.path.join(state_root, job_id, 'job.json'), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read the state of job {job_id}: {e}")
+            continue
+        job = TimelapseJob(state['job_id'], state['repo_path'], state['options'])
+        job.created_at = state.get('created_at', job.created_at)
+        job.request_key = state.get('request_key')
+        job.message = 'Resuming after a server restart...'
+        get_job_store().add(job)
+        get_scheduler().submit(job, priority=state.get('priority', 0))
+        resumed += 1
+    return resumed
 
 
 def generate_timelapse_worker(job):
@@ -49,22 +396,18 @@ def generate_timelapse_worker(job):
     try:
         job.status = 'running'
         job.message = 'Initializing...'
+        save_job(job)
         
-        # Create temporary directory for frames
-        temp_dir = tempfile.mkdtemp()
+        # Frames only go to a temporary directory when using the concat or segmented encoder
+        temp_dir = None
+        frames = None
+        output_path = None
+        git_repo = None
+        checkpoint = None
         
         try:
             # Initialize modules
-            width = job.options.get('width')
-            height = job.options.get('height')
-
-            if not width or not height:
-                resolutions = {
-                    "720p": (1280, 720),
-                    "1080p": (1920, 1080),
-                    "4k": (3840, 2160)
-                }
-                width, height = resolutions.get(job.options.get('resolution', '1080p'), (1920, 1080))
+            width, height = job_resolution(job.options)
             
             frame_renderer = FrameRenderer(
                 width=width,
@@ -73,40 +416,28 @@ def generate_timelapse_worker(job):
                 text_color=job.options.get('text_color', '#FFFFFF'),
                 font_path=job.options.get('font_path'),
                 font_size=job.options.get('font_size', 15),
-                no_email=job.options.get('no_email', False)
+                no_email=job.options.get('no_email', False),
+                text_backend=job.options.get('text_backend', 'draw')
             )
             
-            git_repo = GitRepo(job.repo_path)
+            job.profile = PipelineProfile()
+            git_repo = get_repo_pool().acquire(job.repo_path, parse_path_filter(job.options))
+            git_repo.profile = job.profile
             
             # Get Git history
             job.message = 'Analyzing repository...'
             job.progress = 5
-            history = git_repo.get_commit_history(branch=job.options.get('branch'))
+            sampling = job.options.get('sampling') or {}
+            total_commits = git_repo.count_commits(branch=job.options.get('branch'), **sampling)
             
-            if not history:
+            if not total_commits:
                 raise ValueError("No commits found in the specified branch.")
             
-            job.message = f'Found {len(history)} commits. Rendering frames...'
+            check_cancelled(job)
+            history = git_repo.iter_commit_history(branch=job.options.get('branch'), **sampling)
+            job.message = f'Found {total_commits} commits. Rendering frames...'
             job.progress = 10
             
-            # Render frames
-            frame_paths = []
-            for i, commit in enumerate(history):
-                file_contents = git_repo.get_file_tree_at_commit(commit['commit_obj'])
-                frame = frame_renderer.render_frame(commit, file_contents)
-                
-                frame_path = os.path.join(temp_dir, f"frame_{i:05d}.png")
-                frame.save(frame_path)
-                frame_paths.append(frame_path)
-                
-                # Update progress (10% to 80%)
-                job.progress = 10 + int((i + 1) / len(history) * 70)
-                job.message = f'Rendering frames: {i+1}/{len(history)}'
-            
-            # Encode video
-            job.message = 'Encoding video...'
-            job.progress = 80
-            
             output_format = job.options.get('format', 'mp4')
             output_filename = f"timelapse_{job.job_id}.{output_format}"
             output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
@@ -114,9 +445,55 @@ def generate_timelapse_worker(job):
             video_encoder = VideoEncoder(
                 output_path,
                 frame_rate=job.options.get('fps', 2),
-                format=output_format
+                format=output_format,
+                profile=job.profile,
+                # FFmpeg is killed right away instead of finishing the encode
+                cancel_check=lambda: check_cancelled(job)
             )
-            video_encoder.create_video_from_frames(frame_paths)
+            if job.options.get('resumable'):
+                # Frames are kept on disk, so the stream encoder is not used
+                checkpoint = RunCheckpoint(os.path.join(job_state_dir(job.job_id), 'work'),
+                                           checkpoint_settings(frame_renderer, git_repo,
+                                                               dedupe=job.options.get('dedupe', False)),
+                                           resume=True)
+            streaming = job.options.get('encoder', 'stream') == 'stream' and checkpoint is None
+            if not streaming and checkpoint is None:
+                temp_dir = tempfile.mkdtemp()
+            
+            # Render frames
+            render_stats = RenderStats()
+            frames = render_frames(history, git_repo, frame_renderer, frame_dir=temp_dir,
+                                   jobs=resolve_jobs(job.options.get('jobs', 1)),
+                                   dedupe=job.options.get('dedupe', False), stats=render_stats,
+                                   frame_cache=get_frame_cache() if job.options.get('use_cache', False) else None,
+                                   incremental=job.options.get('incremental', False),
+                                   checkpoint=checkpoint, profile=job.profile)
+            
+            def track_progress(frames):
+                for i, commit, frame in frames:
+                    # Stops between frames; the stream encoder then kills FFmpeg
+                    check_cancelled(job)
+                    job.frames_deduplicated = render_stats.frames_deduplicated
+                    frames_rendered.inc()
+                    # Update progress (10% to 80%, or to 95% when encoding as we go)
+                    job.progress = 10 + int((i + 1) / total_commits * (85 if streaming else 70))
+                    job.message = f'Rendering frames: {i+1}/{total_commits}'
+                    yield frame
+            
+            # Encode video
+            if streaming:
+                video_encoder.create_video_from_stream(track_progress(frames), width, height)
+            else:
+                frame_paths = list(track_progress(frames))
+                job.message = 'Encoding video...'
+                job.progress = 80
+                check_cancelled(job)
+                if job.options.get('encoder') == 'segmented':
+                    video_encoder.create_video_from_segments(
+                        frame_paths, job.options.get('segments', 1), jobs=job.options.get('segment_jobs'),
+                        segment_dir=checkpoint.segment_dir if checkpoint is not None else None)
+                else:
+                    video_encoder.create_video_from_frames(frame_paths)
             
             job.output_path = output_path
             job.status = 'completed'
@@ -124,14 +501,36 @@ def generate_timelapse_worker(job):
             job.message = 'Time-lapse generated successfully!'
             
         finally:
+            # Stop a parallel render's worker processes right away
+            if frames is not None:
+                frames.close()
+            if git_repo is not None:
+                # Pooled repositories outlive the job
+                git_repo.profile = None
+                get_repo_pool().release(git_repo)
+            if job.profile is not None:
+                job.profile.stop()
+                record_job_metrics(job.profile)
+            if checkpoint is not None:
+                checkpoint.close()
             # Cleanup temporary frames
-            if os.path.exists(temp_dir):
+            if temp_dir is not None and os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
                 
+    except JobCancelled:
+        job.status = 'cancelled'
+        job.message = 'Cancelled.'
+        if output_path is not None and os.path.exists(output_path):
+            os.remove(output_path)
     except Exception as e:
         job.status = 'failed'
         job.error = str(e)
         job.message = f'Error: {str(e)}'
+    finally:
+        if job.options.get('resumable') and job.status in FINISHED_STATUSES:
+            # Nothing left to resume
+            shutil.rmtree(job_state_dir(job.job_id), ignore_errors=True)
+        save_job(job)
 
 
 @app.route('/')
@@ -150,8 +549,8 @@ def get_branches():
         if not repo_path or not os.path.exists(repo_path):
             return jsonify({'error': 'Invalid repository path'}), 400
         
-        git_repo = GitRepo(repo_path)
-        branches = [ref.name for ref in git_repo.repo.references if 'remotes' not in ref.name]
+        with get_repo_pool().repo(repo_path) as git_repo:
+            branches = git_repo.get_branches()
         
         return jsonify({'branches': branches})
     except Exception as e:
@@ -169,7 +568,7 @@ def generate():
             return jsonify({'error': 'Invalid repository path'}), 400
         
         # Generate job ID
-        job_id = f"{int(time.time())}_{len(jobs)}"
+        job_id = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
         
         # Handle custom resolution
         width = None
@@ -181,6 +580,29 @@ def generate():
             except (ValueError, TypeError):
                 return jsonify({'error': 'Invalid custom resolution dimensions'}), 400
 
+        try:
+            jobs_option = resolve_jobs(data.get('jobs', 1))
+            segments = resolve_jobs(data.get('segments', 'auto'))
+            segment_jobs = resolve_jobs(data.get('segment_jobs', 'auto'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            sampling = {
+                'every': int(data['sample_every']) if data.get('sample_every') else None,
+                'period': data.get('sample_period') or None,
+                'max_frames': int(data['max_frames']) if data.get('max_frames') else None,
+            }
+            check_sampling(**sampling)
+            path_filter = parse_path_filter(data)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            priority = int(data.get('priority', 0))
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid priority'}), 400
+
         # Create job
         options = {
             'format': data.get('format', 'mp4'),
@@ -192,124 +614,316 @@ def generate():
             'bg_color': data.get('bg_color', '#141618'),
             'text_color': data.get('text_color', '#FFFFFF'),
             'font_size': int(data.get('font_size', 15)),
-            'no_email': data.get('no_email', False)
+            'no_email': data.get('no_email', False),
+            'jobs': jobs_option,
+            'sampling': sampling,
+            'include': path_filter.include if path_filter else [],
+            'exclude': path_filter.exclude if path_filter else [],
+            'encoder': data.get('encoder') if data.get('encoder') in ('concat', 'segmented') else 'stream',
+            'segments': segments,
+            'segment_jobs': segment_jobs,
+            'dedupe': bool(data.get('dedupe', False)),
+            'incremental': bool(data.get('incremental', False)),
+            'use_cache': bool(data.get('use_cache', False)),
+            'text_backend': 'atlas' if data.get('text_backend') == 'atlas' else 'draw',
+            'resumable': bool(data.get('resumable', False))
         }
         
         job = TimelapseJob(job_id, repo_path, options)
-        jobs[job_id] = job
-        
-        # Start generation in background thread
-        thread = threading.Thread(target=generate_timelapse_worker, args=(job,))
-        thread.daemon = True
-        thread.start()
+        try:
+            with get_repo_pool().repo(repo_path) as git_repo:
+                job.request_key = request_key(git_repo.get_branch_tip(options['branch']), options)
+        except Exception:
+            # Not shared with other requests; the job reports the error when it runs
+            job.request_key = None
+
+        with _generate_lock:
+            source = get_job_store().find_reusable(job.request_key) if job.request_key else None
+            if source is not None and source.cancel_requested.is_set():
+                source = None
+            if source is not None and source.status not in FINISHED_STATUSES:
+                # The same video is being made: follow that job instead of rendering it again
+                source.attach(job)
+                get_job_store().add(job)
+            elif source is not None:
+                job.reuse = 'cached'
+                job.source_job_id = source.job_id
+                job.output_path = source.output_path
+                job.progress = 100
+                job.message = 'Time-lapse generated successfully!'
+                job.status = 'completed'
+                get_job_store().add(job)
+            else:
+                if options['resumable']:
+                    save_job_state(job, priority)
+
+                # Run in the background once a worker is free
+                job.message = 'Waiting for a free worker...'
+                get_job_store().add(job)
+                get_scheduler().submit(job, priority=priority)
+        if job.reuse is not None:
+            reused_requests.inc(reuse=job.reuse)
         
-        return jsonify({'job_id': job_id})
+        return jsonify({'job_id': job_id, 'reuse': job.reuse, 'source_job_id': job.source_job_id})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/preview', methods=['POST'])
-def preview():
-    """Generate a preview frame."""
-    try:
-        data = request.get_json()
-        repo_path = data.get('repo_path')
-
-        if not repo_path or not os.path.exists(repo_path):
-            return jsonify({'error': 'Invalid repository path'}), 400
+def preview_settings(data):
+    """
+    Builds the FrameRenderer arguments of a preview from the request fields.
 
-        # Determine resolution
-        width = None
-        height = None
-        if data.get('resolution') == 'custom':
-            try:
-                width = int(data.get('width'))
-                height = int(data.get('height'))
-            except (ValueError, TypeError):
-                return jsonify({'error': 'Invalid custom resolution dimensions'}), 400
-        else:
-            resolutions = {
-                "720p": (1280, 720),
-                "1080p": (1920, 1080),
-                "4k": (3840, 2160)
-            }
-            width, height = resolutions.get(data.get('resolution', '1080p'), (1920, 1080))
+    :raises ValueError: If a custom resolution is invalid.
+    """
+    if data.get('resolution') == 'custom':
+        try:
+            width = int(data.get('width'))
+            height = int(data.get('height'))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid custom resolution dimensions')
+    else:
+        resolutions = {
+            "720p": (1280, 720),
+            "1080p": (1920, 1080),
+            "4k": (3840, 2160)
+        }
+        width, height = resolutions.get(data.get('resolution', '1080p'), (1920, 1080))
+    no_email = data.get('no_email', False)
+    if isinstance(no_email, str):
+        # Query string values
+        no_email = no_email.lower() in ('1', 'true', 'on', 'yes')
+    return {
+        'width': width,
+        'height': height,
+        'bg_color': data.get('bg_color', '#141618'),
+        'text_color': data.get('text_color', '#FFFFFF'),
+        'font_size': int(data.get('font_size', 15)),
+        'no_email': bool(no_email),
+    }
+
+
+def get_preview_cache():
+    """Returns the preview cache shared by all requests, creating it on first use."""
+    global _preview_cache
+    with _preview_cache_lock:
+        if _preview_cache is None:
+            _preview_cache = PreviewCache(lambda **settings: FrameRenderer(**settings),
+                                          max_bytes=app.config['PREVIEW_CACHE_MAX_BYTES'])
+        return _preview_cache
+
+
+def render_preview(data, image_format, if_none_match=None):
+    """
+    Renders (or fetches from the cache) a preview of the latest commit of a branch.
 
-        # Initialize renderer
-        frame_renderer = FrameRenderer(
-            width=width,
-            height=height,
-            bg_color=data.get('bg_color', '#141618'),
-            text_color=data.get('text_color', '#FFFFFF'),
-            font_size=int(data.get('font_size', 15)),
-            no_email=data.get('no_email', False)
-        )
+    Only the branch tip is resolved; the history is never walked.
 
-        git_repo = GitRepo(repo_path)
+    :param data: The request fields.
+    :param image_format: One of PREVIEW_FORMATS.
+    :param if_none_match: The request's If-None-Match header. If it contains the
+                          preview's ETag, nothing is rendered.
+    :return: A tuple of the encoded image (None if the ETag matched) and its ETag.
+    :raises ValueError: If the request is invalid or the branch has no commits.
+    """
+    repo_path = data.get('repo_path')
+    if not repo_path or not os.path.exists(repo_path):
+        raise ValueError('Invalid repository path')
+    settings = preview_settings(data)
+    with get_repo_pool().repo(repo_path, parse_path_filter(data)) as git_repo:
+        latest_commit = git_repo.get_latest_commit(branch=data.get('branch') or None)
+        if latest_commit is None:
+            raise ValueError('No commits found')
+
+        preview_cache = get_preview_cache()
+        etag = preview_cache.etag(latest_commit['sha'], settings, git_repo.path_filter, image_format)
+        if if_none_match is not None and if_none_match.contains(etag):
+            return None, etag
+        return preview_cache.get_image(git_repo, latest_commit, settings, image_format)
 
-        # Get latest commit from the specified branch (or current)
-        history = git_repo.get_commit_history(branch=data.get('branch'))
-        if not history:
-             return jsonify({'error': 'No commits found'}), 400
 
-        # Use the latest commit for preview
-        latest_commit = history[-1]
+@app.route('/api/preview', methods=['POST'])
+def preview():
+    """Generate a preview frame, returned as a base64 PNG inside JSON."""
+    try:
+        image, _ = render_preview(request.get_json(), 'png')
+        return jsonify({'image': base64.b64encode(image).decode()})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        file_contents = git_repo.get_file_tree_at_commit(latest_commit['commit_obj'])
-        frame = frame_renderer.render_frame(latest_commit, file_contents)
 
-        # Convert to base64
-        buffered = io.BytesIO()
-        frame.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+@app.route('/api/preview/image', methods=['GET'])
+def preview_image():
+    """
+    Generate a preview frame, returned as an image.
 
-        return jsonify({'image': img_str})
+    Takes the same fields as /api/preview in the query string (include and
+    exclude may be repeated), plus 'image_format'. Without it, WebP is sent
+    unless the Accept header rules it out. Responses carry an ETag, so a
+    browser revalidating an unchanged preview gets a 304 without a render.
+    """
+    data = request.args.to_dict()
+    for field in ('include', 'exclude'):
+        data[field] = request.args.getlist(field)
+    image_format = data.get('image_format')
+    if image_format is None:
+        mimetypes = {mimetype: name for name, (_, mimetype, _) in PREVIEW_FORMATS.items()}
+        image_format = mimetypes[request.accept_mimetypes.best_match(list(mimetypes), 'image/png')]
+    if image_format not in PREVIEW_FORMATS:
+        return jsonify({'error': f"Unsupported preview format: '{image_format}'"}), 400
 
+    try:
+        image, etag = render_preview(data, image_format, request.if_none_match)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    response = Response(image, mimetype=PREVIEW_FORMATS[image_format][1], status=304 if image is None else 200)
+    response.set_etag(etag)
+    # Always revalidate: the same URL shows a new commit once the branch moves
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept'
+    return response
+
 
 @app.route('/api/jobs', methods=['GET'])
 def get_jobs():
-    """Get list of recent jobs."""
-    job_list = []
-    for job_id, job in jobs.items():
-        job_list.append({
-            'id': job.job_id,
-            'repo_path': job.repo_path,
-            'status': job.status,
-            'created_at': job.created_at,
-            'format': job.options.get('format'),
-            'has_output': job.output_path is not None
-        })
+    """
+    Get a page of recent jobs, newest first.
+
+    Query parameters: limit (the page size) and cursor (the next_cursor of the
+    previous page). The response has next_cursor set while more jobs follow.
+    """
+    try:
+        limit = int(request.args.get('limit', app.config['JOBS_PAGE_SIZE']))
+        page, next_cursor = get_job_store().list_page(min(limit, app.config['JOBS_MAX_PAGE_SIZE']),
+                                                      request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job_list = [{
+        'id': job.job_id,
+        'repo_path': job.repo_path,
+        'status': job.status,
+        'created_at': job.created_at,
+        'format': job.options.get('format'),
+        'has_output': job.output_path is not None
+    } for job in page]
+
+    return jsonify({'jobs': job_list, 'next_cursor': next_cursor})
 
-    # Sort by creation time (newest first)
-    job_list.sort(key=lambda x: x['created_at'], reverse=True)
 
-    return jsonify({'jobs': job_list})
+def job_status(job):
+    """Returns the status of a job as reported by /api/status."""
+    return {
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'error': job.error,
+        'has_output': job.output_path is not None,
+        'frames_deduplicated': job.frames_deduplicated,
+        'profile': job.profile.to_dict() if job.profile is not None else None,
+        'reuse': job.reuse,
+        'source_job_id': job.source_job_id,
+        'queue_position': get_scheduler().queue_position(job.source or job) if job.status == 'queued' else None
+    }
 
 
 @app.route('/api/status/<job_id>')
 def get_status(job_id):
     """Get the status of a time-lapse generation job."""
-    job = jobs.get(job_id)
+    job = get_job_store().get(job_id)
     
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    return jsonify({
-        'status': job.status,
-        'progress': job.progress,
-        'message': job.message,
-        'error': job.error,
-        'has_output': job.output_path is not None
-    })
+    return jsonify(job_status(job))
+
+
+@app.route('/api/status/<job_id>/stream')
+def stream_status(job_id):
+    """
+    Stream the status of a job as Server-Sent Events.
+
+    An event with the same data as /api/status is sent whenever the status
+    changes, at most once per STATUS_STREAM_INTERVAL; updates in between are
+    merged into the next event. The stream ends after the job finishes.
+    """
+    job = get_job_store().get(job_id)
+
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    interval = app.config['STATUS_STREAM_INTERVAL']
+    keepalive = app.config['STATUS_STREAM_KEEPALIVE']
+
+    def events():
+        version = -1
+        last_status = None
+        last_sent = 0
+        while True:
+            # Queue positions change without the job changing, so queued jobs are re-checked every second
+            version = job.wait_for_change(version, timeout=1 if job.status == 'queued' else keepalive)
+            # Let further updates arrive and send them together
+            time.sleep(max(0, last_sent + interval - time.monotonic()))
+            status = job_status(job)
+            if status != last_status:
+                yield f"data: {json.dumps(status)}\n\n"
+                last_status = status
+                last_sent = time.monotonic()
+                if status['status'] in FINISHED_STATUSES:
+                    return
+            elif time.monotonic() - last_sent >= keepalive:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/cancel/<job_id>', methods=['POST'])
+def cancel(job_id):
+    """Cancel a queued or running time-lapse generation job."""
+    job = get_job_store().get(job_id)
+
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    source = job.source
+    if source is not None and job.status not in FINISHED_STATUSES:
+        # Only this request stops following the render
+        source.detach(job)
+        job.status = 'cancelled'
+        job.message = 'Cancelled.'
+        get_job_store().save(job)
+        return jsonify({'status': job.status})
+    if job.followers:
+        return jsonify({'error': 'Other requests are waiting for this job'}), 409
+
+    if not get_scheduler().cancel(job):
+        return jsonify({'error': f'Job is already {job.status}'}), 409
+
+    # A queued job is cancelled right away, a running one stops at its next frame or kills FFmpeg
+    if job.status == 'cancelled':
+        job.message = 'Cancelled.'
+        if job.options.get('resumable'):
+            shutil.rmtree(job_state_dir(job_id), ignore_errors=True)
+        get_job_store().save(job)
+    return jsonify({'status': job.status})
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Report the server's metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
 
 
 @app.route('/api/download/<job_id>')
 def download(job_id):
     """Download the generated time-lapse."""
-    job = jobs.get(job_id)
+    job = get_job_store().get(job_id)
     
     if not job or not job.output_path:
         return jsonify({'error': 'Job not found or not completed'}), 404
@@ -333,6 +947,12 @@ def run_server(host='127.0.0.1', port=5000, debug=False):
     """
     if debug:
         print("WARNING: Debug mode is enabled. Do not use in production!")
+    resumed = resume_interrupted_jobs()
+    if resumed:
+        print(f"Resuming {resumed} interrupted job(s).")
+    interrupted = get_job_store().fail_interrupted()
+    if interrupted:
+        print(f"Marked {interrupted} job(s) interrupted by the restart as failed.")
     app.run(host=host, port=port, debug=debug)
 
 
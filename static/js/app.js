@@ -2,12 +2,14 @@
 
 let currentJobId = null;
 let statusCheckInterval = null;
+let statusSource = null;
 
 document.addEventListener('DOMContentLoaded', function() {
     // Set up event listeners
     document.getElementById('load-branches-btn').addEventListener('click', loadBranches);
     document.getElementById('generate-btn').addEventListener('click', generateTimelapse);
     document.getElementById('download-btn').addEventListener('click', downloadTimelapse);
+    document.getElementById('cancel-btn').addEventListener('click', cancelJob);
     document.getElementById('preview-btn').addEventListener('click', previewFrame);
     document.getElementById('close-preview').addEventListener('click', closePreview);
 
@@ -122,21 +124,24 @@ async function previewFrame() {
     loading.style.display = 'block';
 
     try {
-        const response = await fetch('/api/preview', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(config)
-        });
-
-        const data = await response.json();
+        // The image is requested with GET so the browser can revalidate it by ETag
+        const params = new URLSearchParams();
+        for (const [key, value] of Object.entries(config)) {
+            if (value !== null && value !== undefined && !Number.isNaN(value)) {
+                params.append(key, value);
+            }
+        }
+        const response = await fetch(`/api/preview/image?${params}`);
 
         if (!response.ok) {
+            const data = await response.json();
             throw new Error(data.error || 'Failed to generate preview');
         }
 
-        previewImg.src = `data:image/png;base64,${data.image}`;
+        if (previewImg.src.startsWith('blob:')) {
+            URL.revokeObjectURL(previewImg.src);
+        }
+        previewImg.src = URL.createObjectURL(await response.blob());
         previewImg.style.display = 'block';
         loading.style.display = 'none';
 
@@ -222,9 +227,10 @@ async function generateTimelapse() {
         // Show status section
         document.getElementById('status-section').style.display = 'block';
         document.getElementById('download-btn').style.display = 'none';
+        document.getElementById('cancel-btn').style.display = 'block';
         
-        // Start polling for status
-        startStatusPolling();
+        // Follow the job's status as it changes
+        startStatusUpdates();
         
         // Refresh job history immediately (it will show as pending/running)
         loadJobHistory();
@@ -236,6 +242,28 @@ async function generateTimelapse() {
     }
 }
 
+function startStatusUpdates() {
+    stopStatusPolling();
+
+    if (!window.EventSource) {
+        startStatusPolling();
+        return;
+    }
+
+    statusSource = new EventSource(`/api/status/${currentJobId}/stream`);
+    statusSource.onmessage = function(event) {
+        handleStatus(JSON.parse(event.data));
+    };
+    statusSource.onerror = function() {
+        // The stream broke before the job finished: fall back to polling
+        if (statusSource) {
+            statusSource.close();
+            statusSource = null;
+            startStatusPolling();
+        }
+    };
+}
+
 function startStatusPolling() {
     // Clear any existing interval
     if (statusCheckInterval) {
@@ -259,57 +287,96 @@ async function checkStatus() {
         if (!response.ok) {
             throw new Error(data.error || 'Failed to check status');
         }
-        
-        // Update progress bar
-        const progressFill = document.getElementById('progress-fill');
-        progressFill.style.width = `${data.progress}%`;
-        progressFill.textContent = `${data.progress}%`;
-        
-        // Update status message
-        document.getElementById('status-message').textContent = data.message;
-        
-        // Update detail based on status
-        const statusDetail = document.getElementById('status-detail');
-        if (data.status === 'running') {
-            statusDetail.textContent = 'Processing... This may take a few minutes.';
-        } else if (data.status === 'completed') {
-            statusDetail.textContent = 'Your time-lapse is ready!';
-            document.getElementById('download-btn').style.display = 'block';
-            stopStatusPolling();
-            
-            // Re-enable generate button
-            const btn = document.getElementById('generate-btn');
-            btn.disabled = false;
-            btn.textContent = 'Generate Time-lapse';
-
-            // Refresh history to show completed status
-            loadJobHistory();
-
-        } else if (data.status === 'failed') {
-            statusDetail.textContent = `Error: ${data.error || 'Unknown error occurred'}`;
-            statusDetail.style.color = 'var(--danger-color)';
-            stopStatusPolling();
-            
-            // Re-enable generate button
-            const btn = document.getElementById('generate-btn');
-            btn.disabled = false;
-            btn.textContent = 'Generate Time-lapse';
-
-            // Refresh history to show failed status
-            loadJobHistory();
-        }
-        
+
+        handleStatus(data);
     } catch (error) {
         console.error('Error checking status:', error);
         // Don't stop polling on error, might be temporary
     }
 }
 
+function handleStatus(data) {
+    // Update progress bar
+    const progressFill = document.getElementById('progress-fill');
+    progressFill.style.width = `${data.progress}%`;
+    progressFill.textContent = `${data.progress}%`;
+    
+    // Update status message
+    document.getElementById('status-message').textContent = data.message;
+    
+    // Update detail based on status
+    const statusDetail = document.getElementById('status-detail');
+    if (data.status === 'queued') {
+        statusDetail.textContent = `Queued: position ${data.queue_position} in line.`;
+    } else if (data.status === 'running') {
+        statusDetail.textContent = 'Processing... This may take a few minutes.';
+    } else if (data.status === 'completed') {
+        statusDetail.textContent = 'Your time-lapse is ready!';
+        document.getElementById('download-btn').style.display = 'block';
+        stopStatusPolling();
+        
+        // Re-enable generate button
+        const btn = document.getElementById('generate-btn');
+        btn.disabled = false;
+        btn.textContent = 'Generate Time-lapse';
+
+        // Refresh history to show completed status
+        loadJobHistory();
+
+    } else if (data.status === 'failed') {
+        statusDetail.textContent = `Error: ${data.error || 'Unknown error occurred'}`;
+        statusDetail.style.color = 'var(--danger-color)';
+        stopStatusPolling();
+        
+        // Re-enable generate button
+        const btn = document.getElementById('generate-btn');
+        btn.disabled = false;
+        btn.textContent = 'Generate Time-lapse';
+
+        // Refresh history to show failed status
+        loadJobHistory();
+
+    } else if (data.status === 'cancelled') {
+        statusDetail.textContent = 'The job was cancelled.';
+        stopStatusPolling();
+
+        // Re-enable generate button
+        const btn = document.getElementById('generate-btn');
+        btn.disabled = false;
+        btn.textContent = 'Generate Time-lapse';
+
+        loadJobHistory();
+    }
+}
+
 function stopStatusPolling() {
     if (statusCheckInterval) {
         clearInterval(statusCheckInterval);
         statusCheckInterval = null;
     }
+    if (statusSource) {
+        statusSource.close();
+        statusSource = null;
+    }
+    document.getElementById('cancel-btn').style.display = 'none';
+}
+
+async function cancelJob() {
+    if (!currentJobId) return;
+
+    try {
+        const response = await fetch(`/api/cancel/${currentJobId}`, { method: 'POST' });
+        const data = await response.json();
+
+        if (!response.ok) {
+            throw new Error(data.error || 'Failed to cancel the job');
+        }
+
+        document.getElementById('status-message').textContent = 'Cancelling...';
+        checkStatus();
+    } catch (error) {
+        alert(`Error cancelling job: ${error.message}`);
+    }
 }
 
 function downloadTimelapse() {
@@ -339,7 +406,7 @@ async function loadJobHistory() {
 
             let statusClass = '';
             if (job.status === 'completed') statusClass = 'status-completed';
-            else if (job.status === 'failed') statusClass = 'status-failed';
+            else if (job.status === 'failed' || job.status === 'cancelled') statusClass = 'status-failed';
             else statusClass = 'status-running';
 
             let actionHtml = '';
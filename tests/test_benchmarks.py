@@ -0,0 +1,46 @@
+import unittest
+import tempfile
+import shutil
+import os
+from git import Repo
+from benchmarks.synthetic_repo import SyntheticRepoSpec, generate_repo
+from benchmarks.run import compare, percentile
+
+class TestSyntheticRepo(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def test_generate_repo_is_deterministic(self):
+        spec = SyntheticRepoSpec(commits=40, files=12, file_size=256, binary_ratio=0.25, merge_density=0.3)
+        first = Repo(generate_repo(os.path.join(self.test_dir, 'a'), spec))
+        second = Repo(generate_repo(os.path.join(self.test_dir, 'b'), spec))
+        self.assertEqual(first.head.commit.hexsha, second.head.commit.hexsha)
+
+        main = list(first.iter_commits('main', first_parent=True))
+        self.assertEqual(len(main), 40)
+        self.assertTrue(any(len(commit.parents) == 2 for commit in main))
+        paths = [blob.path for blob in first.head.commit.tree.traverse() if blob.type == 'blob']
+        self.assertEqual(len(paths), 12)
+        self.assertEqual(sum(path.endswith('.bin') for path in paths), 3)
+
+        other = Repo(generate_repo(os.path.join(self.test_dir, 'c'), SyntheticRepoSpec(commits=40, seed=1)))
+        self.assertNotEqual(other.head.commit.hexsha, first.head.commit.hexsha)
+
+
+class TestBenchmarkCompare(unittest.TestCase):
+    def test_compare_flags_regressions(self):
+        def results(throughput, p50, rss):
+            return {'scenarios': {'render_1080p': {'throughput': throughput, 'peak_rss_mb': rss,
+                                                   'latency_ms': {'p50': p50, 'p90': p50 * 2}},
+                                  'encode_gif': {'skipped': 'No FFmpeg'}}}
+        baseline = results(100.0, 10.0, 200.0)
+        self.assertEqual(compare(baseline, results(95.0, 11.0, 210.0), threshold=0.15), [])
+        regressions = compare(baseline, results(80.0, 10.0, 260.0), threshold=0.15)
+        self.assertEqual([(name, metric) for name, metric, *_ in regressions],
+                         [('render_1080p', 'throughput'), ('render_1080p', 'peak_rss_mb')])
+        self.assertEqual(percentile([4, 1, 3, 2], 50), 2)
+        self.assertEqual(percentile([4, 1, 3, 2], 99), 4)
+
+if __name__ == '__main__':
+    unittest.main()
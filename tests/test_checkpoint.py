@@ -0,0 +1,112 @@
+import unittest
+import tempfile
+import shutil
+import os
+from git import Repo
+from src.git_utils import GitRepo
+from src.frame_renderer import FrameRenderer
+from src.parallel_renderer import render_frames, checkpoint_settings, RenderStats
+from src.checkpoint import RunCheckpoint, JOURNAL_FILE
+from src.video_encoder import HeldFrame
+
+class TestRunCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.work_dir = os.path.join(tempfile.mkdtemp(), 'work')
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.work_dir))
+        self.repo = Repo.init(self.test_dir)
+        for i in range(5):
+            with open(os.path.join(self.test_dir, f'file_{i}.txt'), 'w') as f:
+                f.write(f'This is file {i}')
+            self.repo.index.add([f'file_{i}.txt'])
+            self.repo.index.commit(f'Commit {i}')
+        self.git_repo = GitRepo(self.test_dir)
+        self.renderer = FrameRenderer(320, 240)
+        self.settings = checkpoint_settings(self.renderer, self.git_repo)
+
+    def render(self, checkpoint, stop_after=None, jobs=1):
+        stats = RenderStats()
+        frames = render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                               jobs=jobs, stats=stats, checkpoint=checkpoint)
+        paths = []
+        for _, _, frame_path in frames:
+            paths.append(frame_path)
+            if len(paths) == stop_after:
+                frames.close()
+                break
+        checkpoint.close()
+        return paths, stats
+
+    def test_resume_skips_finished_frames(self):
+        paths, _ = self.render(RunCheckpoint(self.work_dir, self.settings), stop_after=3)
+        self.assertEqual(len(paths), 3)
+        with open(paths[0], 'rb') as f:
+            first_frame = f.read()
+
+        for jobs in (1, 2):
+            paths, stats = self.render(RunCheckpoint(self.work_dir, self.settings, resume=True), jobs=jobs)
+            self.assertEqual(len(paths), 5)
+            self.assertEqual(stats.frames_resumed, 5 if jobs == 2 else 3)
+            self.assertEqual(stats.frames_rendered, 0 if jobs == 2 else 2)
+            with open(paths[0], 'rb') as f:
+                self.assertEqual(f.read(), first_frame)
+        # Resumed frames are not recorded twice
+        with open(os.path.join(self.work_dir, JOURNAL_FILE)) as f:
+            self.assertEqual(len(f.read().splitlines()), 5)
+
+    def test_other_settings_or_history_start_over(self):
+        self.render(RunCheckpoint(self.work_dir, self.settings))
+        _, stats = self.render(RunCheckpoint(self.work_dir, dict(self.settings, dedupe=True), resume=True))
+        self.assertEqual((stats.frames_resumed, stats.frames_rendered), (0, 5))
+
+        # Without resume, the work directory is reset
+        self.render(RunCheckpoint(self.work_dir, self.settings), stop_after=2)
+        _, stats = self.render(RunCheckpoint(self.work_dir, self.settings, resume=True))
+        self.assertEqual((stats.frames_resumed, stats.frames_rendered), (2, 3))
+
+        # A rewritten commit is rendered again, and so is everything after it
+        self.repo.git.reset('--hard', 'HEAD~3')
+        for i in range(2, 5):
+            with open(os.path.join(self.test_dir, f'file_{i}.txt'), 'w') as f:
+                f.write(f'This is rewritten file {i}')
+            self.repo.index.add([f'file_{i}.txt'])
+            self.repo.index.commit(f'Rewritten commit {i}')
+        _, stats = self.render(RunCheckpoint(self.work_dir, self.settings, resume=True))
+        self.assertEqual((stats.frames_resumed, stats.frames_rendered), (2, 3))
+
+    def test_held_frames_are_resumed(self):
+        checkpoint = RunCheckpoint(self.work_dir, self.settings)
+        paths = [os.path.join(checkpoint.frame_dir, name) for name in ('frame_00000.png', 'frame_00001_header.png')]
+        for path in paths:
+            open(path, 'wb').close()
+        checkpoint.record(0, 'a' * 40, paths[0])
+        checkpoint.record(1, 'b' * 40, HeldFrame(*paths))
+        checkpoint.close()
+
+        checkpoint = RunCheckpoint(self.work_dir, self.settings, resume=True)
+        self.assertEqual(checkpoint.resumed_frame(0, 'a' * 40), paths[0])
+        frame = checkpoint.resumed_frame(1, 'b' * 40)
+        self.assertEqual((frame.base, frame.header), tuple(paths))
+        checkpoint.close()
+
+        # A held frame whose header is gone is rendered again
+        os.remove(paths[1])
+        checkpoint = RunCheckpoint(self.work_dir, self.settings, resume=True)
+        self.assertEqual(checkpoint.resumed_frame(0, 'a' * 40), paths[0])
+        self.assertIsNone(checkpoint.resumed_frame(1, 'b' * 40))
+        checkpoint.close()
+
+    def test_cut_off_journal_line_is_ignored(self):
+        self.render(RunCheckpoint(self.work_dir, self.settings), stop_after=2)
+        with open(os.path.join(self.work_dir, JOURNAL_FILE), 'a') as f:
+            f.write('2 abc')
+        checkpoint = RunCheckpoint(self.work_dir, self.settings, resume=True)
+        self.assertEqual(checkpoint.resumable_frames, 2)
+        _, stats = self.render(checkpoint)
+        self.assertEqual(stats.frames_resumed, 2)
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(self.work_dir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import tempfile
+import shutil
+import os
+import tracemalloc
+from git import Repo
+from src.git_utils import GitRepo
+from src.commit_store import CommitStore
+
+class TestCommitStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.repo = Repo.init(self.test_dir)
+        for i in range(3):
+            with open(os.path.join(self.test_dir, f'file_{i}.txt'), 'w') as f:
+                f.write(f'This is file {i}')
+            self.repo.index.add([f'file_{i}.txt'])
+            self.repo.index.commit(f'Commit {i}\n\nWith a body.\n', commit_date=f'2024-03-0{i + 1}T12:00:00+0530')
+
+    def test_records_match_commit_dictionaries(self):
+        git_repo = GitRepo(self.test_dir)
+        store = git_repo.get_commit_history()
+        self.assertIsInstance(store, CommitStore)
+        self.assertEqual([dict(record) for record in store], list(git_repo.iter_commit_history()))
+
+        last = store[-1]
+        self.assertEqual(last['message'], 'Commit 2\n\nWith a body.')
+        self.assertEqual(last['date'], self.repo.head.commit.committed_datetime)
+        self.assertEqual(last['date'].utcoffset(), self.repo.head.commit.committed_datetime.utcoffset())
+        self.assertEqual(last['commit_obj'].tree['file_2.txt'].data_stream.read(), b'This is file 2')
+        self.assertEqual(store.raw_fields(0)[3], store[0]['date'].isoformat().encode('ascii'))
+        self.assertEqual(len(store[1:]), 2)
+        with self.assertRaises(IndexError):
+            store[3]
+        with self.assertRaises(KeyError):
+            last['tree']
+
+    def test_memory_per_commit(self):
+        commits = 20000
+        fields = [[f'{i:040x}'.encode('ascii'), f'Author {i % 50}'.encode('utf-8'),
+                   f'author{i % 50}@example.com'.encode('utf-8'), b'2024-01-01T12:00:00+02:00',
+                   f'Commit {i:05d}\n'.encode('utf-8')] for i in range(commits)]
+
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            store = CommitStore()
+            for commit_fields in fields:
+                store.append_fields(commit_fields)
+            per_commit = (tracemalloc.get_traced_memory()[0] - before) / commits
+        finally:
+            tracemalloc.stop()
+
+        # A 20-byte SHA, author id, time, UTC offset and message end, plus a 12-byte message
+        self.assertLess(per_commit, 100)
+        self.assertLess(store.nbytes / commits, 60)
+        self.assertEqual(len(store._authors), 50)
+        self.assertEqual(store[12345]['author_email'], 'author45@example.com')
+        self.assertEqual(store.sha(12345), f'{12345:040x}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import shutil
+import os
+from PIL import Image
+from src.frame_cache import FrameCache
+
+class TestFrameCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = {'width': 100, 'height': 100, 'bg_color': '#141618', 'text_color': '#ffffff',
+                         'font_path': None, 'font_size': 15, 'no_email': False}
+        self.key = FrameCache.settings_key(self.settings)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _frame(self, shade):
+        return Image.new('RGB', (100, 100), color=(shade, shade, shade))
+
+    def test_settings_key_depends_on_settings(self):
+        self.assertEqual(self.key, FrameCache.settings_key(dict(self.settings)))
+        other = dict(self.settings, font_size=16)
+        self.assertNotEqual(self.key, FrameCache.settings_key(other))
+
+    def test_put_and_get(self):
+        cache = FrameCache(self.cache_dir)
+        self.assertIsNone(cache.get('a' * 40, self.key))
+
+        path = cache.put('a' * 40, self.key, self._frame(10))
+        self.assertEqual(cache.get('a' * 40, self.key), path)
+        with Image.open(path) as image:
+            self.assertEqual(image.getpixel((0, 0)), (10, 10, 10))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_index_survives_reopen(self):
+        FrameCache(self.cache_dir).put('b' * 40, self.key, self._frame(20))
+        reopened = FrameCache(self.cache_dir)
+        self.assertEqual(len(reopened), 1)
+        self.assertIsNotNone(reopened.get('b' * 40, self.key))
+
+    def test_lru_eviction(self):
+        cache = FrameCache(self.cache_dir)
+        first = cache.put('1' * 40, self.key, self._frame(1))
+        frame_size = os.path.getsize(first)
+        cache.max_bytes = frame_size * 2
+        cache.put('2' * 40, self.key, self._frame(1))
+        cache.get('1' * 40, self.key)  # '2' is now the least recently used frame
+        cache.put('3' * 40, self.key, self._frame(1))
+
+        self.assertIsNotNone(cache.get('1' * 40, self.key))
+        self.assertIsNone(cache.get('2' * 40, self.key))
+        self.assertIsNotNone(cache.get('3' * 40, self.key))
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+    def test_put_file_and_clear(self):
+        cache = FrameCache(self.cache_dir)
+        path = cache.put('c' * 40, self.key, self._frame(30))
+        linked = cache.put_file('d' * 40, self.key, path)
+        self.assertTrue(os.path.samefile(path, linked))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertIsNone(cache.get('c' * 40, self.key))
+
+if __name__ == '__main__':
+    unittest.main()
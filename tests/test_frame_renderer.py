@@ -1,9 +1,11 @@
 import unittest
+import unittest.mock
+from collections.abc import Mapping
 import tempfile
 import os
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFont
 from datetime import datetime
-from src.frame_renderer import FrameRenderer
+from src.frame_renderer import FrameRenderer, IncrementalFrameRenderer
 
 class TestFrameRenderer(unittest.TestCase):
     def setUp(self):
@@ -76,5 +78,156 @@ class TestFrameRenderer(unittest.TestCase):
         # A better test would be to use OCR, but that's too complex for this context.
         # For now, we'll rely on the visual difference.
 
+    def test_atlas_backend_renders_frame(self):
+        renderer = FrameRenderer(self.width, self.height, text_backend='atlas')
+        img = renderer.render_frame(self.commit_info, self.file_contents)
+        self.assertEqual(img.size, (self.width, self.height))
+        self.assertEqual(self._get_pixel_color(img, 0, 0), renderer.bg_color)
+        # Text was drawn in the header area
+        self.assertIsNotNone(img.crop((0, 0, self.width, 60)).convert('L').point(lambda p: p > 128 and 255).getbbox())
+        self.assertEqual(renderer.settings['text_backend'], 'atlas')
+
+    def test_invalid_text_backend(self):
+        with self.assertRaises(ValueError):
+            FrameRenderer(self.width, self.height, text_backend='opengl')
+
+    def test_only_visible_files_are_loaded(self):
+        class CountingTree(Mapping):
+            def __init__(self, contents):
+                self.contents = contents
+                self.loaded = set()
+            def __getitem__(self, path):
+                self.loaded.add(path)
+                return self.contents[path]
+            def __iter__(self):
+                return iter(self.contents)
+            def __len__(self):
+                return len(self.contents)
+
+        contents = {f'dir/file_{i:04d}.py': '\n'.join(f'line {j}' for j in range(3)) for i in range(2000)}
+        tree = CountingTree(contents)
+        img = self.renderer.render_frame(self.commit_info, tree)
+
+        visible_paths, _ = self.renderer.plan_visible_files(contents)
+        self.assertLess(len(tree.loaded), 50)
+        self.assertTrue(tree.loaded <= set(visible_paths))
+        self.assertEqual(img.tobytes(), self.renderer.render_frame(self.commit_info, contents).tobytes())
+
+    def test_plan_visible_files_bounds_lines(self):
+        paths, max_lines = self.renderer.plan_visible_files(['b.py', 'a.py'])
+        self.assertEqual(paths, ['a.py', 'b.py'])
+        # A file with more lines than the bound renders the same as its first max_lines lines
+        long_file = '\n'.join(f'line {i}' for i in range(max_lines * 3))
+        short_file = '\n'.join(f'line {i}' for i in range(max_lines))
+        self.assertEqual(self.renderer.render_frame(self.commit_info, {'a.py': long_file}).tobytes(),
+                         self.renderer.render_frame(self.commit_info, {'a.py': short_file}).tobytes())
+
+    def test_content_fingerprint_ignores_hidden_lines(self):
+        long_file = '\n'.join(f'line {i}' for i in range(500))
+        base = {'a.py': long_file, 'z.py': 'print(1)'}
+        changed_below = {'a.py': long_file, 'z.py': 'print(2)'}
+        changed_visible = {'a.py': 'changed\n' + long_file, 'z.py': 'print(1)'}
+
+        fingerprint = self.renderer.content_fingerprint(base)
+        self.assertEqual(fingerprint, self.renderer.content_fingerprint(dict(base)))
+        self.assertEqual(fingerprint, self.renderer.content_fingerprint(changed_below))
+        self.assertNotEqual(fingerprint, self.renderer.content_fingerprint(changed_visible))
+
+    def test_content_key_measures_each_line_once(self):
+        long_file = '\n'.join(f'line {i}' for i in range(100))
+        file_contents = {'a.py': 'print(1)', 'b.py': long_file}
+        for backend in ('draw', 'atlas'):
+            renderer = FrameRenderer(self.width, self.height, text_backend=backend)
+            key = renderer.content_key(self.commit_info, file_contents)
+            # Another commit with the same lines is laid out from the remembered measurements
+            with unittest.mock.patch.object(type(renderer.font), 'getbbox', side_effect=AssertionError):
+                self.assertEqual(renderer.content_key(self.commit_info, dict(file_contents)), key, backend)
+
+    def test_header_overlay_matches_repainted_header(self):
+        file_contents = {'a.py': 'x = 1', 'b.py': 'y = 2'}
+        for backend in ('draw', 'atlas'):
+            renderer = FrameRenderer(self.width, self.height, text_backend=backend)
+            image = renderer.render_frame(self.commit_info, file_contents)
+            commit_info = dict(self.commit_info, hash='b2c3d4a', message='Test commit message again')
+            header = renderer.header_overlay(image, self.commit_info, commit_info)
+            self.assertEqual(header.size, (self.width, renderer.header_overlay_height))
+            # The header over the rest of the earlier frame is the whole repainted frame
+            expected = renderer.repaint_header(image, self.commit_info, commit_info)
+            image.paste(header, (0, 0))
+            self.assertEqual(image.tobytes(), expected.tobytes(), backend)
+
+        # With 'draw', a header without descenders is lower, and content that moves is repainted whole
+        moved = dict(self.commit_info, message='NO DESCENDERS')
+        self.assertNotEqual(self.renderer.content_top(moved), self.renderer.content_top(self.commit_info))
+        self.assertIsNone(self.renderer.header_overlay(image, self.commit_info, moved))
+
+    def test_incremental_renderer_matches_full_render(self):
+        incremental = IncrementalFrameRenderer(self.renderer)
+        long_file = '\n'.join(f'line {i}' for i in range(100))
+        steps = [
+            ({'a.py': 'print(1)', 'b.py': 'x = 1\ny = 2', 'c.py': long_file}, None),
+            # Same number of lines: repainted in place
+            ({'a.py': 'print(2)', 'b.py': 'x = 1\ny = 2', 'c.py': long_file}, {'a.py'}),
+            # More lines: everything below moves
+            ({'a.py': 'print(2)', 'b.py': 'x = 1\ny = 2\nz = 3', 'c.py': long_file}, {'b.py'}),
+            # A file is added in front and another one removed
+            ({'0.py': 'new', 'a.py': 'print(2)', 'c.py': long_file}, {'0.py', 'b.py'}),
+            # A change in the cut off file, and one below the frame
+            ({'0.py': 'new', 'a.py': 'print(2)', 'c.py': 'changed\n' + long_file, 'z.py': 'z'}, {'c.py', 'z.py'}),
+            # Files at the end are removed
+            ({'0.py': 'new'}, {'a.py', 'c.py', 'z.py'}),
+        ]
+        for i, (file_contents, changed_paths) in enumerate(steps):
+            commit_info = dict(self.commit_info, hash=f'abc000{i}')
+            expected = self.renderer.render_frame(commit_info, file_contents)
+            actual = incremental.render_frame(commit_info, file_contents, changed_paths)
+            self.assertEqual(actual.tobytes(), expected.tobytes(), f"step {i}")
+        self.assertEqual(incremental.full_renders, 1)
+        self.assertEqual(incremental.partial_renders, len(steps) - 1)
+
+    def test_incremental_renderer_with_glyphs_below_their_line(self):
+        # Pillow's bundled TrueType font; at this size '_' and '.' are drawn below the file's rows
+        try:
+            font_data = ImageFont.load_default(size=32).path.getvalue()
+        except (AttributeError, TypeError):
+            self.skipTest("Needs Pillow's FreeType default font")
+        with tempfile.NamedTemporaryFile(suffix='.ttf', delete=False) as f:
+            f.write(font_data)
+        self.addCleanup(os.remove, f.name)
+        for backend in ('draw', 'atlas'):
+            renderer = FrameRenderer(self.width, self.height, font_path=f.name, font_size=32, text_backend=backend)
+            incremental = IncrementalFrameRenderer(renderer)
+            steps = [
+                ({'a.py': 'x = 1\n...', 'b.py': 'old'}, None),
+                ({'a.py': 'x = 1\n...', 'b.py': 'new'}, {'b.py'}),
+                ({'a.py': 'x = 1\n___', 'b.py': 'new'}, {'a.py'}),
+                ({'a.py': 'x = 1\ny = 2', 'b.py': 'new'}, {'a.py'}),
+                ({'a.py': 'x = 1\ny = 2', 'b.py': 'newer'}, {'b.py'}),
+            ]
+            for i, (file_contents, changed_paths) in enumerate(steps):
+                expected = renderer.render_frame(self.commit_info, file_contents)
+                actual = incremental.render_frame(self.commit_info, file_contents, changed_paths)
+                self.assertEqual(actual.tobytes(), expected.tobytes(), f"{backend} step {i}")
+            # Once no glyphs are out of place, frames are repainted again
+            self.assertGreater(incremental.partial_renders, 0)
+
+    def test_incremental_renderer_does_not_measure_lines_again(self):
+        for backend in ('draw', 'atlas'):
+            renderer = FrameRenderer(self.width, self.height, text_backend=backend)
+            incremental = IncrementalFrameRenderer(renderer)
+            incremental.render_frame(self.commit_info, {'a.py': 'x = 1', 'b.py': 'y = 2'})
+            # Lines drawn before are checked against the remembered line and glyph metrics
+            with unittest.mock.patch.object(type(renderer.font), 'getbbox', side_effect=AssertionError):
+                incremental.render_frame(self.commit_info, {'a.py': 'y = 2', 'b.py': 'x = 1'}, {'a.py', 'b.py'})
+                incremental.render_frame(self.commit_info, {'a.py': 'x = 1', 'b.py': 'x = 1'}, {'b.py'})
+            self.assertEqual(incremental.partial_renders, 2, backend)
+
+    def test_incremental_renderer_does_not_modify_returned_frames(self):
+        incremental = IncrementalFrameRenderer(self.renderer)
+        first = incremental.render_frame(self.commit_info, {'a.py': 'one'})
+        first_bytes = first.tobytes()
+        incremental.render_frame(self.commit_info, {'a.py': 'two'}, {'a.py'})
+        self.assertEqual(first.tobytes(), first_bytes)
+
 if __name__ == '__main__':
     unittest.main()
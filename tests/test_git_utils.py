@@ -1,9 +1,13 @@
 import unittest
+import unittest.mock
 import tempfile
 import shutil
 import os
+import sys
+import gc
 from git import Repo
-from src.git_utils import GitRepo
+from src.git_utils import GitRepo, BlobCache, RepoIndex, BINARY_FILE_MARKER, SKIPPED_FILE_MARKER
+from src.path_filter import PathFilter
 
 class TestGitRepo(unittest.TestCase):
     def setUp(self):
@@ -75,5 +79,265 @@ class TestGitRepo(unittest.TestCase):
         file_tree2 = git_repo.get_file_tree_at_commit(commit2)
         self.assertEqual(file_tree2, {'file_0.txt': 'This is file 0', 'file_1.txt': 'This is file 1', 'file_2.txt': 'This is file 2'})
 
+    def test_iter_commit_history_streams_metadata(self):
+        git_repo = GitRepo(self.test_dir)
+        history = git_repo.iter_commit_history()
+
+        first = next(history)
+        self.assertEqual(first['sha'], self.commit_hashes[0])
+        self.assertEqual(first['message'], 'Commit 0')
+
+        expected = list(self.repo.iter_commits(reverse=True))
+        rest = list(history)
+        self.assertEqual(len(rest), 2)
+        for record, commit in zip([first] + rest, expected):
+            self.assertEqual(record['author_name'], commit.author.name)
+            self.assertEqual(record['author_email'], commit.author.email)
+            self.assertEqual(record['date'], commit.committed_datetime)
+            self.assertEqual(record['commit_obj'].hexsha, commit.hexsha)
+
+    def test_closing_history_early_stops_git_log(self):
+        # Long messages, so git is still writing when the walk is closed
+        for i in range(4):
+            self.repo.index.commit(f'Long {i}\n\n' + 'x' * 200000)
+        git_repo = GitRepo(self.test_dir)
+        history = git_repo.iter_commit_history()
+        self.assertEqual(next(history)['message'], 'Commit 0')
+        # git dies of SIGPIPE, which is not an error here; the inner generators are
+        # closed as they are collected, so an error would only reach the unraisable hook
+        with unittest.mock.patch('sys.unraisablehook') as unraisable:
+            history.close()
+            del history
+            gc.collect()
+        unraisable.assert_not_called()
+
+    def test_iter_commit_history_unknown_branch(self):
+        git_repo = GitRepo(self.test_dir)
+        with self.assertRaises(ValueError):
+            git_repo.iter_commit_history(branch='does-not-exist')
+
+    def test_get_latest_commit(self):
+        git_repo = GitRepo(self.test_dir)
+        latest = git_repo.get_latest_commit()
+        self.assertEqual(latest['sha'], self.commit_hashes[2])
+        self.assertEqual(latest['message'], 'Commit 2')
+
+        filtered = GitRepo(self.test_dir, path_filter=PathFilter(['file_1.txt']))
+        self.assertEqual(filtered.get_latest_commit()['sha'], self.commit_hashes[1])
+        self.assertIsNone(GitRepo(self.test_dir, path_filter=PathFilter(['missing'])).get_latest_commit())
+
+    def test_get_branch_tip(self):
+        self.assertEqual(GitRepo(self.test_dir).get_branch_tip(), self.commit_hashes[2])
+        filtered = GitRepo(self.test_dir, path_filter=PathFilter(['file_1.txt']), repo_index=RepoIndex())
+        self.assertEqual(filtered.get_branch_tip(), self.commit_hashes[2])
+        with self.assertRaises(ValueError):
+            GitRepo(self.test_dir).get_branch_tip('does-not-exist')
+
+    def test_repo_index_caches_history_until_refs_change(self):
+        repo_index = RepoIndex()
+        git_repo = GitRepo(self.test_dir, repo_index=repo_index)
+        self.assertEqual(len(git_repo.get_commit_history()), 3)
+        self.assertEqual(git_repo.get_branches(), [git_repo.repo.active_branch.name])
+
+        # A second handle reuses the resolved tip and the metadata without running git log
+        other = GitRepo(self.test_dir, repo_index=repo_index)
+        with unittest.mock.patch.object(GitRepo, '_stream_log_fields', side_effect=AssertionError):
+            self.assertEqual([c['sha'] for c in other.get_commit_history()], self.commit_hashes)
+            self.assertEqual(other.count_commits(), 3)
+            self.assertEqual(other.count_commits(period='day'), 1)
+            self.assertEqual(other.get_latest_commit()['sha'], self.commit_hashes[2])
+
+        # A new commit moves the branch, which invalidates the resolved tip
+        with open(os.path.join(self.test_dir, 'file_3.txt'), 'w') as f:
+            f.write('This is file 3')
+        self.repo.index.add(['file_3.txt'])
+        self.repo.index.commit('Commit 3')
+        self.assertEqual(other.count_commits(), 4)
+        self.assertEqual(other.get_latest_commit()['message'], 'Commit 3')
+        self.repo.create_head('feature')
+        self.assertEqual(len(other.get_branches()), 2)
+
+    def test_count_commits(self):
+        git_repo = GitRepo(self.test_dir)
+        self.assertEqual(git_repo.count_commits(), 3)
+
+    def test_sampling_keeps_last_commit_of_each_group(self):
+        for i in range(3, 7):
+            self._commit_file(f'file_{i}.txt', f'Commit {i}')
+        git_repo = GitRepo(self.test_dir)
+
+        sampled = git_repo.get_commit_history(every=3)
+        self.assertEqual([commit['message'] for commit in sampled], ['Commit 2', 'Commit 5', 'Commit 6'])
+        self.assertEqual(git_repo.count_commits(every=3), 3)
+
+        sampled = git_repo.get_commit_history(max_frames=2)
+        self.assertEqual([commit['message'] for commit in sampled], ['Commit 3', 'Commit 6'])
+        self.assertEqual(git_repo.count_commits(max_frames=2), 2)
+        self.assertEqual(len(git_repo.get_commit_history(max_frames=100)), 7)
+
+    def test_sampling_by_period(self):
+        dates = ['2024-01-01T09:00:00+0000', '2024-01-01T18:00:00+0000', '2024-01-03T10:00:00+0000',
+                 '2024-01-08T10:00:00+0000', '2024-01-08T11:00:00+0000']
+        for i, date in enumerate(dates):
+            self._commit_file(f'dated_{i}.txt', f'Dated {i}', date=date)
+        git_repo = GitRepo(self.test_dir)
+
+        # The three setUp commits come first and share the day they were made on
+        per_day = [commit['message'] for commit in git_repo.get_commit_history(period='day')]
+        self.assertEqual(per_day, ['Commit 2', 'Dated 1', 'Dated 2', 'Dated 4'])
+        self.assertEqual(git_repo.count_commits(period='day'), 4)
+        per_week = [commit['message'] for commit in git_repo.get_commit_history(period='week')]
+        self.assertEqual(per_week, ['Commit 2', 'Dated 2', 'Dated 4'])
+        self.assertEqual(git_repo.count_commits(period='week'), 3)
+
+    def test_invalid_sampling(self):
+        git_repo = GitRepo(self.test_dir)
+        for options in ({'every': 0}, {'max_frames': -1}, {'period': 'month'}, {'every': 2, 'max_frames': 10}):
+            with self.assertRaises(ValueError):
+                git_repo.iter_commit_history(**options)
+
+    def test_path_filter_limits_history_and_trees(self):
+        self._commit_file('services/billing/api.py', 'Add billing')
+        self._commit_file('services/auth/login.py', 'Add auth')
+        self._commit_file('services/billing/debug.log', 'Add billing log')
+        git_repo = GitRepo(self.test_dir, path_filter=PathFilter(['services/billing'], ['*.log', '**/*.log']))
+
+        history = git_repo.get_commit_history()
+        self.assertEqual([commit['message'] for commit in history], ['Add billing'])
+        self.assertEqual(git_repo.count_commits(), 1)
+
+        tip = self.repo.head.commit
+        self.assertEqual(git_repo.get_file_tree_at_commit(tip), {'services/billing/api.py': 'Add billing'})
+        self.assertEqual(list(git_repo.get_file_tree_at_commit(tip, lazy=True)), ['services/billing/api.py'])
+        self.assertEqual(git_repo.get_changed_paths(self.repo.commit(self.commit_hashes[0]), tip),
+                         {'services/billing/api.py'})
+
+    def _commit_file(self, name, message, date=None):
+        file_path = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(message)
+        self.repo.index.add([file_path])
+        self.repo.index.commit(message, author_date=date, commit_date=date)
+
+    def test_lazy_file_tree_reads_blobs_on_access(self):
+        git_repo = GitRepo(self.test_dir)
+        commit = self.repo.head.commit
+        lazy_tree = git_repo.get_file_tree_at_commit(commit, lazy=True)
+
+        self.assertEqual(sorted(lazy_tree), ['file_0.txt', 'file_1.txt', 'file_2.txt'])
+        self.assertEqual(lazy_tree.loaded_paths, set())
+        self.assertEqual(git_repo.blob_cache.misses, 0)
+
+        self.assertEqual(lazy_tree['file_1.txt'], 'This is file 1')
+        self.assertEqual(lazy_tree.loaded_paths, {'file_1.txt'})
+        self.assertEqual(lazy_tree, git_repo.get_file_tree_at_commit(commit))
+
+    def test_file_tree_reuses_cached_blobs(self):
+        git_repo = GitRepo(self.test_dir)
+        history = git_repo.get_commit_history()
+
+        for commit in history:
+            git_repo.get_file_tree_at_commit(commit['commit_obj'])
+
+        # Three distinct blobs are read once each, every later lookup is a hit
+        self.assertEqual(git_repo.blob_cache.misses, 3)
+        self.assertEqual(git_repo.blob_cache.hits, 3)
+        self.assertEqual(len(git_repo.blob_cache), 3)
+
+    def test_file_tree_marks_binary_files(self):
+        file_path = os.path.join(self.test_dir, 'image.bin')
+        with open(file_path, 'wb') as f:
+            f.write(b'\xff\xfe\x00\x01')
+        self.repo.index.add([file_path])
+        commit = self.repo.index.commit('Add binary')
+
+        git_repo = GitRepo(self.test_dir)
+        file_tree = git_repo.get_file_tree_at_commit(commit)
+        self.assertEqual(file_tree['image.bin'], BINARY_FILE_MARKER)
+
+    def test_large_files_are_cut_off(self):
+        lines = [f'line {i} \u00e9' for i in range(1000)]
+        self._commit_file('big.txt', '\n'.join(lines))
+        git_repo = GitRepo(self.test_dir, max_file_bytes=100)
+
+        content = git_repo.get_file_tree_at_commit(self.repo.head.commit)['big.txt']
+        # Only whole lines from the first 100 bytes are kept
+        self.assertLessEqual(len(content.encode('utf-8')), 100)
+        self.assertEqual(content.splitlines(), lines[:len(content.splitlines())])
+        self.assertGreater(len(content.splitlines()), 5)
+
+    def test_nul_bytes_mark_files_as_binary(self):
+        file_path = os.path.join(self.test_dir, 'data.bin')
+        with open(file_path, 'wb') as f:
+            f.write(b'valid utf-8\0' * 10000)
+        self.repo.index.add([file_path])
+        commit = self.repo.index.commit('Add data')
+
+        for max_file_bytes in (1024 * 1024, 64):
+            git_repo = GitRepo(self.test_dir, max_file_bytes=max_file_bytes)
+            self.assertEqual(git_repo.get_file_tree_at_commit(commit)['data.bin'], BINARY_FILE_MARKER)
+
+    def test_commit_read_budget(self):
+        git_repo = GitRepo(self.test_dir, max_commit_bytes=20)
+        file_tree = git_repo.get_file_tree_at_commit(self.repo.head.commit, lazy=True)
+
+        # Each file holds 14 characters: the second one crosses the budget, the third is skipped
+        self.assertEqual(file_tree['file_0.txt'], 'This is file 0')
+        self.assertEqual(file_tree['file_1.txt'], 'This is file 1')
+        self.assertEqual(file_tree['file_2.txt'], SKIPPED_FILE_MARKER)
+        # Skipped files are not cached, so another tree still reads them
+        self.assertEqual(git_repo.get_file_tree_at_commit(self.repo.head.commit, lazy=True)['file_2.txt'],
+                         'This is file 2')
+
+    def test_get_changed_paths(self):
+        os.makedirs(os.path.join(self.test_dir, 'docs', 'api'))
+        nested_path = os.path.join(self.test_dir, 'docs', 'api', 'index.md')
+        with open(nested_path, 'w') as f:
+            f.write('API')
+        with open(os.path.join(self.test_dir, 'file_0.txt'), 'w') as f:
+            f.write('Changed file 0')
+        self.repo.index.add([nested_path, os.path.join(self.test_dir, 'file_0.txt')])
+        self.repo.index.remove([os.path.join(self.test_dir, 'file_2.txt')], working_tree=True)
+        commit = self.repo.index.commit('Change files')
+
+        git_repo = GitRepo(self.test_dir)
+        first = self.repo.commit(self.commit_hashes[0])
+        self.assertEqual(git_repo.get_changed_paths(commit.parents[0], commit),
+                         {'docs/api/index.md', 'file_0.txt', 'file_2.txt'})
+        # Commits further apart include everything that changed in between
+        self.assertEqual(git_repo.get_changed_paths(first, commit),
+                         {'docs/api/index.md', 'file_0.txt', 'file_1.txt'})
+        self.assertEqual(git_repo.get_changed_paths(commit, commit), set())
+
+
+class TestBlobCache(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = BlobCache()
+        self.assertIsNone(cache.get('abc'))
+        cache.put('abc', 'content')
+        self.assertEqual(cache.get('abc'), 'content')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_lru_eviction(self):
+        entry_size = sys.getsizeof('x' * 100)
+        cache = BlobCache(max_bytes=entry_size * 2)
+        cache.put('a', 'a' * 100)
+        cache.put('b', 'b' * 100)
+        cache.get('a')  # 'b' is now the least recently used entry
+        cache.put('c', 'c' * 100)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+    def test_oversized_entry_is_not_cached(self):
+        cache = BlobCache(max_bytes=10)
+        cache.put('big', 'x' * 1000)
+        self.assertNotIn('big', cache)
+        self.assertEqual(cache.current_bytes, 0)
+
 if __name__ == '__main__':
     unittest.main()
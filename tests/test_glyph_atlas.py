@@ -0,0 +1,39 @@
+import unittest
+from PIL import Image, ImageDraw, ImageFont, ImageChops
+from src.glyph_atlas import GlyphAtlas
+
+class TestGlyphAtlas(unittest.TestCase):
+    def setUp(self):
+        self.font = ImageFont.load_default()
+        self.atlas = GlyphAtlas(self.font)
+
+    def _draw_both(self, text):
+        expected = Image.new('RGB', (600, 40), (20, 22, 24))
+        ImageDraw.Draw(expected).text((10, 10), text, font=self.font, fill=(255, 255, 255))
+        actual = Image.new('RGB', (600, 40), (20, 22, 24))
+        self.atlas.draw_text(ImageDraw.Draw(actual), (10, 10), text, (255, 255, 255))
+        return expected, actual
+
+    def test_matches_imagedraw_text(self):
+        expected, actual = self._draw_both("def render(self, commit): return {'a': [1, 2]}  # ok")
+        self.assertIsNone(ImageChops.difference(expected, actual).getbbox())
+
+    def test_glyphs_are_rasterized_once(self):
+        self._draw_both("aaaa bbbb")
+        self.assertEqual(len(self.atlas), 3)  # 'a', ' ', 'b'
+        self._draw_both("abab")
+        self.assertEqual(len(self.atlas), 3)
+
+    def test_fixed_line_height(self):
+        self.assertGreater(self.atlas.line_height, 0)
+        bbox = self.font.getbbox("Ag|()[]{}")
+        self.assertEqual(self.atlas.line_height, bbox[3] - bbox[1])
+
+    def test_ink_rows_match_font_bbox(self):
+        for text in ("def f(x): return [x]", "...", "___", "    ", ""):
+            bbox = self.font.getbbox(text)
+            expected = (bbox[1], bbox[3]) if bbox[3] > bbox[1] else (0, 0)
+            self.assertEqual(self.atlas.ink_rows(text), expected, repr(text))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import threading
+import time
+from src.job_scheduler import JobScheduler
+
+class FakeJob:
+    def __init__(self, name):
+        self.name = name
+        self.status = 'pending'
+        self.cancel_requested = threading.Event()
+
+class TestJobScheduler(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = []
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.all_done = threading.Semaphore(0)
+
+    def _run(self, job):
+        with self.lock:
+            self.started.append(job.name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        job.status = 'running'
+        self.release.wait(5)
+        with self.lock:
+            self.running -= 1
+        job.status = 'completed'
+        self.all_done.release()
+
+    def _wait_until(self, condition):
+        deadline = time.time() + 5
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_runs_at_most_max_workers_jobs(self):
+        scheduler = JobScheduler(self._run, max_workers=2)
+        job_list = [FakeJob(i) for i in range(5)]
+        for job in job_list:
+            scheduler.submit(job)
+        self._wait_until(lambda: scheduler.running_count == 2)
+        self.assertEqual(scheduler.queued_count, 3)
+        self.release.set()
+        for _ in job_list:
+            self.assertTrue(self.all_done.acquire(timeout=5))
+        self.assertEqual(self.max_running, 2)
+        self.assertEqual(sorted(self.started), list(range(5)))
+
+    def test_priority_order_and_queue_position(self):
+        scheduler = JobScheduler(self._run, max_workers=1)
+        blocker = FakeJob('blocker')
+        scheduler.submit(blocker)
+        self._wait_until(lambda: scheduler.running_count == 1)
+
+        low, normal, high = FakeJob('low'), FakeJob('normal'), FakeJob('high')
+        scheduler.submit(low, priority=-1)
+        scheduler.submit(normal)
+        scheduler.submit(high, priority=5)
+        self.assertEqual(low.status, 'queued')
+        self.assertEqual([scheduler.queue_position(job) for job in (high, normal, low)], [1, 2, 3])
+        self.assertIsNone(scheduler.queue_position(blocker))
+
+        self.release.set()
+        for _ in range(4):
+            self.assertTrue(self.all_done.acquire(timeout=5))
+        self.assertEqual(self.started, ['blocker', 'high', 'normal', 'low'])
+
+    def test_cancel(self):
+        scheduler = JobScheduler(self._run, max_workers=1)
+        running, queued = FakeJob('running'), FakeJob('queued')
+        scheduler.submit(running)
+        scheduler.submit(queued)
+        self._wait_until(lambda: scheduler.running_count == 1)
+
+        self.assertTrue(scheduler.cancel(queued))
+        self.assertEqual(queued.status, 'cancelled')
+        self.assertEqual(scheduler.queued_count, 0)
+
+        self.assertTrue(scheduler.cancel(running))
+        self.assertTrue(running.cancel_requested.is_set())
+
+        self.release.set()
+        self._wait_until(lambda: scheduler.running_count == 0)
+        self.assertFalse(scheduler.cancel(running))
+        self.assertEqual(self.started, ['running'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import tempfile
+import shutil
+import os
+from src.job_store import JobStore
+
+class FakeJob:
+    def __init__(self, job_id, repo_path, options):
+        self.job_id = job_id
+        self.repo_path = repo_path
+        self.options = options
+        self.status = 'pending'
+        self.progress = 0
+        self.message = ''
+        self.error = None
+        self.output_path = None
+        self.frames_deduplicated = 0
+        self.profile = None
+        self.created_at = 0
+        self.request_key = None
+        self.source_job_id = None
+        self.reuse = None
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.clock = FakeClock()
+        self.store = self.open_store()
+
+    def open_store(self, **limits):
+        return JobStore(os.path.join(self.test_dir, 'jobs.sqlite3'), FakeJob, clock=self.clock, **limits)
+
+    def add_job(self, store, job_id, status, created_at, output_size=None):
+        job = FakeJob(job_id, '/repo', {'format': 'mp4'})
+        job.status = status
+        job.created_at = created_at
+        if output_size is not None:
+            job.output_path = os.path.join(self.test_dir, f'{job_id}.mp4')
+            with open(job.output_path, 'wb') as f:
+                f.write(b'x' * output_size)
+        store.add(job)
+        return job
+
+    def test_finished_jobs_are_read_back_from_the_database(self):
+        running = self.add_job(self.store, 'running', 'running', 1)
+        done = self.add_job(self.store, 'done', 'completed', 2, output_size=10)
+
+        self.assertIs(self.store.get('running'), running)
+        self.assertIsNone(self.store.live('done'))
+        loaded = self.store['done']
+        self.assertIsNot(loaded, done)
+        self.assertEqual((loaded.status, loaded.output_path, loaded.options), ('completed', done.output_path,
+                                                                               {'format': 'mp4'}))
+        self.assertNotIn('missing', self.store)
+        with self.assertRaises(KeyError):
+            self.store['missing']
+
+        # The history survives a restart; the running job was interrupted
+        reopened = self.open_store()
+        self.assertEqual(reopened.fail_interrupted(), 1)
+        self.assertEqual(reopened['running'].status, 'failed')
+        self.assertEqual(reopened['done'].status, 'completed')
+        self.assertEqual(reopened.count_by_status(), {'failed': 1, 'completed': 1})
+
+    def test_pages_newest_first(self):
+        for i in range(5):
+            self.add_job(self.store, f'job_{i}', 'completed', created_at=i)
+        live = self.add_job(self.store, 'job_5', 'pending', created_at=5)
+        live.status = 'running'
+
+        page, cursor = self.store.list_page(limit=2)
+        self.assertEqual([job.job_id for job in page], ['job_5', 'job_4'])
+        self.assertIs(page[0], live)
+        page, cursor = self.store.list_page(limit=2, cursor=cursor)
+        self.assertEqual([job.job_id for job in page], ['job_3', 'job_2'])
+        page, cursor = self.store.list_page(limit=2, cursor=cursor)
+        self.assertEqual([job.job_id for job in page], ['job_1', 'job_0'])
+        self.assertIsNone(cursor)
+        self.assertEqual(self.store.count_by_status(), {'completed': 5, 'running': 1})
+        with self.assertRaises(ValueError):
+            self.store.list_page(cursor='bad')
+
+    def test_sweep_deletes_expired_jobs_and_oldest_outputs(self):
+        store = self.open_store(max_age=100, max_output_bytes=25)
+        old = self.add_job(store, 'old', 'completed', 1, output_size=10)
+        self.clock.now += 60
+        middle = self.add_job(store, 'middle', 'completed', 2, output_size=10)
+        self.clock.now += 10
+        new = self.add_job(store, 'new', 'completed', 3, output_size=10)
+        self.add_job(store, 'running', 'running', 4)
+
+        # Over the size limit: the oldest output goes, its job stays
+        self.assertEqual(store.sweep(), (0, 1))
+        self.assertFalse(os.path.exists(old.output_path))
+        self.assertIsNone(store['old'].output_path)
+        self.assertTrue(os.path.exists(middle.output_path))
+
+        # Past the age limit: the job goes with its output
+        self.clock.now += 95
+        self.assertEqual(store.sweep(), (2, 1))
+        self.assertNotIn('old', store)
+        self.assertFalse(os.path.exists(middle.output_path))
+        self.assertTrue(os.path.exists(new.output_path))
+        self.assertIn('running', store)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ from src import main
 
 class TestMainCli(unittest.TestCase):
 
-    @patch('sys.argv', ['src/main.py', 'fake_repo', 'output.mp4', '--fps', '5'])
+    @patch('sys.argv', ['src/main.py', 'fake_repo', 'output.mp4', '--fps', '5', '--encoder', 'concat'])
     @patch('src.main.GitRepo')
     @patch('src.main.FrameRenderer')
     @patch('src.main.VideoEncoder')
@@ -17,7 +17,8 @@ class TestMainCli(unittest.TestCase):
 
         mock_commit1 = {'hash': '1234567', 'commit_obj': MagicMock()}
         mock_commit2 = {'hash': 'abcdefg', 'commit_obj': MagicMock()}
-        mock_repo_instance.get_commit_history.return_value = [mock_commit1, mock_commit2]
+        mock_repo_instance.count_commits.return_value = 2
+        mock_repo_instance.iter_commit_history.return_value = iter([mock_commit1, mock_commit2])
 
         mock_repo_instance.get_file_tree_at_commit.side_effect = [
             {'file1.txt': 'content1'},
@@ -37,7 +38,7 @@ class TestMainCli(unittest.TestCase):
         main.main()
 
         # --- Assertions ---
-        mock_git_repo.assert_called_once_with('fake_repo')
+        mock_git_repo.assert_called_once_with('fake_repo', path_filter=None, profile=None)
         mock_frame_renderer.assert_called_once_with(
             width=1920,
             height=1080,
@@ -45,9 +46,11 @@ class TestMainCli(unittest.TestCase):
             text_color='#FFFFFF',
             font_path=None,
             font_size=15,
-            no_email=False
+            no_email=False,
+            text_backend='draw'
         )
-        mock_repo_instance.get_commit_history.assert_called_once_with(branch=None)
+        mock_repo_instance.count_commits.assert_called_once_with(branch=None, every=None, period=None, max_frames=None)
+        mock_repo_instance.iter_commit_history.assert_called_once_with(branch=None, every=None, period=None, max_frames=None)
 
         # Check calls to render_frame using a direct comparison of call_args_list
         self.assertEqual(mock_renderer_instance.render_frame.call_count, 2)
@@ -65,7 +68,7 @@ class TestMainCli(unittest.TestCase):
             call('fake_temp_dir/frame_00001.png')
         ])
 
-        mock_video_encoder.assert_called_once_with('output.mp4', frame_rate=5, format='mp4')
+        mock_video_encoder.assert_called_once_with('output.mp4', frame_rate=5, format='mp4', profile=None)
         mock_encoder_instance.create_video_from_frames.assert_called_once_with([
             'fake_temp_dir/frame_00000.png',
             'fake_temp_dir/frame_00001.png'
@@ -73,6 +76,60 @@ class TestMainCli(unittest.TestCase):
 
         mock_rmtree.assert_called_once_with('fake_temp_dir')
 
+    @patch('sys.argv', ['src/main.py', 'fake_repo', 'output.mp4', '--encoder', 'segmented', '--segments', '4',
+                        '--segment-jobs', '2'])
+    @patch('src.main.GitRepo')
+    @patch('src.main.FrameRenderer')
+    @patch('src.main.VideoEncoder')
+    @patch('src.main.tempfile.mkdtemp', return_value='fake_temp_dir')
+    @patch('src.main.shutil.rmtree')
+    def test_main_segmented_encoder(self, mock_rmtree, mock_mkdtemp, mock_video_encoder, mock_frame_renderer,
+                                    mock_git_repo):
+        mock_repo_instance = mock_git_repo.return_value
+        mock_repo_instance.count_commits.return_value = 1
+        mock_repo_instance.iter_commit_history.return_value = iter([{'hash': '1234567', 'commit_obj': MagicMock()}])
+        mock_repo_instance.get_file_tree_at_commit.return_value = {}
+
+        main.main()
+
+        mock_encoder_instance = mock_video_encoder.return_value
+        mock_encoder_instance.create_video_from_segments.assert_called_once_with(
+            ['fake_temp_dir/frame_00000.png'], 4, jobs=2, segment_dir=None)
+        mock_encoder_instance.create_video_from_frames.assert_not_called()
+        mock_rmtree.assert_called_once_with('fake_temp_dir')
+
+    @patch('sys.argv', ['src/main.py', 'fake_repo', 'output.mp4', '--resolution', '720p'])
+    @patch('src.main.GitRepo')
+    @patch('src.main.FrameRenderer')
+    @patch('src.main.VideoEncoder')
+    @patch('src.main.tempfile.mkdtemp')
+    def test_main_streams_frames_to_encoder(self, mock_mkdtemp, mock_video_encoder, mock_frame_renderer, mock_git_repo):
+        mock_repo_instance = MagicMock()
+        mock_git_repo.return_value = mock_repo_instance
+        mock_commit1 = {'hash': '1234567', 'commit_obj': MagicMock()}
+        mock_commit2 = {'hash': 'abcdefg', 'commit_obj': MagicMock()}
+        mock_repo_instance.count_commits.return_value = 2
+        mock_repo_instance.iter_commit_history.return_value = iter([mock_commit1, mock_commit2])
+        mock_repo_instance.get_file_tree_at_commit.return_value = {}
+
+        frame1, frame2 = MagicMock(), MagicMock()
+        mock_frame_renderer.return_value.render_frame.side_effect = [frame1, frame2]
+
+        streamed = []
+        mock_encoder_instance = mock_video_encoder.return_value
+        mock_encoder_instance.create_video_from_stream.side_effect = \
+            lambda frames, width, height: streamed.extend(frames)
+
+        main.main()
+
+        # Frames go straight to the encoder and never touch disk
+        mock_mkdtemp.assert_not_called()
+        frame1.save.assert_not_called()
+        self.assertEqual(streamed, [frame1, frame2])
+        args = mock_encoder_instance.create_video_from_stream.call_args.args
+        self.assertEqual(args[1:], (1280, 720))
+        mock_encoder_instance.create_video_from_frames.assert_not_called()
+
     @patch('sys.argv', ['src/main.py', 'fake_repo', 'output.mp4', '--no-email'])
     @patch('src.main.GitRepo')
     @patch('src.main.FrameRenderer')
@@ -83,7 +140,8 @@ class TestMainCli(unittest.TestCase):
         # We only need to test that the `no_email` flag is passed correctly
         mock_repo_instance = MagicMock()
         mock_git_repo.return_value = mock_repo_instance
-        mock_repo_instance.get_commit_history.return_value = [{'hash': '123', 'commit_obj': MagicMock()}]
+        mock_repo_instance.count_commits.return_value = 1
+        mock_repo_instance.iter_commit_history.return_value = iter([{'hash': '123', 'commit_obj': MagicMock()}])
         mock_repo_instance.get_file_tree_at_commit.return_value = {}
 
         main.main()
@@ -93,5 +151,29 @@ class TestMainCli(unittest.TestCase):
         kwargs = mock_frame_renderer.call_args.kwargs
         self.assertTrue(kwargs.get('no_email', False))
 
+    @patch('sys.argv', ['src/main.py', 'fake_repo', 'output.mp4', '--cache', '--cache-dir', 'fake_cache',
+                        '--cache-size', '10'])
+    @patch('src.main.GitRepo')
+    @patch('src.main.FrameRenderer')
+    @patch('src.main.VideoEncoder')
+    @patch('src.main.FrameCache')
+    @patch('src.main.render_frames', return_value=iter([]))
+    def test_main_uses_frame_cache(self, mock_render_frames, mock_frame_cache, mock_video_encoder, mock_frame_renderer, mock_git_repo):
+        mock_git_repo.return_value.count_commits.return_value = 1
+
+        main.main()
+
+        mock_frame_cache.assert_called_once_with('fake_cache', max_bytes=10 * 1024 * 1024)
+        self.assertIs(mock_render_frames.call_args.kwargs['frame_cache'], mock_frame_cache.return_value)
+
+    @patch('sys.argv', ['src/main.py', '--clear-cache', '--cache-dir', 'fake_cache'])
+    @patch('src.main.GitRepo')
+    @patch('src.main.FrameCache')
+    def test_main_clear_cache_only(self, mock_frame_cache, mock_git_repo):
+        main.main()
+
+        mock_frame_cache.return_value.clear.assert_called_once()
+        mock_git_repo.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import tempfile
+import shutil
+import os
+from src.metrics import MetricsRegistry, Counter, Gauge, Histogram, directory_size, process_rss_bytes
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_render_text_format(self):
+        registry = MetricsRegistry()
+        requests = registry.register(Counter('requests_total', 'Requests.', labels=('code',)))
+        registry.register(Gauge('queue_depth', 'Queued "jobs".', lambda: 3))
+        registry.register(Gauge('missing', 'Left out.', lambda: None))
+        requests.inc(code=200)
+        requests.inc(2, code=200)
+        requests.inc(code='a"b')
+
+        self.assertEqual(registry.render(), (
+            '# HELP requests_total Requests.\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{code="200"} 3\n'
+            'requests_total{code="a\\"b"} 1\n'
+            '# HELP queue_depth Queued "jobs".\n'
+            '# TYPE queue_depth gauge\n'
+            'queue_depth 3\n'))
+        self.assertEqual(requests.value(code=200), 3)
+        with self.assertRaises(ValueError):
+            requests.inc(-1, code=200)
+        with self.assertRaises(ValueError):
+            registry.register(Counter('requests_total', 'Again.'))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('duration_seconds', 'Durations.', (0.25, 1))
+        histogram.observe_many([0.125, 0.25, 0.5, 2])
+        histogram.observe(0.0625)
+
+        self.assertEqual(histogram.samples(), [
+            ('_bucket', {'le': '0.25'}, 3),
+            ('_bucket', {'le': '1.0'}, 4),
+            ('_bucket', {'le': '+Inf'}, 5),
+            ('_sum', {}, 2.9375),
+            ('_count', {}, 5),
+        ])
+        with self.assertRaises(ValueError):
+            Histogram('bad_seconds', 'Unsorted.', (1, 0.1))
+
+    def test_directory_size(self):
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        os.makedirs(os.path.join(test_dir, 'nested'))
+        for name, size in (('a.mp4', 100), (os.path.join('nested', 'b.gif'), 50)):
+            with open(os.path.join(test_dir, name), 'wb') as f:
+                f.write(b'x' * size)
+
+        self.assertEqual(directory_size(test_dir), 150)
+        self.assertEqual(directory_size(os.path.join(test_dir, 'missing')), 0)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), "Needs /proc")
+    def test_process_rss_bytes(self):
+        self.assertGreater(process_rss_bytes(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+import unittest
+import tempfile
+import shutil
+import os
+from git import Repo
+from PIL import Image
+from src.git_utils import GitRepo
+from src.frame_renderer import FrameRenderer
+from src.parallel_renderer import render_frames, resolve_jobs, RenderStats
+from src.frame_cache import FrameCache
+from src.video_encoder import HeldFrame
+
+def frame_image(frame):
+    """Returns a yielded frame (an Image, a path or a HeldFrame) as a whole RGB Image."""
+    if isinstance(frame, HeldFrame):
+        return frame.to_image()
+    if isinstance(frame, str):
+        with Image.open(frame) as image:
+            return image.convert('RGB')
+    return frame
+
+class TestResolveJobs(unittest.TestCase):
+    def test_integer_values(self):
+        self.assertEqual(resolve_jobs(4), 4)
+        self.assertEqual(resolve_jobs('3'), 3)
+        self.assertEqual(resolve_jobs(None), 1)
+
+    def test_auto(self):
+        self.assertEqual(resolve_jobs('auto'), os.cpu_count() or 1)
+
+    def test_invalid_values(self):
+        for value in ('0', '-2', 'many'):
+            with self.assertRaises(ValueError):
+                resolve_jobs(value)
+
+class TestRenderFrames(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.frame_dir = tempfile.mkdtemp()
+        self.repo = Repo.init(self.test_dir)
+        for i in range(4):
+            file_path = os.path.join(self.test_dir, f'file_{i}.txt')
+            with open(file_path, 'w') as f:
+                f.write(f'This is file {i}')
+            self.repo.index.add([file_path])
+            self.repo.index.commit(f'Commit {i}')
+        self.git_repo = GitRepo(self.test_dir)
+        self.renderer = FrameRenderer(320, 240)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        shutil.rmtree(self.frame_dir)
+
+    def test_serial_rendering_saves_frames_in_order(self):
+        history = self.git_repo.iter_commit_history()
+        results = list(render_frames(history, self.git_repo, self.renderer, frame_dir=self.frame_dir))
+
+        self.assertEqual([index for index, _, _ in results], [0, 1, 2, 3])
+        self.assertEqual(results[0][1]['message'], 'Commit 0')
+        for _, _, frame_path in results:
+            self.assertTrue(os.path.exists(frame_path))
+
+    def test_serial_rendering_without_frame_dir_yields_images(self):
+        history = self.git_repo.iter_commit_history()
+        results = list(render_frames(history, self.git_repo, self.renderer))
+        self.assertIsInstance(results[0][2], Image.Image)
+
+    def test_parallel_rendering_matches_serial_output(self):
+        serial = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer))
+        parallel = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer, jobs=2))
+
+        self.assertEqual([commit['sha'] for _, commit, _ in parallel],
+                         [commit['sha'] for _, commit, _ in serial])
+        for (_, _, expected), (_, _, actual) in zip(serial, parallel):
+            self.assertEqual(expected.tobytes(), actual.tobytes())
+
+    def test_incremental_rendering_matches_full_rendering(self):
+        expected = [frame.tobytes() for _, _, frame in
+                    render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer)]
+        for jobs in (1, 2):
+            results = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                         jobs=jobs, incremental=True))
+            self.assertEqual([frame.tobytes() for _, _, frame in results], expected)
+
+    def test_frame_cache_skips_rendering_on_rerun(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        frame_cache = FrameCache(cache_dir)
+
+        first_stats = RenderStats()
+        first = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                   stats=first_stats, frame_cache=frame_cache))
+        self.assertEqual(first_stats.frames_rendered, 4)
+        self.assertEqual(len(frame_cache), 4)
+
+        for jobs in (1, 2):
+            stats = RenderStats()
+            rerun = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                       frame_dir=self.frame_dir if jobs == 1 else None, jobs=jobs,
+                                       stats=stats, frame_cache=frame_cache))
+            self.assertEqual(stats.frames_rendered, 0)
+            self.assertEqual(stats.frames_cached, 4)
+            if jobs == 1:
+                with Image.open(rerun[2][2]) as image:
+                    self.assertEqual(image.tobytes(), first[2][2].tobytes())
+            else:
+                self.assertEqual(rerun[2][2].tobytes(), first[2][2].tobytes())
+
+class TestRenderFramesDedupe(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = Repo.init(self.test_dir)
+        # A file that fills the whole frame, so changes to files sorted after it are invisible.
+        # Every message has a descender, so the headers are all as high.
+        self._commit('a_long.txt', '\n'.join(f'line {i}' for i in range(200)), 'Add long file')
+        self._commit('z_hidden.txt', 'hidden 1', 'Add hiding file')
+        self._commit('z_hidden.txt', 'hidden 2', 'Change hiding file')
+        self._commit('a_long.txt', 'short now', 'Shorten long file')
+        self.git_repo = GitRepo(self.test_dir)
+        self.renderer = FrameRenderer(320, 240)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _commit(self, name, content, message):
+        file_path = os.path.join(self.test_dir, name)
+        with open(file_path, 'w') as f:
+            f.write(content)
+        self.repo.index.add([file_path])
+        self.repo.index.commit(message)
+
+    def _full_renders(self):
+        return [self.renderer.render_frame(commit, self.git_repo.get_file_tree_at_commit(commit['commit_obj']))
+                for commit in self.git_repo.get_commit_history()]
+
+    def _check_results(self, results, stats):
+        frames = [frame for _, _, frame in results]
+        self.assertEqual(len(frames), 4)
+        # Held frames show their own commit info over the previous frame's content
+        for frame, expected in zip(frames, self._full_renders()):
+            self.assertEqual(frame_image(frame).tobytes(), expected.tobytes())
+        self.assertNotEqual(frame_image(frames[1]).tobytes(), frames[0].tobytes())
+        # Only their headers are made, to be laid over the frame they repeat
+        for frame in frames[1:3]:
+            self.assertIsInstance(frame, HeldFrame)
+            self.assertIs(frame.base, frames[0])
+            self.assertEqual(frame.header.size, (320, self.renderer.header_overlay_height))
+        self.assertEqual(stats.frames_rendered, 2)
+        self.assertEqual(stats.frames_deduplicated, 2)
+
+    def test_serial_dedupe_reuses_previous_frame(self):
+        stats = RenderStats()
+        results = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                     dedupe=True, stats=stats))
+        self._check_results(results, stats)
+
+    def test_parallel_dedupe_reuses_previous_frame(self):
+        stats = RenderStats()
+        results = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                     jobs=2, dedupe=True, stats=stats))
+        self._check_results(results, stats)
+
+    def test_dedupe_saves_held_frames(self):
+        frame_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, frame_dir)
+        stats = RenderStats()
+        results = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                     frame_dir=frame_dir, dedupe=True, stats=stats))
+        frames = [frame for _, _, frame in results]
+        for frame, expected in zip(frames, self._full_renders()):
+            self.assertEqual(frame_image(frame).tobytes(), expected.tobytes())
+        # Held frames save their headers next to the frame they repeat
+        self.assertEqual([frames[1].base, frames[2].base], [frames[0], frames[0]])
+        self.assertEqual(len(os.listdir(frame_dir)), 4)
+        self.assertEqual(stats.frames_deduplicated, 2)
+
+    def test_held_frames_follow_the_header_height(self):
+        # Changes to a binary file are invisible; the header grows and shrinks with the message
+        class TallHeaderRenderer(FrameRenderer):
+            def _text_height(self, font, text):
+                return super()._text_height(font, text) + (10 if 'tall' in text else 0)
+        self._commit('data.bin', '\0a', 'Add data')
+        for message in ('Change data, tall', 'Change data', 'Change data again'):
+            self._commit('data.bin', f'\0{message}', message)
+        # Serial only: worker processes build plain FrameRenderers
+        renderer = TallHeaderRenderer(320, 320)
+        stats = RenderStats()
+        results = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, renderer,
+                                     dedupe=True, stats=stats))
+        for _, commit, frame in results[4:]:
+            expected = renderer.render_frame(commit, self.git_repo.get_file_tree_at_commit(commit['commit_obj']))
+            self.assertEqual(frame_image(frame).tobytes(), expected.tobytes())
+        self.assertEqual(stats.frames_deduplicated, 5)
+
+    def test_dedupe_with_frame_cache_caches_held_frames(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        frame_cache = FrameCache(cache_dir)
+        list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                           dedupe=True, frame_cache=frame_cache))
+        self.assertEqual(len(frame_cache), 4)
+
+        stats = RenderStats()
+        results = list(render_frames(self.git_repo.iter_commit_history(), self.git_repo, self.renderer,
+                                     dedupe=True, stats=stats, frame_cache=frame_cache))
+        for (_, _, frame), expected in zip(results, self._full_renders()):
+            self.assertEqual(frame.tobytes(), expected.tobytes())
+        self.assertEqual((stats.frames_rendered, stats.frames_cached, stats.frames_deduplicated), (0, 4, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import shutil
+import os
+from git import Repo
+from src.path_filter import PathFilter
+
+PATHS = [
+    'README.md',
+    'build.log',
+    'services/billing/api.py',
+    'services/billing/invoices/models.py',
+    'services/billing/invoices/debug.log',
+    'services/auth/login.py',
+    'docs/billing.md',
+    'docs/api/index.md',
+]
+
+class TestPathFilter(unittest.TestCase):
+    def test_matches_like_git_pathspecs(self):
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        repo = Repo.init(test_dir)
+        # One commit per file, so the commits git log selects tell which paths matched
+        for path in PATHS:
+            file_path = os.path.join(test_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as f:
+                f.write(path)
+            repo.index.add([path])
+            repo.index.commit(path)
+
+        cases = [
+            (['services/billing'], []),
+            (['services/billing/'], ['**/*.log']),
+            (['*.log'], []),
+            (['**/*.log'], []),
+            (['services/*/api.py'], []),
+            (['docs/**'], ['docs/api']),
+            (['services/b?lling/**/*.py'], []),
+            ([], ['services', 'README.md']),
+            (['[bR]*'], []),
+        ]
+        for include, exclude in cases:
+            path_filter = PathFilter(include, exclude)
+            expected = set(repo.git.log('--format=%s', '--', *path_filter.pathspecs()).splitlines())
+            actual = {path for path in PATHS if path_filter.matches(path)}
+            self.assertEqual(actual, expected, (include, exclude))
+
+    def test_may_contain_prunes_directories(self):
+        path_filter = PathFilter(['services/billing/**/*.py'], ['services/billing/legacy'])
+        self.assertTrue(path_filter.may_contain('services'))
+        self.assertTrue(path_filter.may_contain('services/billing'))
+        self.assertTrue(path_filter.may_contain('services/billing/invoices/deep'))
+        self.assertFalse(path_filter.may_contain('services/auth'))
+        self.assertFalse(path_filter.may_contain('docs'))
+        self.assertFalse(path_filter.may_contain('services/billing/legacy'))
+        self.assertFalse(path_filter.may_contain('services/billing/legacy/old'))
+
+    def test_wildcard_pattern_does_not_select_directory_content(self):
+        path_filter = PathFilter(['services/*'])
+        self.assertTrue(path_filter.matches('services/setup.py'))
+        self.assertFalse(path_filter.matches('services/billing/api.py'))
+        self.assertFalse(path_filter.may_contain('services/billing'))
+
+    def test_empty_pattern(self):
+        with self.assertRaises(ValueError):
+            PathFilter(['/'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import io
+import unittest
+from unittest.mock import MagicMock
+from PIL import Image
+from src.preview import PreviewCache, PREVIEW_FORMATS
+
+SETTINGS = {'width': 64, 'height': 32, 'bg_color': '#000000', 'text_color': '#FFFFFF', 'font_size': 15,
+            'no_email': False}
+
+class FakeRenderer:
+    def __init__(self, **settings):
+        self.settings = settings
+        self.frames = 0
+
+    def render_frame(self, commit_info, file_contents):
+        self.frames += 1
+        return Image.new('RGB', (self.settings['width'], self.settings['height']), self.settings['bg_color'])
+
+class TestPreviewCache(unittest.TestCase):
+    def setUp(self):
+        self.git_repo = MagicMock()
+        self.git_repo.path_filter = None
+        self.git_repo.get_file_tree_at_commit.return_value = {}
+        self.renderers = []
+        def factory(**settings):
+            renderer = FakeRenderer(**settings)
+            self.renderers.append(renderer)
+            return renderer
+        self.factory = factory
+
+    def commit(self, sha):
+        return {'sha': sha, 'commit_obj': sha}
+
+    def test_encodes_each_format(self):
+        cache = PreviewCache(self.factory)
+        for image_format, (pil_format, _, _) in PREVIEW_FORMATS.items():
+            data, _ = cache.get_image(self.git_repo, self.commit('a'), SETTINGS, image_format)
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual(image.format, pil_format)
+                self.assertEqual(image.size, (64, 32))
+        # One renderer served every format
+        self.assertEqual(len(self.renderers), 1)
+        with self.assertRaises(ValueError):
+            cache.get_image(self.git_repo, self.commit('a'), SETTINGS, 'bmp')
+
+    def test_hits_and_eviction(self):
+        cache = PreviewCache(self.factory, max_renderers=1)
+        first, etag = cache.get_image(self.git_repo, self.commit('a'), SETTINGS, 'png')
+        again, same_etag = cache.get_image(self.git_repo, self.commit('a'), SETTINGS, 'png')
+        self.assertEqual((first, etag), (again, same_etag))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(self.renderers[0].frames, 1)
+
+        # Another commit or other settings are new previews
+        _, other_etag = cache.get_image(self.git_repo, self.commit('b'), SETTINGS, 'png')
+        self.assertNotEqual(other_etag, etag)
+        cache.get_image(self.git_repo, self.commit('a'), dict(SETTINGS, bg_color='#FF0000'), 'png')
+        self.assertEqual(len(self.renderers), 2)
+        self.assertEqual(len(cache._renderers), 1)
+
+        # Images beyond the memory budget are evicted, least recently used first
+        cache = PreviewCache(self.factory, max_bytes=len(first) + 1)
+        cache.get_image(self.git_repo, self.commit('a'), SETTINGS, 'png')
+        cache.get_image(self.git_repo, self.commit('b'), SETTINGS, 'png')
+        self.assertEqual(len(cache._images), 1)
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import tempfile
+import shutil
+import os
+import json
+import pickle
+from git import Repo
+from src.git_utils import GitRepo
+from src.frame_renderer import FrameRenderer
+from src.parallel_renderer import render_frames
+from src.profiling import PipelineProfile, profile_stage, profile_iterator
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestPipelineProfile(unittest.TestCase):
+    def test_summary_of_timed_stages(self):
+        clock = FakeClock()
+        profile = PipelineProfile(clock=clock)
+        for i in range(20):
+            with profile.stage('save_frame') as sample:
+                clock.now += 0.001 * (i + 1)
+                sample.byte_count = 100
+                sample.frames = 1
+        profile.record('commit_history', 0.5)
+
+        summary = profile.to_dict()
+        self.assertEqual(list(summary['stages']), ['commit_history', 'save_frame'])
+        save = summary['stages']['save_frame']
+        self.assertEqual(save['count'], 20)
+        self.assertAlmostEqual(save['total_s'], 0.21)
+        self.assertAlmostEqual(save['mean_ms'], 10.5)
+        self.assertAlmostEqual(save['p95_ms'], 19.0)
+        self.assertEqual((save['bytes'], save['frames']), (2000, 20))
+        self.assertAlmostEqual(summary['wall_s'], 0.21)
+
+        clock.now += 1
+        profile.stop()
+        clock.now += 1
+        self.assertAlmostEqual(profile.to_dict()['wall_s'], 1.21)
+
+    def test_drain_and_merge(self):
+        worker = PipelineProfile()
+        worker.record('render_frame', 0.25, frames=1)
+        worker.record('render_frame', 0.75, frames=1)
+        drained = pickle.loads(pickle.dumps(worker.drain()))
+        self.assertEqual(worker.drain(), {})
+
+        profile = PipelineProfile()
+        profile.record('render_frame', 0.5, frames=1)
+        profile.merge(drained)
+        stage = profile.to_dict()['stages']['render_frame']
+        self.assertEqual((stage['count'], stage['frames']), (3, 3))
+        self.assertAlmostEqual(stage['total_s'], 1.5)
+        self.assertAlmostEqual(stage['p95_ms'], 750)
+
+    def test_helpers_without_profile(self):
+        with profile_stage(None, 'encode') as sample:
+            sample.frames = 1
+        self.assertEqual(list(profile_iterator(iter([1, 2]), None, 'file_tree')), [1, 2])
+
+        profile = PipelineProfile()
+        self.assertEqual(list(profile_iterator(iter([1, 2]), profile, 'file_tree')), [1, 2])
+        self.assertEqual(profile.to_dict()['stages']['file_tree']['count'], 2)
+
+class TestPipelineProfiling(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.frame_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.addCleanup(shutil.rmtree, self.frame_dir)
+        repo = Repo.init(self.test_dir)
+        for i in range(3):
+            with open(os.path.join(self.test_dir, f'file_{i}.txt'), 'w') as f:
+                f.write(f'This is file {i}')
+            repo.index.add([f'file_{i}.txt'])
+            repo.index.commit(f'Commit {i}')
+        self.renderer = FrameRenderer(320, 240)
+
+    def check_stages(self, profile):
+        stages = profile.to_dict()['stages']
+        for name in ('commit_history', 'file_tree', 'read_blob', 'render_frame', 'save_frame'):
+            self.assertIn(name, stages)
+        self.assertEqual(stages['commit_history']['count'], 3)
+        self.assertEqual(stages['render_frame']['frames'], 3)
+        self.assertGreater(stages['save_frame']['bytes'], 0)
+        return stages
+
+    def test_serial_render_records_stages(self):
+        profile = PipelineProfile()
+        git_repo = GitRepo(self.test_dir, profile=profile)
+        list(render_frames(git_repo.iter_commit_history(), git_repo, self.renderer,
+                           frame_dir=self.frame_dir, profile=profile))
+        stages = self.check_stages(profile)
+        # Each file is read once; worker processes have blob caches of their own
+        self.assertEqual(stages['read_blob']['bytes'], len(b'This is file 0') * 3)
+
+        path = os.path.join(self.frame_dir, 'profile.json')
+        profile.write(path)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['stages']['render_frame']['count'], 3)
+
+    def test_parallel_render_merges_worker_stages(self):
+        profile = PipelineProfile()
+        git_repo = GitRepo(self.test_dir, profile=profile)
+        list(render_frames(git_repo.iter_commit_history(), git_repo, self.renderer,
+                           frame_dir=self.frame_dir, jobs=2, profile=profile))
+        self.check_stages(profile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import tempfile
+import shutil
+import os
+import threading
+from git import Repo
+from src.git_utils import GitRepo
+from src.path_filter import PathFilter
+from src.repo_pool import RepoPool
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class TestRepoPool(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        repo = Repo.init(self.test_dir)
+        for i in range(2):
+            with open(os.path.join(self.test_dir, f'file_{i}.txt'), 'w') as f:
+                f.write(f'This is file {i}')
+            repo.index.add([f'file_{i}.txt'])
+            repo.index.commit(f'Commit {i}')
+        self.clock = FakeClock()
+        self.opened = []
+        def factory(repo_path, **shared):
+            git_repo = GitRepo(repo_path, **shared)
+            self.opened.append(git_repo)
+            return git_repo
+        self.pool = RepoPool(factory, idle_timeout=60, clock=self.clock)
+        self.addCleanup(self.pool.close)
+
+    def test_handles_are_reused_and_share_caches(self):
+        with self.pool.repo(self.test_dir, PathFilter(['file_1.txt'])) as git_repo:
+            self.assertEqual(len(git_repo.get_commit_history()), 1)
+        # The same repository through another path gets the same handle, without the filter
+        with self.pool.repo(os.path.join(self.test_dir, '.')) as again:
+            self.assertIs(again, git_repo)
+            self.assertIsNone(again.path_filter)
+            self.assertEqual(len(again.get_commit_history()), 2)
+
+        # Handles checked out at the same time are distinct but share the caches
+        first = self.pool.acquire(self.test_dir)
+        second = self.pool.acquire(self.test_dir)
+        self.assertIsNot(first, second)
+        self.assertIs(first.blob_cache, second.blob_cache)
+        self.assertIs(first.repo_index, second.repo_index)
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertEqual(len(self.opened), 2)
+        self.assertEqual(self.pool.idle_count, 2)
+
+    def test_idle_handles_are_closed(self):
+        with self.pool.repo(self.test_dir) as git_repo:
+            dict(git_repo.get_file_tree_at_commit(git_repo.get_latest_commit()['commit_obj']))
+        # Reading blobs started a persistent git cat-file process
+        self.assertIsNotNone(git_repo.repo.git.cat_file_all)
+
+        self.clock.now = 30
+        self.assertEqual(self.pool.evict_idle(), 0)
+        self.clock.now = 61
+        self.assertEqual(self.pool.evict_idle(), 1)
+        self.assertIsNone(git_repo.repo.git.cat_file_all)
+        self.assertEqual(self.pool.idle_count, 0)
+        with self.pool.repo(self.test_dir) as new_repo:
+            self.assertIsNot(new_repo, git_repo)
+
+    def test_concurrent_requests(self):
+        errors = []
+        def work():
+            try:
+                for _ in range(5):
+                    with self.pool.repo(self.test_dir) as git_repo:
+                        self.assertEqual(len(git_repo.get_commit_history()), 2)
+                        self.assertEqual(len(dict(git_repo.get_file_tree_at_commit(
+                            git_repo.get_latest_commit()['commit_obj']))), 2)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(self.opened), 4)
+
+    def test_invalid_repository(self):
+        not_a_repo = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, not_a_repo)
+        with self.assertRaises(ValueError):
+            self.pool.acquire(not_a_repo)
+        with self.assertRaises(FileNotFoundError):
+            self.pool.acquire('/path/to/nonexistent/repo')
+
+if __name__ == '__main__':
+    unittest.main()
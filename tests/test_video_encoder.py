@@ -1,15 +1,23 @@
 import unittest
+import subprocess
+import threading
 from unittest.mock import patch, MagicMock
 import os
 import tempfile
 import shutil
 from PIL import Image
-from src.video_encoder import VideoEncoder
+from src.video_encoder import VideoEncoder, HeldFrame, SEGMENT_GOP_FRAMES, GIF_PALETTE_SAMPLE_FRAMES, \
+    active_ffmpeg_processes, save_header
 
 # This check is to make the test suite runnable in environments where ffmpeg is not installed.
 # The actual check is inside the VideoEncoder class itself.
 FFMPEG_INSTALLED = shutil.which("ffmpeg") is not None
 
+
+class Cancelled(Exception):
+    """Raised by the cancel checks of the tests."""
+
+
 class TestVideoEncoder(unittest.TestCase):
     def setUp(self):
         self.test_dir = tempfile.mkdtemp()
@@ -49,29 +57,422 @@ class TestVideoEncoder(unittest.TestCase):
     def test_build_ffmpeg_command_gif(self):
         output_path = os.path.join(self.test_dir, 'output.gif')
         encoder = VideoEncoder(output_path, frame_rate=10, format='gif')
-        command = encoder._build_ffmpeg_command('list.txt')
-        self.assertIn('palettegen', command[-2]) # filter_complex is the second to last element
+        command = encoder._build_ffmpeg_command('list.txt', palette_path='palette.png')
+        self.assertIn('paletteuse', command[-2]) # filter_complex is the second to last element
         self.assertIn(output_path, command)
         self.assertIn('10', command)
+        with self.assertRaises(ValueError):
+            encoder._build_ffmpeg_command('list.txt')
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     @patch('src.video_encoder.VideoEncoder.is_ffmpeg_installed', return_value=True)
-    def test_create_video_from_frames_mocked(self, mock_is_installed, mock_run):
+    def test_create_video_from_frames_mocked(self, mock_is_installed, mock_popen):
         output_path = os.path.join(self.test_dir, 'output.mp4')
         encoder = VideoEncoder(output_path, format='mp4')
 
-        mock_result = MagicMock()
-        mock_result.stdout = "ffmpeg output"
-        mock_result.stderr = ""
-        mock_run.return_value = mock_result
+        mock_popen.return_value = self._ffmpeg_process(stdout="ffmpeg output")
 
         encoder.create_video_from_frames(self.frame_paths)
 
-        mock_run.assert_called_once()
-        args, kwargs = mock_run.call_args
+        mock_popen.assert_called_once()
+        args, kwargs = mock_popen.call_args
         command = args[0]
         self.assertEqual(command[-1], output_path)
 
+    def test_create_video_from_frames_holds_repeated_frames(self):
+        output_path = os.path.join(self.test_dir, 'output.mp4')
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(output_path, frame_rate=2, format='mp4')
+
+        lists = []
+        def read_list(command, **kwargs):
+            with open(command[command.index('-i') + 1]) as f:
+                lists.append(f.read())
+            return self._ffmpeg_process()
+
+        paths = [self.frame_paths[0], self.frame_paths[0], self.frame_paths[0], self.frame_paths[1]]
+        with patch('subprocess.Popen', side_effect=read_list):
+            encoder.create_video_from_frames(paths)
+
+        entries = lists[0].splitlines()
+        self.assertEqual(entries[0], f"file '{self.frame_paths[0]}'")
+        self.assertEqual(entries[1], 'duration 1.500000')
+        self.assertEqual(entries[2], f"file '{self.frame_paths[1]}'")
+        self.assertEqual(entries[3], 'duration 0.500000')
+        self.assertEqual(entries[4], f"file '{self.frame_paths[1]}'")
+
+    def _held_frames(self):
+        """Returns frames with two HeldFrames of the first frame, whose headers are saved in the test directory."""
+        header_paths = []
+        for i in range(2):
+            header_paths.append(os.path.join(self.test_dir, f'header_{i}.png'))
+            save_header(Image.new('RGB', (100, 20), color=(255, i * 255, 0)), header_paths[-1])
+        return [self.frame_paths[0], HeldFrame(self.frame_paths[0], header_paths[0]),
+                HeldFrame(self.frame_paths[0], header_paths[1]), self.frame_paths[1]], header_paths
+
+    def test_create_video_from_frames_overlays_held_headers(self):
+        output_path = os.path.join(self.test_dir, 'output.mp4')
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(output_path, frame_rate=2, format='mp4')
+
+        commands, lists = [], []
+        def read_lists(command, **kwargs):
+            commands.append(command)
+            for i, arg in enumerate(command):
+                if arg == '-i':
+                    with open(command[i + 1]) as f:
+                        lists.append(f.read().splitlines())
+            return self._ffmpeg_process()
+
+        frames, header_paths = self._held_frames()
+        with patch('subprocess.Popen', side_effect=read_lists):
+            encoder.create_video_from_frames(frames)
+
+        frame_list, header_list = lists
+        # The base of the held frames is read once and held on screen
+        self.assertEqual(frame_list[:4], [f"file '{self.frame_paths[0]}'", 'duration 1.500000',
+                                          f"file '{self.frame_paths[1]}'", 'duration 0.500000'])
+        no_header = header_list[0]
+        self.assertEqual(header_list[2:8], [f"file '{header_paths[0]}'", 'duration 0.500000',
+                                            f"file '{header_paths[1]}'", 'duration 0.500000',
+                                            no_header, 'duration 0.500000'])
+        command = commands[0]
+        self.assertIn('overlay', command[command.index('-filter_complex') + 1])
+        self.assertEqual(command[command.index('-frames:v') + 1], '4')
+        self.assertFalse(os.path.exists(no_header[len("file '"):-1]))
+
+    def test_frame_lists_set_the_frame_rate_above_the_image_demuxer_rate(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'), frame_rate=30)
+        list_filepath = encoder._write_frame_list(self.frame_paths[:1] * 2, os.path.join(self.test_dir, 'list.txt'),
+                                                  with_durations=True)
+        with open(list_filepath) as f:
+            self.assertEqual(f.read().count('option framerate 30\n'), 2)
+
+    def test_create_gif_from_frames_with_sampled_palette(self):
+        output_path = os.path.join(self.test_dir, 'output.gif')
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(output_path, frame_rate=2, format='gif')
+
+        commands, lists = [], {}
+        paths = [os.path.join(self.test_dir, f'frame_{i // 2:03d}.png') for i in range(200)]
+        with patch('subprocess.Popen', side_effect=self._fake_ffmpeg(commands, lists)):
+            encoder.create_video_from_frames(paths)
+
+        palette_command, encode_command = commands
+        palette_path = palette_command[-1]
+        self.assertIn('palettegen', palette_command[palette_command.index('-vf') + 1])
+        sample = lists[palette_path].splitlines()
+        self.assertEqual(len(sample), GIF_PALETTE_SAMPLE_FRAMES)
+        self.assertEqual(len(set(sample)), GIF_PALETTE_SAMPLE_FRAMES)
+        self.assertEqual(sample[0], f"file '{paths[0]}'")
+
+        # The video is encoded in one pass with the finished palette as input 0
+        self.assertEqual(encode_command[encode_command.index('-i') + 1], palette_path)
+        self.assertEqual(encode_command[encode_command.index('-filter_complex') + 1], '[1:v][0:v] paletteuse')
+        self.assertEqual(encode_command[-1], output_path)
+        self.assertFalse(os.path.exists(os.path.dirname(palette_path)))
+
+    def test_stream_gif_makes_palette_from_whole_video(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.gif'), format='gif')
+
+        count = GIF_PALETTE_SAMPLE_FRAMES * 3
+        distinct = [Image.new('RGB', (10, 10), color=(i, i, i)) for i in range(count)]
+        # Every frame is held for a second frame, once with a header of its own
+        frames = [frame for frame in distinct for _ in range(2)]
+        frames[3] = HeldFrame(frames[3], Image.new('RGB', (10, 4), color=(255, 0, 0)))
+        commands, lists, saved = [], {}, []
+        fake_ffmpeg = self._fake_ffmpeg(commands, lists)
+        def start_ffmpeg(command, **kwargs):
+            # Nothing is encoded before the last frame came in
+            self.assertEqual(len(sent), len(frames))
+            if not commands:
+                saved.extend(name for name in os.listdir(encoder._gif_frame_dir) if name.endswith('.png'))
+            return fake_ffmpeg(command, **kwargs)
+        sent = []
+        with patch('subprocess.Popen', side_effect=start_ffmpeg):
+            encoder.create_video_from_stream((sent.append(frame) or frame for frame in frames), 10, 10)
+
+        # Each distinct frame is saved once, and the header of the held frame on its own
+        self.assertEqual(len(saved), count + 1)
+        palette_command, encode_command = commands
+        sample = lists[palette_command[-1]].splitlines()
+        self.assertEqual(len(sample), GIF_PALETTE_SAMPLE_FRAMES)
+        # The palette sample is spread over the whole video
+        self.assertTrue(sample[-1].endswith(f"frame_{(count - 3) * 2:05d}.png'"))
+        self.assertIn('overlay', encode_command[encode_command.index('-filter_complex') + 1])
+        self.assertEqual(encode_command[encode_command.index('-frames:v') + 1], str(len(frames)))
+        self.assertIsNone(encoder._gif_frame_dir)
+
+    def test_stream_gif_without_frames(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.gif'), format='gif')
+        with patch('subprocess.Popen') as mock_popen:
+            encoder.create_video_from_stream([], 10, 10)
+        mock_popen.assert_not_called()
+        self.assertIsNone(encoder._gif_frame_dir)
+
+    def test_split_segments_on_gop_boundaries(self):
+        frames = [f'frame_{i}.png' for i in range(SEGMENT_GOP_FRAMES * 5 + 10)]
+        chunks = VideoEncoder._split_segments(frames, 3)
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [SEGMENT_GOP_FRAMES * 2, SEGMENT_GOP_FRAMES * 2, SEGMENT_GOP_FRAMES + 10])
+        self.assertEqual(sum(chunks, []), frames)
+        # Never more chunks than GOPs
+        self.assertEqual(len(VideoEncoder._split_segments(frames[:SEGMENT_GOP_FRAMES + 1], 8)), 2)
+
+    def test_create_video_from_segments_mocked(self):
+        output_path = os.path.join(self.test_dir, 'output.mp4')
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(output_path, frame_rate=2, format='mp4')
+
+        commands, lists = [], {}
+        paths = [self.frame_paths[i % 3] for i in range(SEGMENT_GOP_FRAMES * 2 + 1)]
+        with patch('subprocess.Popen', side_effect=self._fake_ffmpeg(commands, lists)):
+            encoder.create_video_from_segments(paths, 4, jobs=2)
+
+        *segment_commands, join_command = commands
+        self.assertEqual(len(segment_commands), 3)
+        for command in segment_commands:
+            self.assertIn('libx264', command)
+            self.assertEqual(command[command.index('-g') + 1], str(SEGMENT_GOP_FRAMES))
+            self.assertEqual(command[command.index('-f', command.index('-i')) + 1], 'mpegts')
+        segment_paths = sorted(command[-1] for command in segment_commands)
+        self.assertEqual(lists[segment_paths[2]].count('file'), 1)
+
+        # The segments are joined in order without re-encoding
+        self.assertEqual(join_command[join_command.index('-c') + 1], 'copy')
+        self.assertEqual(join_command[-1], output_path)
+        finished_paths = [path[:-len('.partial')] for path in segment_paths]
+        self.assertEqual(lists[output_path].splitlines(), [
+            f"file '{finished_paths[0]}'", 'duration 125.000000',
+            f"file '{finished_paths[1]}'", 'duration 125.000000',
+            f"file '{finished_paths[2]}'", 'duration 0.500000',
+        ])
+        # Segments are encoded in a temporary directory that is removed afterwards
+        self.assertFalse(os.path.exists(os.path.dirname(segment_paths[0])))
+
+    def test_create_video_from_segments_reuses_finished_segments(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'), frame_rate=2, format='mp4')
+        segment_dir = os.path.join(self.test_dir, 'segments')
+        paths = [self.frame_paths[i % 3] for i in range(SEGMENT_GOP_FRAMES * 2)]
+
+        commands = []
+        with patch('subprocess.Popen', side_effect=self._fake_ffmpeg(commands, {})):
+            encoder.create_video_from_segments(paths, 2, segment_dir=segment_dir)
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(len(os.listdir(segment_dir)), 3)  # two segments and the join list
+
+        # Only the segment whose frames changed is encoded again
+        paths[SEGMENT_GOP_FRAMES:] = [self.frame_paths[1]] * SEGMENT_GOP_FRAMES
+        commands.clear()
+        with patch('subprocess.Popen', side_effect=self._fake_ffmpeg(commands, {})):
+            encoder.create_video_from_segments(paths, 2, segment_dir=segment_dir)
+        self.assertEqual(len(commands), 2)
+        # Touching a frame file invalidates the segments it is part of
+        os.utime(self.frame_paths[1], ns=(0, 0))
+        commands.clear()
+        with patch('subprocess.Popen', side_effect=self._fake_ffmpeg(commands, {})):
+            encoder.create_video_from_segments(paths, 2, segment_dir=segment_dir)
+        self.assertEqual(len(commands), 3)
+        commands.clear()
+        with patch('subprocess.Popen', side_effect=self._fake_ffmpeg(commands, {})):
+            encoder.create_video_from_segments(paths, 2, segment_dir=segment_dir)
+        self.assertEqual(len(commands), 1)
+        self.assertEqual(len(os.listdir(segment_dir)), 3)
+
+    @classmethod
+    def _fake_ffmpeg(cls, commands, lists):
+        """Returns a subprocess.Popen stand-in that records FFmpeg commands and writes their outputs."""
+        def run(command, **kwargs):
+            commands.append(command)
+            with open(command[command.index('-i') + 1]) as f:
+                lists[command[-1]] = f.read()
+            with open(command[-1], 'wb') as f:
+                f.write(b'video')
+            return cls._ffmpeg_process()
+        return run
+
+    @staticmethod
+    def _ffmpeg_process(stdout='', stderr='', returncode=0):
+        """Returns a stand-in for an FFmpeg process that has already exited."""
+        process = MagicMock(returncode=returncode)
+        process.communicate.return_value = (stdout, stderr)
+        return process
+
+    def test_cancel_kills_running_ffmpeg(self):
+        cancelled = threading.Event()
+        def check_cancelled():
+            if cancelled.is_set():
+                raise Cancelled()
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'), cancel_check=check_cancelled)
+
+        process = self._ffmpeg_process()
+        polls = []
+        def communicate(timeout=None):
+            # Still encoding; the job is cancelled after the first poll
+            polls.append(timeout)
+            if len(polls) == 2:
+                cancelled.set()
+            raise subprocess.TimeoutExpired('ffmpeg', timeout)
+        process.communicate.side_effect = communicate
+        with patch('subprocess.Popen', return_value=process):
+            with self.assertRaises(Cancelled):
+                encoder.create_video_from_frames(self.frame_paths)
+
+        self.assertEqual(len(polls), 2)
+        self.assertTrue(all(timeout is not None for timeout in polls))
+        process.kill.assert_called_once()
+        process.wait.assert_called_once()
+        self.assertEqual(active_ffmpeg_processes(), 0)
+
+        # Cancelled before FFmpeg starts: it is not started at all
+        with patch('subprocess.Popen') as mock_popen:
+            with self.assertRaises(Cancelled):
+                encoder.create_video_from_segments(self.frame_paths * SEGMENT_GOP_FRAMES, 2)
+        mock_popen.assert_not_called()
+
+    def test_cancel_kills_stream_while_finishing(self):
+        cancelled = threading.Event()
+        def check_cancelled():
+            if cancelled.is_set():
+                raise Cancelled()
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'), cancel_check=check_cancelled)
+
+        with patch('subprocess.Popen') as mock_popen:
+            process = mock_popen.return_value
+            process.stderr.read.return_value = b''
+            def wait(timeout=None):
+                if process.kill.called:
+                    return -9
+                cancelled.set()
+                raise subprocess.TimeoutExpired('ffmpeg', timeout)
+            process.wait.side_effect = wait
+            with self.assertRaises(Cancelled):
+                encoder.create_video_from_stream([Image.new('RGB', (100, 100))], 100, 100)
+
+        process.kill.assert_called_once()
+        self.assertEqual(active_ffmpeg_processes(), 0)
+
+    def test_create_video_from_segments_single_pass_for_gif(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.gif'), format='gif')
+        with patch.object(encoder, 'create_video_from_frames') as single_pass:
+            encoder.create_video_from_segments(self.frame_paths * 200, 4)
+        single_pass.assert_called_once_with(self.frame_paths * 200)
+
+    def test_stream_repeats_held_frame_buffer(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'))
+
+        frame = MagicMock(size=(100, 100), mode='RGB')
+        frame.tobytes.return_value = b'rgb'
+        with patch('subprocess.Popen') as mock_popen:
+            process = mock_popen.return_value
+            process.stderr.read.return_value = b''
+            process.wait.return_value = 0
+            encoder.create_video_from_stream([frame, frame, frame], 100, 100)
+
+        self.assertEqual(process.stdin.write.call_count, 3)
+        frame.tobytes.assert_called_once()
+
+    def test_stream_lays_held_headers_over_their_base(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'))
+
+        base = Image.new('RGB', (100, 100), color=(10, 20, 30))
+        header = Image.new('RGB', (100, 20), color=(255, 0, 0))
+        expected = base.copy()
+        expected.paste(header, (0, 0))
+        with patch('subprocess.Popen') as mock_popen:
+            process = mock_popen.return_value
+            process.stderr.read.return_value = b''
+            process.wait.return_value = 0
+            encoder.create_video_from_stream([base, HeldFrame(base, header)], 100, 100)
+            with self.assertRaises(ValueError):
+                encoder.create_video_from_stream([HeldFrame(base, Image.new('RGB', (50, 20)))], 100, 100)
+
+        writes = [call.args[0] for call in process.stdin.write.call_args_list]
+        self.assertEqual(writes, [base.tobytes(), expected.tobytes()])
+
+    def test_build_ffmpeg_stream_command(self):
+        output_path = os.path.join(self.test_dir, 'output.mp4')
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(output_path, frame_rate=15, format='mp4')
+        command = encoder._build_ffmpeg_stream_command(100, 80)
+        self.assertEqual(command[command.index('-f') + 1], 'rawvideo')
+        self.assertEqual(command[command.index('-s') + 1], '100x80')
+        self.assertEqual(command[command.index('-i') + 1], '-')
+        self.assertIn('libx264', command)
+        self.assertEqual(command[-1], output_path)
+
+    def test_create_video_from_stream_mocked(self):
+        output_path = os.path.join(self.test_dir, 'output.mp4')
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(output_path, format='mp4')
+
+        frames = [Image.new('RGB', (100, 100), color=(i, i, i)) for i in range(3)]
+        running = []
+        with patch('subprocess.Popen') as mock_popen:
+            process = mock_popen.return_value
+            process.stderr.read.return_value = b''
+            process.wait.return_value = 0
+            encoder.create_video_from_stream(
+                (running.append(active_ffmpeg_processes()) or frame for frame in frames), 100, 100)
+
+        # FFmpeg is counted as running from the first frame until it exits
+        self.assertEqual(running, [1, 1, 1])
+        self.assertEqual(active_ffmpeg_processes(), 0)
+
+        self.assertEqual(process.stdin.write.call_count, 3)
+        self.assertEqual(process.stdin.write.call_args_list[0].args[0], frames[0].tobytes())
+        process.stdin.close.assert_called_once()
+
+    def test_create_video_from_stream_rejects_wrong_size(self):
+        with patch.object(VideoEncoder, 'is_ffmpeg_installed', return_value=True):
+            encoder = VideoEncoder(os.path.join(self.test_dir, 'output.mp4'))
+
+        with patch('subprocess.Popen') as mock_popen:
+            process = mock_popen.return_value
+            process.stderr.read.return_value = b''
+            with self.assertRaises(ValueError):
+                encoder.create_video_from_stream([Image.new('RGB', (50, 50))], 100, 100)
+        # The FFmpeg process is killed when rendering fails
+        process.kill.assert_called_once()
+
+    @unittest.skipUnless(FFMPEG_INSTALLED, "FFmpeg is not installed, skipping FFmpeg-dependent tests.")
+    def test_create_video_from_stream_integration(self):
+        output_path = os.path.join(self.test_dir, 'output.mp4')
+        encoder = VideoEncoder(output_path, frame_rate=1, format='mp4')
+
+        frames = [Image.open(path) for path in self.frame_paths]
+        encoder.create_video_from_stream(frames, 100, 100)
+
+        self.assertTrue(os.path.exists(output_path))
+        self.assertGreater(os.path.getsize(output_path), 0)
+
+    @unittest.skipUnless(FFMPEG_INSTALLED, "FFmpeg is not installed, skipping FFmpeg-dependent tests.")
+    def test_create_video_with_held_frames_integration(self):
+        frames, _ = self._held_frames()
+        for frame_rate in (10, 30):
+            output_path = os.path.join(self.test_dir, f'output_{frame_rate}.mp4')
+            VideoEncoder(output_path, frame_rate=frame_rate, format='mp4').create_video_from_frames(frames)
+
+            decoded = subprocess.run(['ffmpeg', '-v', 'error', '-i', output_path, '-f', 'rawvideo',
+                                      '-pix_fmt', 'rgb24', '-'], capture_output=True, check=True).stdout
+            size = 100 * 100 * 3
+            self.assertEqual(len(decoded), len(frames) * size)
+            for i, frame in enumerate(frames):
+                expected = frame.to_image() if isinstance(frame, HeldFrame) else Image.open(frame).convert('RGB')
+                actual = Image.frombytes('RGB', (100, 100), decoded[i * size:(i + 1) * size])
+                for xy in ((50, 10), (50, 80)):
+                    for got, want in zip(actual.getpixel(xy), expected.getpixel(xy)):
+                        self.assertAlmostEqual(got, want, delta=12, msg=f"{frame_rate} fps, frame {i} at {xy}")
+
     @unittest.skipUnless(FFMPEG_INSTALLED, "FFmpeg is not installed, skipping FFmpeg-dependent tests.")
     def test_create_video_integration(self):
         output_path = os.path.join(self.test_dir, 'output.mp4')
@@ -5,6 +5,7 @@ import sys
 import time
 import shutil
 import tempfile
+import threading
 from unittest.mock import MagicMock, patch
 
 # Add parent directory to path so we can import src
@@ -16,7 +17,14 @@ sys.modules['src.frame_renderer'] = MagicMock()
 sys.modules['src.video_encoder'] = MagicMock()
 
 # Import the app after mocking
-from src.web_app import app, jobs, TimelapseJob
+from src.web_app import (app, get_job_store, TimelapseJob, get_preview_cache, get_repo_pool, resume_interrupted_jobs,
+                         record_job_metrics, save_job, generate_timelapse_worker)
+from src.job_scheduler import JobScheduler
+from src.profiling import PipelineProfile
+
+# The job history is kept in the upload folder
+app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+jobs = get_job_store()
 
 class WebAppTestCase(unittest.TestCase):
     def setUp(self):
@@ -24,6 +32,8 @@ class WebAppTestCase(unittest.TestCase):
         self.app.testing = True
         # Reset jobs
         jobs.clear()
+        get_preview_cache().clear()
+        get_repo_pool().close()
 
     def test_index_route(self):
         response = self.app.get('/')
@@ -54,6 +64,8 @@ class WebAppTestCase(unittest.TestCase):
                 job = jobs[job_id]
                 self.assertEqual(job.options['width'], 800)
                 self.assertEqual(job.options['height'], 600)
+                # The frame cache writes every frame to disk, so it is only used on request
+                self.assertFalse(job.options['use_cache'])
 
     def test_generate_invalid_custom_resolution(self):
         with patch('os.path.exists', return_value=True):
@@ -75,24 +87,243 @@ class WebAppTestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(len(data['jobs']), 1)
         self.assertEqual(data['jobs'][0]['id'], 'test_job')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_jobs_pages(self):
+        for i in range(3):
+            job = TimelapseJob(f'job_{i}', '/path', {'format': 'mp4'})
+            job.created_at = i
+            jobs[job.job_id] = job
+
+        data = json.loads(self.app.get('/api/jobs?limit=2').data)
+        self.assertEqual([job['id'] for job in data['jobs']], ['job_2', 'job_1'])
+        data = json.loads(self.app.get('/api/jobs', query_string={'limit': 2, 'cursor': data['next_cursor']}).data)
+        self.assertEqual([job['id'] for job in data['jobs']], ['job_0'])
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(self.app.get('/api/jobs?cursor=bad').status_code, 400)
+
+    def _read_events(self, response):
+        return [json.loads(chunk[len('data: '):]) for chunk in response.get_data(as_text=True).split('\n\n')
+                if chunk.startswith('data: ')]
+
+    def test_status_stream_of_finished_job(self):
+        job = TimelapseJob('done_job', '/path', {'format': 'mp4'})
+        job.status = 'completed'
+        job.progress = 100
+        jobs['done_job'] = job
+
+        response = self.app.get('/api/status/done_job/stream')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = self._read_events(response)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['status'], 'completed')
+        self.assertEqual(self.app.get('/api/status/unknown/stream').status_code, 404)
+
+    def test_status_reports_stage_timings(self):
+        job = TimelapseJob('timed_job', '/path', {'format': 'mp4'})
+        jobs['timed_job'] = job
+        self.assertIsNone(json.loads(self.app.get('/api/status/timed_job').data)['profile'])
+
+        job.profile = PipelineProfile()
+        job.profile.record('render_frame', 0.25, frames=1)
+        profile = json.loads(self.app.get('/api/status/timed_job').data)['profile']
+        self.assertEqual(profile['stages']['render_frame']['count'], 1)
+        self.assertEqual(profile['stages']['render_frame']['frames'], 1)
+
+    def test_metrics_endpoint(self):
+        for job_id, status in (('queued_job', 'queued'), ('done_job', 'completed')):
+            job = TimelapseJob(job_id, '/path', {'format': 'mp4'})
+            job.status = status
+            jobs[job_id] = job
+        profile = PipelineProfile()
+        profile.record('render_frame', 0.02, frames=1)
+        profile.record('render_frame', 0.2, frames=1)
+        profile.record('read_blob', 0.001, byte_count=1234)
+        profile.record('encode', 3.0)
+        record_job_metrics(profile)
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        samples = dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                       if not line.startswith('#'))
+        self.assertEqual(samples['chronoscope_jobs{state="queued"}'], '1')
+        self.assertEqual(samples['chronoscope_jobs{state="completed"}'], '1')
+        self.assertEqual(samples['chronoscope_jobs{state="running"}'], '0')
+        self.assertGreaterEqual(int(samples['chronoscope_frame_render_seconds_count']), 2)
+        self.assertGreaterEqual(int(samples['chronoscope_git_read_bytes_total']), 1234)
+        self.assertGreaterEqual(int(samples['chronoscope_job_encode_seconds_count']), 1)
+        for name in ('chronoscope_job_queue_depth', 'chronoscope_frames_rendered_total',
+                     'chronoscope_upload_folder_bytes', 'chronoscope_ffmpeg_processes'):
+            self.assertIn(name, samples)
+
+    def test_status_stream_coalesces_updates(self):
+        job = TimelapseJob('busy_job', '/path', {'format': 'mp4'})
+        job.status = 'running'
+        jobs['busy_job'] = job
+
+        def work():
+            for i in range(200):
+                job.progress = i // 2
+                time.sleep(0.001)
+            job.status = 'completed'
+
+        worker = threading.Thread(target=work)
+        with patch.dict(app.config, {'STATUS_STREAM_INTERVAL': 0.05}):
+            worker.start()
+            events = self._read_events(self.app.get('/api/status/busy_job/stream'))
+        worker.join()
+
+        self.assertEqual(events[-1]['status'], 'completed')
+        self.assertLess(len(events), 50)
+        progress = [event['progress'] for event in events]
+        self.assertEqual(progress, sorted(progress))
+
+    def test_cancel_queued_job(self):
+        release = threading.Event()
+        scheduler = JobScheduler(lambda job: release.wait(5), max_workers=1)
+        self.addCleanup(release.set)
+        running = TimelapseJob('running_job', '/path', {'format': 'mp4'})
+        queued = TimelapseJob('queued_job', '/path', {'format': 'mp4'})
+        jobs['running_job'] = running
+        jobs['queued_job'] = queued
+
+        with patch('src.web_app.get_scheduler', return_value=scheduler):
+            scheduler.submit(running)
+            while scheduler.running_count == 0:
+                time.sleep(0.01)
+            scheduler.submit(queued)
+            response = self.app.get('/api/status/queued_job')
+            data = json.loads(response.data)
+            self.assertEqual(data['status'], 'queued')
+            self.assertEqual(data['queue_position'], 1)
+
+            response = self.app.post('/api/cancel/queued_job')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)['status'], 'cancelled')
+            self.assertEqual(queued.status, 'cancelled')
+
+            # Cancelling again, or an unknown job, fails
+            self.assertEqual(self.app.post('/api/cancel/queued_job').status_code, 409)
+            self.assertEqual(self.app.post('/api/cancel/unknown').status_code, 404)
+
+    @patch('src.web_app.VideoEncoder')
+    @patch('src.web_app.render_frames')
+    @patch('src.web_app.get_repo_pool')
+    def test_cancel_while_encoding(self, mock_get_repo_pool, mock_render_frames, MockVideoEncoder):
+        mock_get_repo_pool.return_value.acquire.return_value.count_commits.return_value = 1
+        mock_render_frames.side_effect = lambda *args, **kwargs: (frame for frame in [(0, {}, 'frame_00000.png')])
+        job = TimelapseJob('encoding_job', '/path', {'format': 'mp4', 'encoder': 'concat'})
+        jobs['encoding_job'] = job
+
+        def encode(frame_paths):
+            # The job is cancelled while FFmpeg runs, which polls the encoder's cancel check
+            self.assertEqual(job.message, 'Encoding video...')
+            job.cancel_requested.set()
+            MockVideoEncoder.call_args.kwargs['cancel_check']()
+            self.fail('The cancel check did not stop the encode')
+        MockVideoEncoder.return_value.create_video_from_frames.side_effect = encode
+
+        generate_timelapse_worker(job)
+
+        self.assertEqual((job.status, job.message), ('cancelled', 'Cancelled.'))
+        MockVideoEncoder.return_value.create_video_from_frames.assert_called_once_with(['frame_00000.png'])
+
+    def test_resumable_job_survives_restart(self):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        scheduler = MagicMock()
+        with patch.dict(app.config, {'JOB_STATE_DIR': state_dir}), \
+                patch('src.web_app.get_scheduler', return_value=scheduler):
+            with patch('os.path.exists', return_value=True):
+                response = self.app.post('/api/generate', json={
+                    'repo_path': '/valid/path', 'resumable': True, 'priority': 3})
+            job_id = json.loads(response.data)['job_id']
+            self.assertTrue(os.path.exists(os.path.join(state_dir, job_id, 'job.json')))
+
+            # After a restart the job is queued again under the same id
+            options = jobs[job_id].options
+            jobs.clear()
+            self.assertEqual(resume_interrupted_jobs(), 1)
+            job = jobs[job_id]
+            self.assertEqual((job.repo_path, job.options), ('/valid/path', options))
+            scheduler.submit.assert_called_with(job, priority=3)
+            # Jobs already known are not queued twice
+            self.assertEqual(resume_interrupted_jobs(), 0)
+
+            # A cancelled job is not resumed
+            scheduler.cancel.side_effect = lambda job: setattr(job, 'status', 'cancelled') or True
+            self.app.post(f'/api/cancel/{job_id}')
+            self.assertFalse(os.path.exists(os.path.join(state_dir, job_id)))
+
+    @patch('src.web_app.GitRepo')
+    def test_identical_requests_share_a_render(self, MockGitRepo):
+        MockGitRepo.return_value.get_branch_tip.return_value = 'a' * 40
+        scheduler = MagicMock()
+        request = {'repo_path': '/valid/path', 'branch': 'main', 'fps': 5}
+
+        def generate(**changes):
+            with patch('src.web_app.get_scheduler', return_value=scheduler), \
+                    patch('os.path.exists', return_value=True):
+                return json.loads(self.app.post('/api/generate', json=dict(request, **changes)).data)
+
+        first = generate()
+        # More render processes make the same video; another frame rate does not
+        attached = generate(jobs=2)
+        other = generate(fps=10)
+        self.assertEqual(scheduler.submit.call_count, 2)
+        self.assertEqual((attached['reuse'], attached['source_job_id']), ('attached', first['job_id']))
+        self.assertIsNone(other['reuse'])
+
+        source = jobs[first['job_id']]
+        source.status = 'running'
+        source.progress = 40
+        status = json.loads(self.app.get(f"/api/status/{attached['job_id']}").data)
+        self.assertEqual((status['status'], status['progress'], status['reuse']), ('running', 40, 'attached'))
+
+        # Cancelling an attached request leaves the render running for the others
+        leaving = generate()
+        self.assertEqual(self.app.post(f"/api/cancel/{leaving['job_id']}").status_code, 200)
+        self.assertEqual(source.followers, [jobs[attached['job_id']]])
+        self.assertEqual(self.app.post(f"/api/cancel/{first['job_id']}").status_code, 409)
+
+        # The attached request finishes with the render
+        source.output_path = os.path.join(app.config['UPLOAD_FOLDER'], 'shared.mp4')
+        with open(source.output_path, 'wb') as f:
+            f.write(b'video')
+        source.status = 'completed'
+        save_job(source)
+        self.assertEqual(jobs[attached['job_id']].status, 'completed')
+        self.assertEqual(jobs[attached['job_id']].output_path, source.output_path)
+
+        # Later requests get the finished video right away
+        cached = generate(encoder='segmented')
+        self.assertEqual((cached['reuse'], cached['source_job_id']), ('cached', first['job_id']))
+        self.assertEqual(scheduler.submit.call_count, 2)
+        status = json.loads(self.app.get(f"/api/status/{cached['job_id']}").data)
+        self.assertEqual((status['status'], status['has_output'], status['reuse']), ('completed', True, 'cached'))
+
+    def _mock_preview(self, MockFrameRenderer, MockGitRepo):
+        mock_repo = MockGitRepo.return_value
+        mock_repo.path_filter = None
+        mock_repo.get_latest_commit.return_value = {'sha': 'a' * 40, 'commit_obj': 'mock_obj'}
+        mock_repo.get_file_tree_at_commit.return_value = {}
+
+        # Mock FrameRenderer and render_frame
+        mock_renderer = MockFrameRenderer.return_value
+        mock_image = MagicMock()
+        # Mock save to write to BytesIO
+        def mock_save(fp, format, **options):
+            fp.write(b'fake_image_data')
+        mock_image.save.side_effect = mock_save
+        mock_renderer.render_frame.return_value = mock_image
+        return mock_repo, mock_renderer
 
     @patch('src.web_app.GitRepo')
     @patch('src.web_app.FrameRenderer')
     def test_preview_endpoint(self, MockFrameRenderer, MockGitRepo):
         with patch('os.path.exists', return_value=True):
-            # Mock GitRepo and history
-            mock_repo = MockGitRepo.return_value
-            mock_repo.get_commit_history.return_value = [{'commit_obj': 'mock_obj'}]
-            mock_repo.get_file_tree_at_commit.return_value = {}
-
-            # Mock FrameRenderer and render_frame
-            mock_renderer = MockFrameRenderer.return_value
-            mock_image = MagicMock()
-            # Mock save to write to BytesIO
-            def mock_save(fp, format):
-                fp.write(b'fake_image_data')
-            mock_image.save.side_effect = mock_save
-            mock_renderer.render_frame.return_value = mock_image
+            mock_repo, _ = self._mock_preview(MockFrameRenderer, MockGitRepo)
 
             response = self.app.post('/api/preview', json={
                 'repo_path': '/valid/path',
@@ -102,9 +333,45 @@ class WebAppTestCase(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             data = json.loads(response.data)
             self.assertIn('image', data)
+            # The handle goes back to the pool for the next request
+            self.assertEqual(get_repo_pool().idle_count, 1)
             # base64 of 'fake_image_data'
             # b'fake_image_data' -> ZmFrZV9pbWFnZV9kYXRh
             self.assertEqual(data['image'], 'ZmFrZV9pbWFnZV9kYXRh')
+            # Only the branch tip is resolved
+            mock_repo.get_commit_history.assert_not_called()
+
+    @patch('src.web_app.GitRepo')
+    @patch('src.web_app.FrameRenderer')
+    def test_preview_image_is_cached(self, MockFrameRenderer, MockGitRepo):
+        with patch('os.path.exists', return_value=True):
+            _, mock_renderer = self._mock_preview(MockFrameRenderer, MockGitRepo)
+            url = '/api/preview/image?repo_path=/valid/path&bg_color=%23000000'
+
+            accept = {'Accept': 'image/webp,*/*'}
+            response = self.app.get(url, headers=accept)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/webp')
+            self.assertEqual(response.data, b'fake_image_data')
+            etag = response.headers['ETag']
+
+            # Unchanged: 304 without rendering; a repeat without the ETag is served from the cache
+            response = self.app.get(url, headers=dict(accept, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.app.get(url, headers=accept).status_code, 200)
+            # Without an Accept header, PNG is sent
+            self.assertEqual(self.app.get(url).mimetype, 'image/png')
+            self.assertEqual(mock_renderer.render_frame.call_count, 2)
+            # The renderer is reused for other formats and the font is loaded once
+            response = self.app.get(url + '&image_format=jpeg')
+            self.assertEqual(response.mimetype, 'image/jpeg')
+            self.assertNotEqual(response.headers['ETag'], etag)
+            self.assertEqual(MockFrameRenderer.call_count, 1)
+
+            # A different color is a new preview
+            self.app.get('/api/preview/image?repo_path=/valid/path&bg_color=%23FFFFFF')
+            self.assertEqual(MockFrameRenderer.call_count, 2)
+            self.assertEqual(self.app.get(url + '&image_format=bmp').status_code, 400)
 
 if __name__ == '__main__':
     import sys